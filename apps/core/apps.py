@@ -0,0 +1,15 @@
+from django.apps import AppConfig
+
+
+class CoreConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'apps.core'
+
+    def ready(self):
+        from django.core.signals import request_finished
+        from .db.pool import export_pool_stats
+        from .signing import validate_settings
+
+        validate_settings()
+
+        request_finished.connect(export_pool_stats, dispatch_uid='core.export_pool_stats')
@@ -0,0 +1,234 @@
+"""
+apps/core/benchmarking.py
+
+Small micro-benchmark harness used by ``manage.py benchmark``.
+
+Benchmarks live in a ``benchmarks.py`` module inside each app and are
+registered with the ``@register`` decorator. Every benchmark runs a fixed
+number of timed iterations (``repeat``), each calling ``run()`` ``number``
+times, so results are comparable between runs and between machines that use
+the same baseline file.
+"""
+import gc
+import json
+import platform
+import statistics
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import django
+from django.apps import apps
+from django.core.management.base import CommandError
+from django.db import connection
+from django.utils.module_loading import autodiscover_modules
+
+_registry = {}
+
+
+def register(cls):
+    """Class decorator adding a Benchmark subclass to the registry."""
+    for params in cls.param_sets():
+        bench = cls(**params)
+        _registry[bench.full_name] = bench
+    return cls
+
+
+def discover():
+    """Import every installed app's ``benchmarks`` module and return the registry."""
+    autodiscover_modules('benchmarks')
+    return dict(sorted(_registry.items()))
+
+
+class Benchmark:
+    """
+    Base class for a single micro-benchmark.
+
+    Subclasses set ``name`` and implement ``run()``. ``setup()``/``teardown()``
+    run once around the whole benchmark, ``setup_iteration()`` runs untimed
+    before each timed iteration.
+
+    ``params`` maps a parameter name to the list of values to run with; one
+    benchmark is registered per parameter value. Override ``get_repeat()``
+    to use fewer iterations for expensive sizes. Values put in ``extra``
+    (e.g. response size in bytes) are reported alongside the timings.
+    """
+    name = None
+    params = {}
+    repeat = 10
+    number = 1
+    warmup = 1
+
+    def __init__(self, **params):
+        self.kwargs = params
+        self.extra = {}
+
+    @classmethod
+    def param_sets(cls):
+        if not cls.params:
+            return [{}]
+        (key, values), = cls.params.items()
+        return [{key: value} for value in values]
+
+    @property
+    def full_name(self):
+        if not self.kwargs:
+            return self.name
+        suffix = ','.join(f'{k}={v}' for k, v in self.kwargs.items())
+        return f'{self.name}[{suffix}]'
+
+    def get_repeat(self):
+        return self.repeat
+
+    def setup(self):
+        pass
+
+    def setup_iteration(self):
+        pass
+
+    def run(self):
+        raise NotImplementedError
+
+    def teardown(self):
+        pass
+
+
+def setup_database():
+    """
+    Create a fresh in-memory SQLite test database for the benchmark run.
+
+    Tables for unmanaged models (``managed = False``) are not created by
+    migrate, so they are created here from the model definitions, together
+    with their ``Meta.indexes`` (which create_model skips for unmanaged models).
+    Returns the original database name for ``teardown_database()``.
+    """
+    if connection.vendor != 'sqlite':
+        raise CommandError(
+            "Benchmarks run against in-memory SQLite; use "
+            "DJANGO_SETTINGS_MODULE=djangoMVP.settings.bench."
+        )
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    existing = set(connection.introspection.table_names())
+    with connection.schema_editor() as editor:
+        for model in apps.get_models():
+            if not model._meta.managed and model._meta.db_table not in existing:
+                editor.create_model(model)
+                for index in model._meta.indexes:
+                    editor.add_index(model, index)
+    return old_name
+
+
+def teardown_database(old_name):
+    connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+class _QueryCounter:
+    """Execute wrapper counting queries without the cost of capturing SQL."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def run_benchmark(bench):
+    """Run one benchmark and return a dict of timing statistics (per call, ns)."""
+    bench.setup()
+    try:
+        for _ in range(bench.warmup):
+            bench.setup_iteration()
+            for _ in range(bench.number):
+                bench.run()
+
+        timings = []
+        queries = 0
+        for _ in range(bench.get_repeat()):
+            bench.setup_iteration()
+            gc.collect()
+            gc.disable()
+            counter = _QueryCounter()
+            try:
+                with connection.execute_wrapper(counter):
+                    start = time.perf_counter_ns()
+                    for _ in range(bench.number):
+                        bench.run()
+                    elapsed = time.perf_counter_ns() - start
+            finally:
+                gc.enable()
+            timings.append(elapsed / bench.number)
+            queries = counter.count / bench.number
+    finally:
+        bench.teardown()
+
+    return {
+        'repeat': len(timings),
+        'number': bench.number,
+        'min_ns': min(timings),
+        'median_ns': statistics.median(timings),
+        'mean_ns': statistics.fmean(timings),
+        'stdev_ns': statistics.stdev(timings) if len(timings) > 1 else 0.0,
+        'queries': queries,
+        **bench.extra,
+    }
+
+
+def environment_info():
+    return {
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'platform': platform.platform(),
+        'database': connection.vendor,
+        'created_at': datetime.now(timezone.utc).isoformat(),
+    }
+
+
+def save_results(path, results):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    payload = {'environment': environment_info(), 'results': results}
+    path.write_text(json.dumps(payload, indent=2, sort_keys=True))
+
+
+def load_results(path):
+    return json.loads(Path(path).read_text())['results']
+
+
+def compare_results(baseline, candidate, threshold):
+    """
+    Compare two result dicts by median time.
+
+    Returns a list of ``(name, base_ns, new_ns, ratio, status)`` rows where
+    status is ``regression`` when the candidate is slower by more than
+    ``threshold`` (a fraction, e.g. 0.1 for 10%), ``improvement`` when faster
+    by more than the threshold, and ``ok`` otherwise.
+    """
+    rows = []
+    for name in sorted(set(baseline) | set(candidate)):
+        if name not in baseline or name not in candidate:
+            status = 'new' if name not in baseline else 'missing'
+            base = baseline.get(name, {}).get('median_ns')
+            new = candidate.get(name, {}).get('median_ns')
+            rows.append((name, base, new, None, status))
+            continue
+        base = baseline[name]['median_ns']
+        new = candidate[name]['median_ns']
+        ratio = new / base if base else float('inf')
+        if ratio > 1 + threshold:
+            status = 'regression'
+        elif ratio < 1 - threshold:
+            status = 'improvement'
+        else:
+            status = 'ok'
+        rows.append((name, base, new, ratio, status))
+    return rows
+
+
+def format_ns(value):
+    if value is None:
+        return '-'
+    for unit, scale in (('s', 1e9), ('ms', 1e6), ('us', 1e3)):
+        if value >= scale:
+            return f'{value / scale:.2f}{unit}'
+    return f'{value:.0f}ns'
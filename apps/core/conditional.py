@@ -0,0 +1,41 @@
+"""
+apps/core/conditional.py
+
+Conditional GET helpers for detail endpoints.
+
+The view looks up only the validators (ETag and Last-Modified) first and
+calls ``not_modified``; if the client's copy is current that returns a 304
+and the object is never loaded or serialized. Otherwise the view builds the
+full response and passes it through ``set_validators``::
+
+    validators = Service.get_validators(pk)
+    response = conditional.not_modified(request, *validators)
+    if response is None:
+        response = Response(...)
+    return conditional.set_validators(response, *validators)
+"""
+from calendar import timegm
+
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+
+def _timestamp(last_modified):
+    return timegm(last_modified.utctimetuple()) if last_modified is not None else None
+
+
+def not_modified(request, etag, last_modified):
+    """Return a 304 (or 412) response if the request's preconditions allow it, else None."""
+    response = get_conditional_response(request, etag=etag, last_modified=_timestamp(last_modified))
+    if response is not None:
+        set_validators(response, etag, last_modified)
+    return response
+
+
+def set_validators(response, etag, last_modified):
+    """Add ETag / Last-Modified and ask caches to revalidate before reuse."""
+    response.headers['ETag'] = etag
+    if last_modified is not None:
+        response.headers['Last-Modified'] = http_date(_timestamp(last_modified))
+    patch_cache_control(response, no_cache=True)
+    return response
@@ -0,0 +1,100 @@
+"""
+apps/core/db/operations.py
+
+Migration operations for schema changes to unmanaged models.
+
+Guideline and Trust map onto existing tables (``managed = False``), so the
+migration autodetector ignores their fields and indexes and the built-in
+operations skip them. These operations apply the change anyway: they update
+the migration state like their parents and run the DDL if the table exists
+and doesn't have the column or index yet. Where the table doesn't exist
+(test databases, which create unmanaged tables from the current models
+after migrating), they do nothing.
+"""
+from django.db import migrations, router
+from django.db.backends.base.schema import BaseDatabaseSchemaEditor
+
+
+def _applies(schema_editor, app_label, model):
+    # router.allow_migrate_model() would refuse because the model is unmanaged
+    return (
+        router.allow_migrate(schema_editor.connection.alias, app_label, model_name=model._meta.model_name)
+        and model._meta.db_table in schema_editor.connection.introspection.table_names()
+    )
+
+
+class AddUnmanagedField(migrations.AddField):
+    """AddField for an unmanaged model; new NOT NULL fields need a ``db_default``."""
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if not _applies(schema_editor, app_label, model):
+            return
+        field = model._meta.get_field(self.name)
+        with schema_editor.connection.cursor() as cursor:
+            columns = {
+                column.name
+                for column in schema_editor.connection.introspection.get_table_description(cursor, model._meta.db_table)
+            }
+        if field.column in columns:
+            return
+        # Always a plain ALTER TABLE ADD COLUMN: SQLite's editor would rebuild
+        # the table from the migration state, which doesn't describe the
+        # whole of an unmanaged table.
+        BaseDatabaseSchemaEditor.add_field(schema_editor, model, field)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        model = from_state.apps.get_model(app_label, self.model_name)
+        if _applies(schema_editor, app_label, model):
+            schema_editor.execute(
+                'ALTER TABLE %s DROP COLUMN %s' % (
+                    schema_editor.quote_name(model._meta.db_table),
+                    schema_editor.quote_name(model._meta.get_field(self.name).column),
+                )
+            )
+
+
+class AddUnmanagedIndex(migrations.AddIndex):
+    """
+    AddIndex for an unmanaged model; skipped if an index of that name exists.
+
+    With ``concurrently=True`` the index is built with CREATE INDEX
+    CONCURRENTLY on PostgreSQL so writes to a live table aren't blocked; the
+    migration must then set ``atomic = False``. With ``vendor`` the index is
+    only created on that database vendor (e.g. a PostgreSQL GIN index).
+    """
+
+    def __init__(self, model_name, index, concurrently=False, vendor=None):
+        super().__init__(model_name, index)
+        self.concurrently = concurrently
+        self.vendor = vendor
+
+    def deconstruct(self):
+        name, args, kwargs = super().deconstruct()
+        if self.concurrently:
+            kwargs['concurrently'] = True
+        if self.vendor:
+            kwargs['vendor'] = self.vendor
+        return name, args, kwargs
+
+    def _vendor_applies(self, schema_editor):
+        return self.vendor is None or schema_editor.connection.vendor == self.vendor
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if not self._vendor_applies(schema_editor) or not _applies(schema_editor, app_label, model):
+            return
+        with schema_editor.connection.cursor() as cursor:
+            constraints = schema_editor.connection.introspection.get_constraints(cursor, model._meta.db_table)
+        if self.index.name in constraints:
+            return
+        if self.concurrently and schema_editor.connection.vendor == 'postgresql':
+            schema_editor.add_index(model, self.index, concurrently=True)
+        else:
+            schema_editor.add_index(model, self.index)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        model = from_state.apps.get_model(app_label, self.model_name)
+        if self._vendor_applies(schema_editor) and _applies(schema_editor, app_label, model):
+            schema_editor.remove_index(model, self.index)
+
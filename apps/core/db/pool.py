@@ -0,0 +1,68 @@
+"""
+apps/core/db/pool.py
+
+Export psycopg connection pool statistics as Prometheus metrics.
+
+Django keeps one ``psycopg_pool.ConnectionPool`` per database alias and
+process. After a request finishes, the pool's counters are popped and added to
+Prometheus counters, at most once per ``POOL_STATS_INTERVAL`` seconds so the
+request path only pays for a timestamp check.
+"""
+import threading
+import time
+
+from django.db import connections
+from prometheus_client import Counter, Gauge
+
+POOL_STATS_INTERVAL = 5.0
+
+POOL_REQUESTS = Counter(
+    'db_pool_requests_total', 'Connections requested from the pool.', ['alias'])
+POOL_REQUESTS_QUEUED = Counter(
+    'db_pool_requests_queued_total', 'Connection requests that had to wait for a free connection.', ['alias'])
+POOL_WAIT_SECONDS = Counter(
+    'db_pool_wait_seconds_total', 'Total time spent waiting for a pooled connection.', ['alias'])
+POOL_ERRORS = Counter(
+    'db_pool_errors_total', 'Connection requests that failed, e.g. timed out waiting.', ['alias'])
+POOL_CONNECTIONS_LOST = Counter(
+    'db_pool_connections_lost_total', 'Pooled connections found broken by health checks.', ['alias'])
+POOL_SIZE = Gauge(
+    'db_pool_size', 'Open connections in the pool.', ['alias'], multiprocess_mode='livesum')
+POOL_IN_USE = Gauge(
+    'db_pool_in_use', 'Connections currently checked out of the pool.', ['alias'], multiprocess_mode='livesum')
+POOL_MAX_SIZE = Gauge(
+    'db_pool_max_size', 'Configured maximum pool size (saturation = in_use / max_size).', ['alias'],
+    multiprocess_mode='livesum')
+
+_last_export = 0.0
+_lock = threading.Lock()
+
+
+def pools():
+    """Yield ``(alias, pool)`` for every database alias with pooling enabled."""
+    for alias in connections:
+        pool = getattr(connections[alias], 'pool', None)
+        if pool is not None:
+            yield alias, pool
+
+
+def export_pool_stats(**kwargs):
+    """``request_finished`` receiver updating the pool metrics."""
+    global _last_export
+    now = time.monotonic()
+    if now - _last_export < POOL_STATS_INTERVAL or not _lock.acquire(blocking=False):
+        return
+    try:
+        _last_export = now
+        for alias, pool in pools():
+            stats = pool.pop_stats()
+            POOL_REQUESTS.labels(alias).inc(stats.get('requests_num', 0))
+            POOL_REQUESTS_QUEUED.labels(alias).inc(stats.get('requests_queued', 0))
+            POOL_WAIT_SECONDS.labels(alias).inc(stats.get('requests_wait_ms', 0) / 1000)
+            POOL_ERRORS.labels(alias).inc(stats.get('requests_errors', 0))
+            POOL_CONNECTIONS_LOST.labels(alias).inc(stats.get('connections_lost', 0))
+            POOL_SIZE.labels(alias).set(stats['pool_size'])
+            POOL_IN_USE.labels(alias).set(stats['pool_size'] - stats['pool_available'])
+            POOL_MAX_SIZE.labels(alias).set(stats['pool_max'])
+    finally:
+        _lock.release()
@@ -0,0 +1,154 @@
+"""
+apps/core/db/router.py
+
+Primary/replica database router with read-your-writes stickiness.
+
+Reads of models in ``REPLICA_READ_APPS`` go to a healthy replica from
+``DATABASE_REPLICAS``; everything else, and every write, goes to ``default``.
+Once a request writes, the rest of that request reads from the primary and
+``ReplicaPinningMiddleware`` sets a short-lived cookie so the same client
+keeps reading from the primary for ``REPLICA_STICKY_SECONDS``, long enough
+for replication to catch up.
+
+Writes of ``REPLICA_UNPINNED_MODELS`` (view analytics, history rows) don't
+pin: a GET that happens to flush the view buffer must not send its reader to
+the primary. Outside a request (management commands, background threads)
+there is no routing state and writes pin nothing.
+"""
+import itertools
+import logging
+import threading
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from apps.core import metrics
+
+logger = logging.getLogger(__name__)
+
+PIN_COOKIE_NAME = 'db_primary_pin'
+
+
+class _RoutingState:
+    __slots__ = ('pinned', 'wrote')
+
+    def __init__(self, pinned=False):
+        self.pinned = pinned
+        self.wrote = False
+
+
+_state = ContextVar('db_routing_state', default=None)
+
+
+def begin_request(pinned):
+    """Start routing state for a request; returns a token for ``end_request``."""
+    return _state.set(_RoutingState(pinned))
+
+
+def end_request(token):
+    """Reset the routing state, returning True if the request wrote to the primary."""
+    state = _state.get()
+    _state.reset(token)
+    return state is not None and state.wrote
+
+
+def pin_to_primary():
+    """Mark the current request as having written; a no-op outside a request."""
+    state = _state.get()
+    if state is not None:
+        state.pinned = True
+        state.wrote = True
+
+
+def is_pinned():
+    state = _state.get()
+    return state is not None and state.pinned
+
+
+class ReplicaHealth:
+    """
+    Cached per-process health status of replica aliases.
+
+    A replica is probed with ``SELECT 1`` at most every
+    ``REPLICA_HEALTH_CHECK_INTERVAL`` seconds; while a probe is failing the
+    replica is skipped and reads fall back to the primary.
+    """
+
+    def __init__(self):
+        self._checked = {}
+        self._healthy = {}
+        self._lock = threading.Lock()
+
+    def is_healthy(self, alias):
+        interval = getattr(settings, 'REPLICA_HEALTH_CHECK_INTERVAL', 10)
+        now = time.monotonic()
+        if now - self._checked.get(alias, float('-inf')) < interval:
+            return self._healthy.get(alias, True)
+        if not self._lock.acquire(blocking=False):
+            # Another thread is probing; use the last known status meanwhile
+            return self._healthy.get(alias, True)
+        try:
+            self._checked[alias] = now
+            self._healthy[alias] = self._probe(alias)
+        finally:
+            self._lock.release()
+        return self._healthy[alias]
+
+    def _probe(self, alias):
+        try:
+            with connections[alias].cursor() as cursor:
+                cursor.execute('SELECT 1')
+            return True
+        except Exception:
+            logger.warning("Replica %s failed its health check; reading from primary", alias, exc_info=True)
+            metrics.DB_REPLICA_HEALTH_FAILURES.labels(alias).inc()
+            connections[alias].close()
+            return False
+
+
+health = ReplicaHealth()
+
+
+class PrimaryReplicaRouter:
+    """Route reads of selected apps to replicas and everything else to the primary."""
+
+    def __init__(self):
+        self.replicas = list(getattr(settings, 'DATABASE_REPLICAS', []))
+        self.read_apps = set(getattr(settings, 'REPLICA_READ_APPS', []))
+        self.unpinned_models = {label.lower() for label in getattr(settings, 'REPLICA_UNPINNED_MODELS', [])}
+        self._cycle = itertools.cycle(self.replicas) if self.replicas else None
+
+    def db_for_read(self, model, **hints):
+        if not self.replicas or model._meta.app_label not in self.read_apps:
+            return None
+        if is_pinned() or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            alias = DEFAULT_DB_ALIAS
+        else:
+            alias = self._pick_replica()
+        metrics.DB_READS_ROUTED.labels(alias).inc()
+        return alias
+
+    def _pick_replica(self):
+        for _ in range(len(self.replicas)):
+            alias = next(self._cycle)
+            if health.is_healthy(alias):
+                return alias
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        if self.replicas and model._meta.label_lower not in self.unpinned_models:
+            pin_to_primary()
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *self.replicas}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in self.replicas:
+            return False
+        return None
@@ -0,0 +1,173 @@
+"""
+apps/core/filecache.py
+
+Read-through LRU cache of remote objects on local disk.
+
+Entries are plain files named by the SHA-256 of their key, so a cached
+object can be served straight from disk (``sendfile``). A hit bumps the
+file's mtime, which is the LRU clock; when a new entry pushes the total size
+over ``max_bytes`` the least recently used files are deleted down to 90% of
+the limit. Files being served while evicted stay readable until closed.
+
+Concurrent misses for the same key are coalesced: threads of one process
+wait on a per-key lock and worker processes on an ``flock``'d lock file, so
+only one of them fetches the object and the others find it on disk.
+"""
+import hashlib
+import logging
+import os
+import threading
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+from prometheus_client import Counter
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not on Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+FILE_CACHE_EVENTS = Counter(
+    'file_cache_events_total',
+    'Disk cache lookups by cache and result (hit, miss, coalesced).',
+    ['cache', 'result'],
+)
+FILE_CACHE_EVICTIONS = Counter(
+    'file_cache_evictions_total',
+    'Files evicted from a disk cache to stay under its size limit.',
+    ['cache'],
+)
+
+LOCK_STRIPES = 256
+
+
+class DiskLRUCache:
+    """Size-bounded LRU cache of files under ``directory``."""
+
+    def __init__(self, name, directory, max_bytes):
+        self.name = name
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        self._evict_lock = threading.Lock()
+
+    def entry_name(self, key):
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def path_for(self, key):
+        return self.directory / f'{self.entry_name(key)}.bin'
+
+    def get(self, key):
+        """Return the cached path for ``key`` or None, marking it recently used."""
+        path = self.path_for(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def get_or_fetch(self, key, fetch):
+        """
+        Return the local path of ``key``, calling ``fetch(fileobj)`` on a miss.
+
+        ``fetch`` writes the object to the given binary file; exceptions it
+        raises (e.g. FileNotFoundError) propagate and nothing is cached.
+        """
+        path = self.get(key)
+        if path is not None:
+            FILE_CACHE_EVENTS.labels(self.name, 'hit').inc()
+            return path
+        with self._key_lock(key), self._process_lock(key):
+            path = self.get(key)
+            if path is not None:
+                FILE_CACHE_EVENTS.labels(self.name, 'coalesced').inc()
+                return path
+            FILE_CACHE_EVENTS.labels(self.name, 'miss').inc()
+            path = self.path_for(key)
+            tmp = path.with_name(f'{path.stem}.{uuid.uuid4().hex}.tmp')
+            try:
+                with open(tmp, 'wb') as out:
+                    fetch(out)
+                os.replace(tmp, path)
+            finally:
+                tmp.unlink(missing_ok=True)
+        self.evict()
+        return path
+
+    @contextmanager
+    def _key_lock(self, key):
+        with self._locks_guard:
+            lock, users = self._locks.get(key, (None, 0))
+            if lock is None:
+                lock = threading.Lock()
+            self._locks[key] = (lock, users + 1)
+        try:
+            with lock:
+                yield
+        finally:
+            with self._locks_guard:
+                lock, users = self._locks[key]
+                if users == 1:
+                    del self._locks[key]
+                else:
+                    self._locks[key] = (lock, users - 1)
+
+    @contextmanager
+    def _process_lock(self, key):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        if fcntl is None:
+            yield
+            return
+        # A fixed set of lock files (never deleted) shared by all workers
+        stripe = int(self.entry_name(key)[:4], 16) % LOCK_STRIPES
+        lock_dir = self.directory / 'locks'
+        lock_dir.mkdir(exist_ok=True)
+        with open(lock_dir / f'{stripe:03d}.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def size(self):
+        return sum(entry.stat().st_size for entry in self._entries())
+
+    def _entries(self):
+        try:
+            with os.scandir(self.directory) as it:
+                return [entry for entry in it if entry.name.endswith('.bin') and entry.is_file()]
+        except FileNotFoundError:
+            return []
+
+    def evict(self):
+        """Delete least recently used entries until the cache is under its limit."""
+        if not self._evict_lock.acquire(blocking=False):
+            return
+        try:
+            entries = []
+            total = 0
+            for entry in self._entries():
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+            if total <= self.max_bytes:
+                return
+            target = self.max_bytes * 0.9
+            for _, size, path in sorted(entries):
+                if total <= target:
+                    break
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    continue
+                total -= size
+                FILE_CACHE_EVICTIONS.labels(self.name).inc()
+        finally:
+            self._evict_lock.release()
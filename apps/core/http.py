@@ -0,0 +1,115 @@
+"""
+apps/core/http.py
+
+Serving local files with HTTP Range support.
+
+``file_response`` answers full and single-range requests with a
+``FileResponse``. Under gunicorn the open file is handed to
+``wsgi.file_wrapper``, which sends it with ``sendfile()`` (zero-copy) from
+the current offset for ``Content-Length`` bytes, so a range costs a seek.
+Without a file wrapper (runserver, tests) ``RangeFile`` bounds the reads.
+"""
+import os
+import re
+
+from django.http import FileResponse, HttpResponse
+from django.utils.cache import patch_cache_control
+
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(header, size):
+    """
+    Parse a ``Range`` header into an inclusive ``(start, end)`` byte range.
+
+    Returns None when the whole file should be sent: no header, a malformed
+    or invalid one (e.g. ``bytes=5-3``), or multiple ranges (which the spec
+    allows a server to ignore). Raises RangeNotSatisfiable if the range lies
+    outside the file.
+    """
+    if not header:
+        return None
+    match = _RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0 or size == 0:
+            raise RangeNotSatisfiable
+        return max(size - length, 0), size - 1
+    start = int(first)
+    if last and int(last) < start:
+        # An invalid range-spec (RFC 9110 14.1.1): ignore the header
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable
+    return start, min(int(last), size - 1) if last else size - 1
+
+
+class RangeFile:
+    """Read-only view of ``length`` bytes of an open file starting at ``start``."""
+
+    def __init__(self, file, start, length):
+        self.file = file
+        self.remaining = length
+        file.seek(start)
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def file_response(request, path, content_type, etag=None, filename=None, cache_control=None):
+    """
+    Return a 200/206/416 response for the file at ``path``.
+
+    ``If-Range`` is honoured with ``etag``: a stale validator gets the full
+    file. ``cache_control`` is a dict passed to ``patch_cache_control``.
+    """
+    size = os.path.getsize(path)
+    byte_range = None
+    if_range = request.headers.get('If-Range')
+    if not if_range or (etag and if_range == etag):
+        try:
+            byte_range = parse_range(request.headers.get('Range'), size)
+        except RangeNotSatisfiable:
+            response = HttpResponse(status=416)
+            response.headers['Content-Range'] = f'bytes */{size}'
+            return response
+
+    file = open(path, 'rb')
+    if byte_range is None:
+        response = FileResponse(file, content_type=content_type)
+        response.headers['Content-Length'] = str(size)
+    else:
+        start, end = byte_range
+        response = FileResponse(RangeFile(file, start, end - start + 1), status=206, content_type=content_type)
+        response.headers['Content-Length'] = str(end - start + 1)
+        response.headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+    response.headers['Accept-Ranges'] = 'bytes'
+    if etag:
+        response.headers['ETag'] = etag
+    if filename:
+        response.headers['Content-Disposition'] = f'inline; filename="{filename}"'
+    if cache_control:
+        patch_cache_control(response, **cache_control)
+    return response
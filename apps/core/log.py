@@ -0,0 +1,178 @@
+"""
+apps/core/log.py
+
+Logging building blocks used by the LOGGING setting.
+
+- ``QueueListenerHandler`` hands records to a background thread, so request
+  threads never block on stdout or any other log I/O.
+- ``JSONFormatter`` emits one JSON object per line, including the request id
+  and any ``extra=`` fields, with credentials redacted.
+- ``RequestContextFilter`` attaches the current request id (set by
+  ``apps.core.middleware.RequestIdMiddleware``).
+- ``SamplingFilter`` keeps only a fraction of DEBUG/INFO records for noisy loggers.
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import re
+import traceback
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+request_id_var = ContextVar('request_id', default=None)
+
+REDACTED = '[redacted]'
+SENSITIVE_HEADERS = {
+    'authorization',
+    'cookie',
+    'set-cookie',
+    'proxy-authorization',
+    'x-csrftoken',
+    'x-profile-token',
+}
+# JWTs and other long bearer-like secrets that end up inside messages
+_TOKEN_RE = re.compile(r'eyJ[\w-]+\.[\w-]+\.[\w-]+')
+
+# Attributes every LogRecord has; anything else was passed through ``extra=``
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+
+def redact_headers(headers):
+    """Return a plain dict of ``headers`` with credential-bearing values replaced."""
+    return {
+        name: REDACTED if name.lower() in SENSITIVE_HEADERS else value
+        for name, value in dict(headers).items()
+    }
+
+
+def scrub(text):
+    """Replace JWT-looking tokens in free text."""
+    return _TOKEN_RE.sub(REDACTED, text)
+
+
+class RequestContextFilter(logging.Filter):
+    """Attach ``record.request_id`` from the current request context."""
+
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keep a fraction of DEBUG/INFO records per logger.
+
+    ``rates`` maps a logger name (matching the logger and its children) to the
+    fraction of records to keep, e.g. ``{'apps.guidelines.views': 0.01}``, or
+    the same as a string: ``"apps.guidelines.views=0.01,apps.users=0.1"``.
+    WARNING and above always pass.
+    """
+
+    def __init__(self, rates=None):
+        super().__init__()
+        self.rates = parse_sample_rates(rates) if isinstance(rates, str) else dict(rates or {})
+        self._cache = {}
+
+    def rate_for(self, name):
+        try:
+            return self._cache[name]
+        except KeyError:
+            pass
+        rate = 1.0
+        best = -1
+        for prefix, value in self.rates.items():
+            if (name == prefix or name.startswith(prefix + '.')) and len(prefix) > best:
+                rate, best = value, len(prefix)
+        self._cache[name] = rate
+        return rate
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or not self.rates:
+            return True
+        rate = self.rate_for(record.name)
+        return rate >= 1.0 or random.random() < rate
+
+
+def parse_sample_rates(value):
+    """Parse ``"logger.a=0.1,logger.b=0.01"`` into a dict."""
+    rates = {}
+    for item in filter(None, (part.strip() for part in (value or '').split(','))):
+        name, _, rate = item.partition('=')
+        rates[name.strip()] = float(rate)
+    return rates
+
+
+class JSONFormatter(logging.Formatter):
+    """Format records as single-line JSON objects."""
+
+    def format(self, record):
+        payload = {
+            'timestamp': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': scrub(record.getMessage()),
+            'request_id': getattr(record, 'request_id', None),
+        }
+        for key, value in record.__dict__.items():
+            if key in _RECORD_ATTRS or key in payload:
+                continue
+            if key == 'headers' and isinstance(value, dict):
+                value = redact_headers(value)
+            payload[key] = value
+        if record.exc_info:
+            payload['exc_info'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            payload['exc_info'] = record.exc_text
+        if record.stack_info:
+            payload['stack_info'] = record.stack_info
+        return json.dumps(payload, default=str)
+
+
+class QueueListenerHandler(QueueHandler):
+    """
+    QueueHandler that owns a QueueListener writing to ``stream``.
+
+    The calling thread only merges the message arguments and renders any
+    traceback (both must happen while the objects are still alive); JSON
+    formatting and the write happen on the listener thread. The listener is
+    restarted in forked children (gunicorn workers) and flushed at exit.
+    """
+
+    def __init__(self, stream=None, maxsize=10000):
+        super().__init__(queue.Queue(maxsize=maxsize))
+        self.target = logging.StreamHandler(stream)
+        self.listener = QueueListener(self.queue, self.target, respect_handler_level=False)
+        self.listener.start()
+        atexit.register(self.listener.stop)
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._restart_listener)
+
+    def _restart_listener(self):
+        self.queue = queue.Queue(maxsize=self.queue.maxsize)
+        self.listener = QueueListener(self.queue, self.target, respect_handler_level=False)
+        self.listener.start()
+        atexit.register(self.listener.stop)
+
+    def setFormatter(self, fmt):
+        # The formatter is applied by the target on the listener thread
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = ''.join(traceback.format_exception(*record.exc_info)).rstrip()
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # Never block the request thread on a slow log consumer
+            pass
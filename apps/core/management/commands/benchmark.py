@@ -0,0 +1,117 @@
+"""
+Run the micro-benchmark suite and compare results against a saved baseline.
+
+Examples:
+    DJANGO_SETTINGS_MODULE=djangoMVP.settings.bench python manage.py benchmark run --save main
+    DJANGO_SETTINGS_MODULE=djangoMVP.settings.bench python manage.py benchmark run --save feature
+    python manage.py benchmark compare main feature --threshold 0.1
+"""
+import fnmatch
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.core import benchmarking
+
+
+class Command(BaseCommand):
+    help = "Run micro-benchmarks against in-memory SQLite and compare saved baselines."
+
+    def add_arguments(self, parser):
+        sub = parser.add_subparsers(dest='subcommand', required=True)
+
+        run = sub.add_parser('run', help='Run the benchmark suite.')
+        run.add_argument('-k', '--filter', action='append', default=[],
+                         help='Only run benchmarks matching this glob (repeatable).')
+        run.add_argument('--save', metavar='NAME',
+                         help='Save results as a baseline with this name (or path ending in .json).')
+        run.add_argument('--compare', metavar='NAME',
+                         help='Compare the results with an existing baseline.')
+        run.add_argument('--threshold', type=float, default=0.10,
+                         help='Relative slowdown flagged as a regression (default 0.10).')
+        run.add_argument('--list', action='store_true', help='List benchmarks and exit.')
+
+        compare = sub.add_parser('compare', help='Compare two saved baselines.')
+        compare.add_argument('baseline')
+        compare.add_argument('candidate')
+        compare.add_argument('--threshold', type=float, default=0.10)
+
+    def handle(self, *args, **options):
+        if options['subcommand'] == 'run':
+            return self.handle_run(**options)
+        return self.handle_compare(**options)
+
+    def baseline_path(self, name):
+        if name.endswith('.json'):
+            return Path(name)
+        directory = getattr(settings, 'BENCHMARK_BASELINE_DIR', Path(settings.BASE_DIR) / 'benchmarks')
+        return Path(directory) / f'{name}.json'
+
+    def handle_run(self, **options):
+        benches = benchmarking.discover()
+        if options['filter']:
+            benches = {
+                name: bench for name, bench in benches.items()
+                if any(fnmatch.fnmatch(name, pattern) for pattern in options['filter'])
+            }
+        if options['list']:
+            for name in benches:
+                self.stdout.write(name)
+            return
+        if not benches:
+            raise CommandError('No benchmarks matched.')
+
+        old_name = benchmarking.setup_database()
+        results = {}
+        try:
+            for name, bench in benches.items():
+                stats = benchmarking.run_benchmark(bench)
+                results[name] = stats
+                self.stdout.write(
+                    f"{name:<60} median {benchmarking.format_ns(stats['median_ns']):>10} "
+                    f"min {benchmarking.format_ns(stats['min_ns']):>10} "
+                    f"± {benchmarking.format_ns(stats['stdev_ns']):>9} "
+                    f"queries {stats['queries']:g}"
+                    + ''.join(f" {key} {value}" for key, value in bench.extra.items())
+                )
+        finally:
+            benchmarking.teardown_database(old_name)
+
+        if options['save']:
+            path = self.baseline_path(options['save'])
+            benchmarking.save_results(path, results)
+            self.stdout.write(self.style.SUCCESS(f'Saved results to {path}'))
+        if options['compare']:
+            baseline = benchmarking.load_results(self.baseline_path(options['compare']))
+            self.report(baseline, results, options['threshold'])
+
+    def handle_compare(self, **options):
+        try:
+            baseline = benchmarking.load_results(self.baseline_path(options['baseline']))
+            candidate = benchmarking.load_results(self.baseline_path(options['candidate']))
+        except FileNotFoundError as e:
+            raise CommandError(f'Baseline not found: {e.filename}')
+        self.report(baseline, candidate, options['threshold'])
+
+    def report(self, baseline, candidate, threshold):
+        rows = benchmarking.compare_results(baseline, candidate, threshold)
+        regressions = 0
+        for name, base, new, ratio, status in rows:
+            change = f'{(ratio - 1) * 100:+.1f}%' if ratio is not None else '-'
+            line = (
+                f'{name:<60} {benchmarking.format_ns(base):>10} -> '
+                f'{benchmarking.format_ns(new):>10} {change:>8}  {status}'
+            )
+            if status == 'regression':
+                regressions += 1
+                self.stdout.write(self.style.ERROR(line))
+            elif status == 'improvement':
+                self.stdout.write(self.style.SUCCESS(line))
+            else:
+                self.stdout.write(line)
+        if regressions:
+            raise CommandError(
+                f'{regressions} benchmark(s) regressed by more than {threshold:.0%}.',
+                returncode=1,
+            )
@@ -0,0 +1,137 @@
+"""
+Simple database load test to size the connection pool.
+
+Runs ``--requests`` simulated requests spread over ``--threads`` threads. Each
+request opens the connection, runs ``--queries`` queries and closes it again
+the way Django does at the end of a request, so with pooling enabled
+connections are returned to the pool instead of being torn down. Compare e.g.:
+
+    DB_POOL=false python manage.py db_loadtest --threads 8
+    DB_POOL=true DB_POOL_MAX_SIZE=8 python manage.py db_loadtest --threads 8
+
+With ``--writers N``, N extra threads run short write transactions against a
+scratch table for the whole run and readers query that table, which shows
+read throughput under write load (e.g. SQLite with and without the tuned
+profile):
+
+    SQLITE_TUNED=false python manage.py db_loadtest --threads 8 --writers 2
+    python manage.py db_loadtest --threads 8 --writers 2
+"""
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, close_old_connections, connections, transaction
+
+SCRATCH_TABLE = 'db_loadtest_scratch'
+SCRATCH_ROWS = 100
+
+
+class Command(BaseCommand):
+    help = "Measure request throughput against the database with N concurrent threads."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default')
+        parser.add_argument('--threads', type=int, default=4)
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--queries', type=int, default=3, help='Queries per simulated request.')
+        parser.add_argument(
+            '--sql', default=None,
+            help=f'Read query (default: SELECT 1, or a read of {SCRATCH_TABLE} with --writers).',
+        )
+        parser.add_argument('--writers', type=int, default=0, help='Threads writing continuously during the run.')
+
+    def handle(self, *args, **options):
+        alias = options['database']
+        sql = options['sql'] or (f'SELECT SUM(n) FROM {SCRATCH_TABLE}' if options['writers'] else 'SELECT 1')
+        latencies = []
+        errors = {'read': 0, 'write': 0}
+        writes = []
+        lock = threading.Lock()
+        stop = threading.Event()
+
+        def simulated_request(_):
+            start = time.perf_counter()
+            conn = connections[alias]
+            try:
+                with conn.cursor() as cursor:
+                    for _ in range(options['queries']):
+                        cursor.execute(sql)
+                        cursor.fetchall()
+            except DatabaseError:
+                with lock:
+                    errors['read'] += 1
+            # End of request: Django closes (or returns to the pool) here
+            close_old_connections()
+            conn.close()
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+        def writer(number):
+            row = number
+            count = 0
+            while not stop.is_set():
+                row = (row + options['writers']) % SCRATCH_ROWS
+                try:
+                    with transaction.atomic(using=alias), connections[alias].cursor() as cursor:
+                        cursor.execute(f'UPDATE {SCRATCH_TABLE} SET n = n + 1 WHERE id = %s', [row])
+                    count += 1
+                except DatabaseError:
+                    with lock:
+                        errors['write'] += 1
+            connections[alias].close()
+            with lock:
+                writes.append(count)
+
+        if options['writers']:
+            self.create_scratch_table(alias)
+        writer_pool = ThreadPoolExecutor(max_workers=options['writers'] or 1)
+        try:
+            for number in range(options['writers']):
+                writer_pool.submit(writer, number)
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=options['threads']) as executor:
+                list(executor.map(simulated_request, range(options['requests'])))
+            elapsed = time.perf_counter() - started
+        finally:
+            stop.set()
+            writer_pool.shutdown()
+            if options['writers']:
+                self.drop_scratch_table(alias)
+
+        latencies.sort()
+        p95 = latencies[int(len(latencies) * 0.95) - 1]
+        pool = getattr(connections[alias], 'pool', None)
+        self.stdout.write(
+            f"threads={options['threads']} requests={options['requests']} "
+            f"pooled={'yes' if pool is not None else 'no'} "
+            f"throughput={options['requests'] / elapsed:.0f} req/s "
+            f"median={statistics.median(latencies) * 1000:.2f}ms p95={p95 * 1000:.2f}ms"
+        )
+        if options['writers']:
+            self.stdout.write(
+                f"writers={options['writers']} writes={sum(writes) / elapsed:.0f}/s "
+                f"read_errors={errors['read']} write_errors={errors['write']}"
+            )
+        elif errors['read']:
+            self.stdout.write(f"read_errors={errors['read']}")
+        if pool is not None:
+            stats = pool.get_stats()
+            self.stdout.write(
+                f"pool size={stats.get('pool_size')} max={stats.get('pool_max')} "
+                f"queued={stats.get('requests_queued', 0)} "
+                f"wait={stats.get('requests_wait_ms', 0)}ms errors={stats.get('requests_errors', 0)}"
+            )
+
+    def create_scratch_table(self, alias):
+        with connections[alias].cursor() as cursor:
+            cursor.execute(f'DROP TABLE IF EXISTS {SCRATCH_TABLE}')
+            cursor.execute(f'CREATE TABLE {SCRATCH_TABLE} (id integer PRIMARY KEY, n integer NOT NULL)')
+            cursor.executemany(f'INSERT INTO {SCRATCH_TABLE} (id, n) VALUES (%s, 0)', [[row] for row in range(SCRATCH_ROWS)])
+
+    def drop_scratch_table(self, alias):
+        with connections[alias].cursor() as cursor:
+            cursor.execute(f'DROP TABLE IF EXISTS {SCRATCH_TABLE}')
+        connections[alias].close()
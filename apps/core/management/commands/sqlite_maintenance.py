@@ -0,0 +1,57 @@
+"""
+Periodic maintenance for SQLite deployments (see SQLITE_TUNED in settings).
+
+Checkpoints the write-ahead log back into the database file, so the WAL
+doesn't keep growing while readers are always active, and runs
+``PRAGMA optimize`` to refresh the query planner statistics. Run it from cron
+or leave it running with ``--interval``:
+
+    python manage.py sqlite_maintenance
+    python manage.py sqlite_maintenance --interval 300
+"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connections
+
+CHECKPOINT_MODES = ['PASSIVE', 'FULL', 'RESTART', 'TRUNCATE']
+
+
+class Command(BaseCommand):
+    help = "Checkpoint the SQLite WAL and run PRAGMA optimize, once or every --interval seconds."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default')
+        parser.add_argument(
+            '--checkpoint', choices=CHECKPOINT_MODES, default='TRUNCATE',
+            help='wal_checkpoint mode; TRUNCATE also resets the WAL file to zero bytes.',
+        )
+        parser.add_argument('--interval', type=int, default=0, help='Repeat every N seconds (0: run once).')
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        if connection.vendor != 'sqlite':
+            raise CommandError(f"Database {options['database']!r} is not SQLite.")
+        while True:
+            self.maintain(connection, options['checkpoint'])
+            if not options['interval']:
+                return
+            # Don't hold the connection (and its read snapshot) while idle
+            connection.close()
+            time.sleep(options['interval'])
+
+    def maintain(self, connection, mode):
+        started = time.perf_counter()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(f'PRAGMA wal_checkpoint({mode})')
+                busy, wal_pages, checkpointed = cursor.fetchone()
+                cursor.execute('PRAGMA optimize')
+        except OperationalError as exc:
+            # Locked for longer than the busy timeout: try again next round
+            self.stderr.write(f"SQLite maintenance skipped: {exc}")
+            return
+        self.stdout.write(
+            f"wal_checkpoint({mode}) busy={busy} wal_pages={wal_pages} checkpointed={checkpointed}; "
+            f"optimize done in {(time.perf_counter() - started) * 1000:.1f}ms"
+        )
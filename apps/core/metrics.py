@@ -0,0 +1,122 @@
+"""
+apps/core/metrics.py
+
+Prometheus metrics shared by the whole project.
+
+Under gunicorn each worker is a separate process, so metrics are recorded in
+prometheus_client's multiprocess mode: when ``PROMETHEUS_MULTIPROC_DIR`` is set
+(see entrypoint.sh and gunicorn.conf.py) every worker writes its samples to
+mmap'd files in that directory and the ``/metrics`` view aggregates them at
+scrape time. Recording a sample is an in-memory write, so it is cheap enough
+for the request path.
+"""
+import os
+import time
+from contextlib import contextmanager
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+# Buckets tuned for API latencies: 5ms .. 10s
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REQUEST_LATENCY = Histogram(
+    'django_http_request_duration_seconds',
+    'Request latency by view.',
+    ['view', 'method'],
+    buckets=LATENCY_BUCKETS,
+)
+RESPONSES = Counter(
+    'django_http_responses_total',
+    'Responses by view and status code.',
+    ['view', 'method', 'status'],
+)
+DB_QUERIES = Counter(
+    'django_db_queries_total',
+    'Database queries executed, by view and database alias.',
+    ['view', 'alias'],
+)
+DB_QUERY_TIME = Counter(
+    'django_db_query_duration_seconds_total',
+    'Total time spent executing database queries, by view and database alias.',
+    ['view', 'alias'],
+)
+DB_READS_ROUTED = Counter(
+    'db_reads_routed_total',
+    'Reads routed by PrimaryReplicaRouter, by database alias (read split).',
+    ['alias'],
+)
+DB_REPLICA_HEALTH_FAILURES = Counter(
+    'db_replica_health_failures_total',
+    'Failed replica health checks.',
+    ['alias'],
+)
+STORAGE_LATENCY = Histogram(
+    'storage_operation_duration_seconds',
+    'Latency of default_storage (S3) operations.',
+    ['operation'],
+    buckets=LATENCY_BUCKETS,
+)
+EMAIL_SEND_LATENCY = Histogram(
+    'email_send_duration_seconds',
+    'Latency of sending email over SMTP.',
+    ['template'],
+    buckets=LATENCY_BUCKETS,
+)
+TOKEN_REFRESHES = Counter(
+    'auth_token_refresh_total',
+    'Access token refresh attempts by result.',
+    ['result'],
+)
+TOKEN_BLACKLIST_HITS = Counter(
+    'auth_token_blacklist_hits_total',
+    'Refresh tokens rejected because they were blacklisted.',
+)
+WHITESPACE_MESSAGES = Counter(
+    'whitespace_messages_total',
+    'Whitespace queue messages by outcome (applied, dead_lettered, abandoned).',
+    ['result'],
+)
+WHITESPACE_BATCH_LATENCY = Histogram(
+    'whitespace_batch_duration_seconds',
+    'Time spent per Whitespace message batch, by stage (receive, process, apply, settle).',
+    ['stage'],
+    buckets=LATENCY_BUCKETS,
+)
+WHITESPACE_BATCH_SIZE = Histogram(
+    'whitespace_batch_size',
+    'Messages per received Whitespace batch.',
+    buckets=(1, 5, 10, 25, 50, 100, 250, 500),
+)
+
+
+@contextmanager
+def timed(histogram, **labels):
+    """Observe the duration of the ``with`` block on ``histogram``."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.labels(**labels).observe(time.perf_counter() - start)
+
+
+def render_latest():
+    """
+    Return ``(payload, content_type)`` for the current metrics.
+
+    In multiprocess mode samples from every worker's files are merged;
+    otherwise the in-process default registry is used.
+    """
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,218 @@
+"""
+apps/core/middleware.py
+
+Cross-cutting request middleware.
+"""
+import re
+import threading
+import time
+import uuid
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+from . import metrics, profiling, timing
+from .db import router
+from .log import request_id_var
+
+_REQUEST_ID_RE = re.compile(r'^[\w.-]{1,128}$')
+
+
+class QueryTimer:
+    """Database execute wrapper counting queries and their total duration."""
+
+    def __init__(self, alias):
+        self.alias = alias
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+
+
+def view_label(request):
+    """Low-cardinality label for the view that handled ``request``."""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return '<unresolved>'
+    return match.view_name or match.route
+
+
+class MetricsMiddleware:
+    """
+    Record per-view latency, status codes and database usage as Prometheus metrics.
+
+    Should be placed first in MIDDLEWARE so the latency covers the whole stack.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timers = []
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for conn in connections.all():
+                timer = QueryTimer(conn.alias)
+                timers.append(timer)
+                stack.enter_context(conn.execute_wrapper(timer))
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - start
+
+        view = view_label(request)
+        metrics.REQUEST_LATENCY.labels(view, request.method).observe(elapsed)
+        metrics.RESPONSES.labels(view, request.method, response.status_code).inc()
+        for timer in timers:
+            if timer.count:
+                metrics.DB_QUERIES.labels(view, timer.alias).inc(timer.count)
+                metrics.DB_QUERY_TIME.labels(view, timer.alias).inc(timer.duration)
+        return response
+
+
+class _TimingQueryWrapper:
+    """Execute wrapper adding every query to the request's ``db`` phase."""
+
+    def __init__(self, timings):
+        self.timings = timings
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.timings.add('db', time.perf_counter() - start)
+
+
+class ServerTimingMiddleware:
+    """
+    Add a ``Server-Timing`` header with the auth, db, serialization and render phases.
+
+    Phases are recorded with ``apps.core.timing.phase()``; database time is
+    collected here. Phases can overlap: queries run while serializing a lazy
+    queryset count towards both ``db`` and ``serialization``.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = getattr(settings, 'SERVER_TIMING_ENABLED', True)
+
+    def __call__(self, request):
+        if not self.enabled:
+            return self.get_response(request)
+        token = timing.start()
+        try:
+            wrapper = _TimingQueryWrapper(timing.current())
+            with ExitStack() as stack:
+                for conn in connections.all():
+                    stack.enter_context(conn.execute_wrapper(wrapper))
+                response = self.get_response(request)
+        finally:
+            timings = timing.finish(token)
+        response['Server-Timing'] = timings.header_value()
+        return response
+
+
+class RequestProfilingMiddleware:
+    """
+    Sampling profiler for single requests plus a slow-request stack logger.
+
+    A request is profiled when it carries a valid signed token (issued to staff
+    by ``/api/debug/profile-token/``) in the ``X-Profile-Token`` header. It is
+    not accepted as a query parameter, which would leak it into access logs and
+    Referer headers. The stored profile id is returned in the ``X-Profile-Id``
+    response header.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        threshold = getattr(settings, 'SLOW_REQUEST_THRESHOLD_MS', 0)
+        self.watchdog = profiling.SlowRequestWatchdog(threshold / 1000) if threshold else None
+
+    def __call__(self, request):
+        token = request.headers.get('X-Profile-Token')
+        sampler = None
+        if token and profiling.check_profile_token(token):
+            sampler = profiling.Sampler(threading.get_ident(), settings.PROFILE_SAMPLE_INTERVAL_MS / 1000)
+            sampler.start()
+        if self.watchdog is not None:
+            self.watchdog.register(request)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            if self.watchdog is not None:
+                self.watchdog.unregister()
+            if sampler is not None:
+                sampler.stop()
+        if sampler is not None:
+            profile_id = profiling.save_profile(sampler, request, response, time.perf_counter() - start)
+            response['X-Profile-Id'] = profile_id
+        return response
+
+
+class RequestIdMiddleware:
+    """
+    Assign each request an id for log correlation.
+
+    An incoming ``X-Request-ID`` (e.g. from the load balancer) is reused when
+    it looks sane; otherwise a new one is generated. The id is echoed back in
+    the response header.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request_id = request.headers.get('X-Request-ID', '')
+        if not _REQUEST_ID_RE.match(request_id):
+            request_id = uuid.uuid4().hex
+        request.request_id = request_id
+        token = request_id_var.set(request_id)
+        try:
+            response = self.get_response(request)
+        finally:
+            request_id_var.reset(token)
+        response['X-Request-ID'] = request_id
+        return response
+
+
+class ReplicaPinningMiddleware:
+    """
+    Keep clients that just wrote reading from the primary database.
+
+    Unsafe methods are pinned for the whole request. If the request wrote, a
+    cookie pins the client's following requests for REPLICA_STICKY_SECONDS.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sticky_seconds = getattr(settings, 'REPLICA_STICKY_SECONDS', 5)
+
+    def __call__(self, request):
+        if not getattr(settings, 'DATABASE_REPLICAS', None):
+            return self.get_response(request)
+        pinned = (
+            router.PIN_COOKIE_NAME in request.COOKIES
+            or request.method not in ('GET', 'HEAD', 'OPTIONS')
+        )
+        token = router.begin_request(pinned)
+        try:
+            response = self.get_response(request)
+        finally:
+            wrote = router.end_request(token)
+        if wrote:
+            response.set_cookie(
+                router.PIN_COOKIE_NAME, '1',
+                max_age=self.sticky_seconds,
+                httponly=True,
+                secure=settings.SESSION_COOKIE_SECURE,
+                samesite=settings.SESSION_COOKIE_SAMESITE,
+                path='/',
+            )
+        return response
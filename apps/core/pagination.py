@@ -0,0 +1,55 @@
+"""
+apps/core/pagination.py
+
+Paginator for admin changelists over large tables.
+
+``Paginator.count`` runs ``SELECT COUNT(*)``, a full scan on PostgreSQL and
+SQLite. For an unfiltered queryset EstimatedCountPaginator uses the planner's
+row estimate instead (``pg_class.reltuples`` kept by autovacuum/ANALYZE, or
+``sqlite_stat1`` kept by ``PRAGMA optimize``) once that is above
+``EXACT_COUNT_THRESHOLD``. Filtered querysets, small tables and databases
+without statistics are counted exactly.
+"""
+from django.core.paginator import Paginator
+from django.db import DatabaseError, connections
+from django.db.models import QuerySet
+from django.utils.functional import cached_property
+
+EXACT_COUNT_THRESHOLD = 10_000
+
+
+def estimated_count(model, using='default'):
+    """Return the planner's row estimate for ``model``'s table, or None if there is none."""
+    connection = connections[using]
+    table = model._meta.db_table
+    try:
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [table])
+            elif connection.vendor == 'sqlite':
+                # The first number of every index's stat is the table's row count
+                cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1', [table])
+            else:
+                return None
+            row = cursor.fetchone()
+    except DatabaseError:
+        # e.g. sqlite_stat1 doesn't exist until the database is first analysed
+        return None
+    if row is None or row[0] is None:
+        return None
+    estimate = int(str(row[0]).split()[0])
+    # reltuples is -1 for a table that has never been analysed
+    return estimate if estimate >= 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator that trusts the planner's estimate for large unfiltered querysets."""
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if isinstance(queryset, QuerySet) and not queryset.query.where:
+            estimate = estimated_count(queryset.model, queryset.db)
+            if estimate is not None and estimate > EXACT_COUNT_THRESHOLD:
+                return estimate
+        return super().count
@@ -0,0 +1,201 @@
+"""
+apps/core/profiling.py
+
+On-demand sampling profiles of single requests and stack capture for slow requests.
+
+Sampling works by reading the request thread's current frame from
+``sys._current_frames()`` at a fixed interval in a helper thread, so the
+profiled code runs unmodified (no tracing hooks) and the overhead is bounded
+by the sampling rate. Profiles are stored as "folded" stack files that can
+be opened directly in speedscope or flamegraph.pl.
+"""
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import traceback
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+from pathlib import Path
+
+from django.conf import settings
+from django.core import signing
+
+logger = logging.getLogger('apps.core.slow_requests')
+
+PROFILE_TOKEN_SALT = 'apps.core.profiling'
+PROFILE_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+
+
+def make_profile_token(user):
+    """Signed token allowing the holder to profile requests for PROFILE_TOKEN_MAX_AGE seconds."""
+    return signing.dumps({'user': str(user.pk)}, salt=PROFILE_TOKEN_SALT)
+
+
+def check_profile_token(token):
+    """Return True if ``token`` is a valid, unexpired profile token."""
+    try:
+        signing.loads(token, salt=PROFILE_TOKEN_SALT, max_age=settings.PROFILE_TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        return False
+    return True
+
+
+def profile_dir():
+    return Path(settings.PROFILE_STORAGE_DIR)
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    module = frame.f_globals.get('__name__', os.path.basename(code.co_filename))
+    return f'{module}:{code.co_name}'
+
+
+class Sampler:
+    """Samples the stack of one thread every ``interval`` seconds."""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='request-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def folded(self):
+        return '\n'.join(f'{stack} {count}' for stack, count in self.stacks.most_common())
+
+
+def save_profile(sampler, request, response, duration):
+    """Store a finished profile and return its id."""
+    profile_id = uuid.uuid4().hex
+    directory = profile_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    (directory / f'{profile_id}.folded').write_text(sampler.folded())
+    meta = {
+        'id': profile_id,
+        'method': request.method,
+        'path': request.get_full_path(),
+        'status': response.status_code,
+        'duration_ms': round(duration * 1000, 1),
+        'samples': sampler.samples,
+        'interval_ms': sampler.interval * 1000,
+        'created_at': datetime.now(timezone.utc).isoformat(),
+    }
+    (directory / f'{profile_id}.json').write_text(json.dumps(meta))
+    prune_profiles(settings.PROFILE_MAX_STORED)
+    return profile_id
+
+
+def prune_profiles(keep):
+    """Delete all but the ``keep`` newest profiles; return how many were removed."""
+    directory = profile_dir()
+    files = sorted(directory.glob('*.json'), key=_mtime, reverse=True)
+    for meta in files[keep:]:
+        # Another worker may be pruning the same files
+        meta.with_suffix('.folded').unlink(missing_ok=True)
+        meta.unlink(missing_ok=True)
+    return max(len(files) - keep, 0)
+
+
+def _mtime(path):
+    try:
+        return path.stat().st_mtime
+    except FileNotFoundError:
+        return 0
+
+
+def load_profile(profile_id):
+    """Return ``(meta, folded_stacks)`` or None if the profile does not exist."""
+    if not PROFILE_ID_RE.match(profile_id):
+        return None
+    directory = profile_dir()
+    try:
+        meta = json.loads((directory / f'{profile_id}.json').read_text())
+        folded = (directory / f'{profile_id}.folded').read_text()
+    except FileNotFoundError:
+        return None
+    return meta, folded
+
+
+def list_profiles(limit=50):
+    directory = profile_dir()
+    if not directory.exists():
+        return []
+    files = sorted(directory.glob('*.json'), key=_mtime, reverse=True)
+    return [json.loads(p.read_text()) for p in files[:limit]]
+
+
+class SlowRequestWatchdog:
+    """
+    Background thread logging the stack of requests running longer than a threshold.
+
+    Requests register on entry and unregister on exit; the watchdog wakes up a
+    few times per threshold period, so the request path only pays for a dict
+    insert and delete.
+    """
+
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _ensure_started(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    # Started lazily so each forked gunicorn worker gets its own thread
+                    self._thread = threading.Thread(target=self._run, name='slow-request-watchdog', daemon=True)
+                    self._thread.start()
+
+    def register(self, request):
+        self._ensure_started()
+        self._inflight[threading.get_ident()] = [time.monotonic(), request.method, request.path, False]
+
+    def unregister(self):
+        self._inflight.pop(threading.get_ident(), None)
+
+    def _run(self):
+        interval = max(self.threshold / 4, 0.05)
+        while True:
+            time.sleep(interval)
+            now = time.monotonic()
+            frames = None
+            for thread_id, entry in list(self._inflight.items()):
+                started, method, path, reported = entry
+                if reported or now - started < self.threshold:
+                    continue
+                if frames is None:
+                    frames = sys._current_frames()
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                entry[3] = True
+                logger.warning(
+                    "Slow request %s %s running for %.0fms, stack:\n%s",
+                    method, path, (now - started) * 1000, ''.join(traceback.format_stack(frame)),
+                )
@@ -0,0 +1,16 @@
+"""
+apps/core/renderers.py
+
+DRF renderers that report their cost in the Server-Timing header.
+"""
+from rest_framework.renderers import JSONRenderer
+
+from . import timing
+
+
+class TimedJSONRenderer(JSONRenderer):
+    """JSONRenderer recording the ``render`` phase."""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with timing.phase('render'):
+            return super().render(data, accepted_media_type, renderer_context)
@@ -0,0 +1,167 @@
+"""
+apps/core/signing.py
+
+Signed document URLs, computed locally (no network calls).
+
+``DOCUMENT_URL_SIGNING`` selects the scheme:
+
+* ``None``: URLs are not signed (public bucket, the default);
+* ``'s3'``: S3 SigV4 query-string presigned URLs, signed with
+  ``AWS_ACCESS_KEY_ID`` / ``AWS_SECRET_ACCESS_KEY``;
+* ``'cloudfront'``: CloudFront canned-policy URLs on ``AWS_S3_CUSTOM_DOMAIN``,
+  signed with the ``AWS_CLOUDFRONT_KEY`` private key (PEM) of key pair
+  ``AWS_CLOUDFRONT_KEY_ID``. Needs the ``cryptography`` package.
+
+Signatures are issued per time bucket of ``SIGNED_URL_BUCKET_SECONDS``: a
+URL signed during bucket ``n`` is dated at the start of the bucket and
+expires at the end of bucket ``n + 1``. Every client therefore gets the
+same URL for an object during a bucket (so browsers and the CDN can cache
+it), each URL stays valid for at least one full bucket, and a process signs
+a given key at most once per bucket (``_sign`` is an LRU cache).
+
+S3 presigned URLs are valid for at most 7 days, so with ``'s3'`` the bucket
+can be at most 3.5 days long; ``validate_settings`` (run at startup) rejects
+longer buckets rather than letting URLs expire before the end of bucket
+``n + 1``.
+"""
+import base64
+import hashlib
+import hmac
+import time
+from datetime import datetime, timezone
+from functools import lru_cache
+from urllib.parse import quote, urlsplit
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+SIGNED_URL_CACHE_SIZE = 50000
+S3_MAX_EXPIRES = 7 * 24 * 3600
+
+
+def signing_mode():
+    return getattr(settings, 'DOCUMENT_URL_SIGNING', None) or None
+
+
+def bucket_seconds():
+    return getattr(settings, 'SIGNED_URL_BUCKET_SECONDS', 3600)
+
+
+def validate_settings():
+    """Raise ImproperlyConfigured if signed URLs could not honour their two-bucket lifetime."""
+    if signing_mode() is None:
+        return
+    size = bucket_seconds()
+    if size <= 0:
+        raise ImproperlyConfigured('SIGNED_URL_BUCKET_SECONDS must be positive.')
+    if signing_mode() == 's3' and 2 * size > S3_MAX_EXPIRES:
+        raise ImproperlyConfigured(
+            f"SIGNED_URL_BUCKET_SECONDS={size} is too long for DOCUMENT_URL_SIGNING='s3': URLs must stay "
+            f"valid for two buckets and S3 caps presigned URLs at {S3_MAX_EXPIRES} seconds."
+        )
+
+
+def current_bucket(now=None):
+    """Index of the signing bucket containing ``now`` (default: the current time)."""
+    return int((time.time() if now is None else now) // bucket_seconds())
+
+
+def bucket_start(bucket):
+    return datetime.fromtimestamp(bucket * bucket_seconds(), tz=timezone.utc)
+
+
+def signed_url(key, now=None):
+    """Return a signed URL for storage ``key``, or None when signing is disabled."""
+    mode = signing_mode()
+    if mode is None:
+        return None
+    return _sign(mode, key, current_bucket(now), bucket_seconds())
+
+
+@lru_cache(maxsize=SIGNED_URL_CACHE_SIZE)
+def _sign(mode, key, bucket, size):
+    signed_at, expires_at = bucket * size, (bucket + 2) * size
+    if mode == 's3':
+        return _presign_s3(key, signed_at, expires_at - signed_at)
+    if mode == 'cloudfront':
+        return _sign_cloudfront(key, expires_at)
+    raise ImproperlyConfigured(f"Unknown DOCUMENT_URL_SIGNING mode {mode!r} (expected 's3' or 'cloudfront').")
+
+
+def _quote(value, safe='~'):
+    return quote(value, safe=safe)
+
+
+@lru_cache(maxsize=8)
+def _s3_signing_key(secret, datestamp, region):
+    key = f'AWS4{secret}'.encode()
+    for part in (datestamp, region, 's3', 'aws4_request'):
+        key = hmac.new(key, part.encode(), hashlib.sha256).digest()
+    return key
+
+
+def _s3_location(key):
+    """Return ``(host, path)`` of ``key``: virtual-hosted on AWS, path-style on a custom endpoint."""
+    bucket = settings.AWS_STORAGE_BUCKET_NAME
+    endpoint = getattr(settings, 'AWS_S3_ENDPOINT_URL', None)
+    if endpoint:
+        return urlsplit(endpoint).netloc, f'/{bucket}/{key}'
+    return f'{bucket}.s3.{settings.AWS_S3_REGION_NAME}.amazonaws.com', f'/{key}'
+
+
+def _presign_s3(key, signed_at, expires_in):
+    """SigV4 query-string presign of a GET, as ``generate_presigned_url`` would produce."""
+    region = settings.AWS_S3_REGION_NAME
+    moment = datetime.fromtimestamp(signed_at, tz=timezone.utc)
+    amz_date, datestamp = moment.strftime('%Y%m%dT%H%M%SZ'), moment.strftime('%Y%m%d')
+    scope = f'{datestamp}/{region}/s3/aws4_request'
+    params = {
+        'X-Amz-Algorithm': 'AWS4-HMAC-SHA256',
+        'X-Amz-Credential': f'{settings.AWS_ACCESS_KEY_ID}/{scope}',
+        'X-Amz-Date': amz_date,
+        'X-Amz-Expires': str(expires_in),
+        'X-Amz-SignedHeaders': 'host',
+    }
+    token = getattr(settings, 'AWS_SESSION_TOKEN', None)
+    if token:
+        params['X-Amz-Security-Token'] = token
+    host, path = _s3_location(key)
+    path = _quote(path, safe='/~')
+    query = '&'.join(f'{_quote(name)}={_quote(value)}' for name, value in sorted(params.items()))
+    canonical = '\n'.join(('GET', path, query, f'host:{host}\n', 'host', 'UNSIGNED-PAYLOAD'))
+    string_to_sign = '\n'.join((
+        'AWS4-HMAC-SHA256', amz_date, scope, hashlib.sha256(canonical.encode()).hexdigest(),
+    ))
+    signing_key = _s3_signing_key(settings.AWS_SECRET_ACCESS_KEY, datestamp, region)
+    signature = hmac.new(signing_key, string_to_sign.encode(), hashlib.sha256).hexdigest()
+    return f'https://{host}{path}?{query}&X-Amz-Signature={signature}'
+
+
+@lru_cache(maxsize=1)
+def _cloudfront_key(pem):
+    try:
+        from cryptography.hazmat.primitives import serialization
+    except ImportError as exc:
+        raise ImproperlyConfigured("DOCUMENT_URL_SIGNING='cloudfront' requires the cryptography package.") from exc
+    return serialization.load_pem_private_key(pem.encode() if isinstance(pem, str) else pem, password=None)
+
+
+def _cloudfront_safe_b64(data):
+    return base64.b64encode(data).decode().translate(str.maketrans('+=/', '-_~'))
+
+
+def _sign_cloudfront(key, expires_at):
+    """Canned-policy signed URL (RSA-SHA1 over the policy), as CloudFrontSigner would produce."""
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.asymmetric import padding
+
+    key_id = getattr(settings, 'AWS_CLOUDFRONT_KEY_ID', None)
+    pem = getattr(settings, 'AWS_CLOUDFRONT_KEY', None)
+    if not key_id or not pem:
+        raise ImproperlyConfigured("DOCUMENT_URL_SIGNING='cloudfront' requires AWS_CLOUDFRONT_KEY_ID and AWS_CLOUDFRONT_KEY.")
+    url = f'https://{settings.AWS_S3_CUSTOM_DOMAIN}/{_quote(key, safe="/~")}'
+    policy = (
+        '{"Statement":[{"Resource":"%s","Condition":{"DateLessThan":{"AWS:EpochTime":%d}}}]}' % (url, expires_at)
+    )
+    signature = _cloudfront_key(pem).sign(policy.encode(), padding.PKCS1v15(), hashes.SHA1())
+    return f'{url}?Expires={expires_at}&Signature={_cloudfront_safe_b64(signature)}&Key-Pair-Id={key_id}'
@@ -0,0 +1,54 @@
+"""
+apps/core/storage.py
+
+S3 storage backend instrumented with Prometheus latency metrics.
+
+Versioned objects (``<name>_v<n>.<ext>``, written once per version and
+never overwritten) are uploaded with ``AWS_S3_IMMUTABLE_CACHE_CONTROL``
+instead of the default ``AWS_S3_OBJECT_PARAMETERS`` Cache-Control.
+"""
+import re
+from functools import wraps
+
+from django.conf import settings
+from storages.backends.s3 import S3Storage
+
+from . import metrics
+
+
+def _timed(operation):
+    def decorator(method):
+        @wraps(method)
+        def wrapper(*args, **kwargs):
+            with metrics.timed(metrics.STORAGE_LATENCY, operation=operation):
+                return method(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# The optional suffix is the random string added when a name is already taken
+VERSIONED_NAME_RE = re.compile(r'_v\d+(?:_[A-Za-z0-9]{7})?\.[^./]+$')
+
+
+def is_versioned(name):
+    return VERSIONED_NAME_RE.search(name) is not None
+
+
+class InstrumentedS3Storage(S3Storage):
+    """S3Storage recording the latency of every network operation."""
+
+    _open = _timed('open')(S3Storage._open)
+    _save = _timed('save')(S3Storage._save)
+    delete = _timed('delete')(S3Storage.delete)
+    exists = _timed('exists')(S3Storage.exists)
+    size = _timed('size')(S3Storage.size)
+    listdir = _timed('listdir')(S3Storage.listdir)
+    get_modified_time = _timed('get_modified_time')(S3Storage.get_modified_time)
+
+    def get_object_parameters(self, name):
+        params = super().get_object_parameters(name)
+        if is_versioned(name):
+            params['CacheControl'] = getattr(
+                settings, 'AWS_S3_IMMUTABLE_CACHE_CONTROL', 'public, max-age=31536000, immutable'
+            )
+        return params
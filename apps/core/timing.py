@@ -0,0 +1,67 @@
+"""
+apps/core/timing.py
+
+Per-request phase timings reported in the ``Server-Timing`` response header.
+
+Code on the request path wraps a phase with ``with timing.phase('auth'):``.
+Outside a request (management commands, tests without the middleware) the
+context manager does nothing.
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+_current = ContextVar('request_timings', default=None)
+
+
+class RequestTimings:
+    """Accumulated durations (seconds) and counts for each named phase."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.durations = {}
+        self.counts = {}
+
+    def add(self, name, duration, count=1):
+        self.durations[name] = self.durations.get(name, 0.0) + duration
+        self.counts[name] = self.counts.get(name, 0) + count
+
+    def header_value(self):
+        """Format as a Server-Timing header value (durations in milliseconds)."""
+        parts = []
+        for name, duration in self.durations.items():
+            entry = f'{name};dur={duration * 1000:.1f}'
+            if self.counts[name] > 1:
+                entry += f';desc="{self.counts[name]} calls"'
+            parts.append(entry)
+        parts.append(f'total;dur={(time.perf_counter() - self.started) * 1000:.1f}')
+        return ', '.join(parts)
+
+
+def start():
+    """Begin collecting timings for the current request; returns a reset token."""
+    return _current.set(RequestTimings())
+
+
+def finish(token):
+    timings = _current.get()
+    _current.reset(token)
+    return timings
+
+
+def current():
+    return _current.get()
+
+
+@contextmanager
+def phase(name):
+    """Add the duration of the ``with`` block to the named phase."""
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    begin = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - begin)
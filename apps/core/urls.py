@@ -0,0 +1,9 @@
+# apps/core/urls.py
+from django.urls import path
+from .views import ProfileTokenView, ProfileListView, ProfileDetailView
+
+urlpatterns = [
+    path('debug/profile-token/', ProfileTokenView.as_view(), name='profile_token'),
+    path('debug/profiles/', ProfileListView.as_view(), name='profile_list'),
+    path('debug/profiles/<str:profile_id>/', ProfileDetailView.as_view(), name='profile_detail'),
+]
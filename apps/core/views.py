@@ -0,0 +1,70 @@
+"""
+apps/core/views.py
+
+Operational endpoints (metrics, request profiles).
+"""
+import hmac
+
+from django.conf import settings
+from django.http import Http404, HttpResponse, HttpResponseForbidden
+from rest_framework import permissions
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from . import metrics, profiling
+
+
+def metrics_view(request):
+    """
+    Expose Prometheus metrics aggregated across all gunicorn workers.
+
+    The scraper must send METRICS_AUTH_TOKEN as a bearer token. Without a
+    token configured the endpoint only exists in DEBUG; otherwise it is 404.
+    """
+    token = getattr(settings, 'METRICS_AUTH_TOKEN', None)
+    if not token and not settings.DEBUG:
+        raise Http404
+    if token:
+        supplied = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+        if not hmac.compare_digest(supplied, token):
+            return HttpResponseForbidden()
+    payload, content_type = metrics.render_latest()
+    return HttpResponse(payload, content_type=content_type)
+
+
+class ProfileTokenView(APIView):
+    """
+    Issue a signed token that enables request profiling for its holder.
+
+    Send it as ``X-Profile-Token: <token>`` on the request to profile; the
+    response carries ``X-Profile-Id``.
+    """
+    permission_classes = [permissions.IsAdminUser]
+
+    def post(self, request, *args, **kwargs):
+        return Response({
+            'token': profiling.make_profile_token(request.user),
+            'expires_in': settings.PROFILE_TOKEN_MAX_AGE,
+        })
+
+
+class ProfileListView(APIView):
+    """List recently captured request profiles."""
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response(profiling.list_profiles())
+
+
+class ProfileDetailView(APIView):
+    """Return a stored profile; ``?format=folded`` returns the raw folded stacks."""
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request, profile_id, *args, **kwargs):
+        profile = profiling.load_profile(profile_id)
+        if profile is None:
+            raise Http404
+        meta, folded = profile
+        if request.GET.get('format') == 'folded':
+            return HttpResponse(folded, content_type='text/plain; charset=utf-8')
+        return Response({**meta, 'stacks': folded.splitlines()})
@@ -1,3 +1,113 @@
-from django.contrib import admin
+"""
+apps/guidelines/admin.py
 
-# Register your models here.
+Admin for guidelines and trusts, sized for large tables.
+
+* Changelists join the trust (``list_select_related``), never run the
+  unfiltered ``COUNT(*)`` (``show_full_result_count = False``) and page with
+  the planner's row estimate (EstimatedCountPaginator).
+* Guideline search goes through the in-memory name and full-text indexes
+  (``GuidelineService.search_guideline_ids``) instead of ``LIKE`` scans;
+  trusts (a small table) are searched by name prefix and picked with an
+  autocomplete widget.
+* Saves, deletes and the bulk actions go through the services, so history
+  rows, version bumps and ``guidelines_changed`` behave as for API writes.
+  The bulk actions are one UPDATE (or DELETE) for the whole selection.
+"""
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin.helpers import ActionForm
+
+from apps.core.pagination import EstimatedCountPaginator
+
+from .models import Guideline, Trust
+from .services import GuidelineService, TrustService
+
+
+class BulkValuesForm(forms.Form):
+    """Inputs of the bulk actions."""
+    trust = forms.ModelChoiceField(queryset=Trust.objects.order_by('name'), required=False)
+    medical_speciality = forms.CharField(max_length=255, required=False)
+
+
+class GuidelineActionForm(ActionForm, BulkValuesForm):
+    """Action bar with the inputs of the bulk actions next to the action select."""
+
+
+@admin.register(Guideline)
+class GuidelineAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'trust', 'medical_speciality', 'locality', 'version_number', 'viewcount', 'updated_at')
+    list_select_related = ('trust',)
+    list_filter = ('medical_speciality', 'trust')
+    # The search box needs a search field; get_search_results does the lookup
+    search_fields = ('name',)
+    search_help_text = 'Name or full-text match, or a guideline id.'
+    autocomplete_fields = ('trust',)
+    readonly_fields = ('viewcount', 'updated_at', 'row_version')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_per_page = 50
+    action_form = GuidelineActionForm
+    actions = ('reassign_trust', 'set_medical_speciality')
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term.strip():
+            return queryset, False
+        return queryset.filter(pk__in=GuidelineService.search_guideline_ids(search_term)), False
+
+    def save_model(self, request, obj, form, change):
+        if not change:
+            obj.pk = GuidelineService.create_guideline(dict(form.cleaned_data), request.user).pk
+            return
+        current = Guideline.objects.get(pk=obj.pk)
+        GuidelineService.update_guideline(current, {name: form.cleaned_data[name] for name in form.changed_data})
+
+    def delete_model(self, request, obj):
+        GuidelineService.delete_guideline(obj)
+
+    def delete_queryset(self, request, queryset):
+        GuidelineService.delete_guidelines(queryset, request.user)
+
+    @admin.action(description='Reassign selected guidelines to the chosen trust')
+    def reassign_trust(self, request, queryset):
+        form = BulkValuesForm(request.POST)
+        if not form.is_valid() or form.cleaned_data['trust'] is None:
+            self.message_user(request, 'Choose a trust to reassign the guidelines to.', messages.ERROR)
+            return
+        trust = form.cleaned_data['trust']
+        changed = GuidelineService.set_fields(queryset, {'trust_id': trust.pk}, request.user)
+        self.message_user(request, f'Reassigned {changed} guideline(s) to {trust}.', messages.SUCCESS)
+
+    @admin.action(description='Set the medical speciality of selected guidelines')
+    def set_medical_speciality(self, request, queryset):
+        form = BulkValuesForm(request.POST)
+        speciality = form.cleaned_data['medical_speciality'].strip() if form.is_valid() else ''
+        if not speciality:
+            self.message_user(request, 'Enter the medical speciality to set.', messages.ERROR)
+            return
+        changed = GuidelineService.set_fields(queryset, {'medical_speciality': speciality}, request.user)
+        self.message_user(request, f'Set the speciality of {changed} guideline(s) to {speciality}.', messages.SUCCESS)
+
+
+@admin.register(Trust)
+class TrustAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'updated_at')
+    # Trusts number in the hundreds: a name prefix match is cheap
+    search_fields = ('name',)
+    ordering = ('name',)
+    readonly_fields = ('updated_at', 'row_version')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_search_results(self, request, queryset, search_term):
+        # The whole term is one prefix ("Trust 1"), not words matched separately
+        if not search_term.strip():
+            return queryset, False
+        return queryset.filter(name__istartswith=search_term.strip()), False
+
+    def save_model(self, request, obj, form, change):
+        TrustService.save_trust(obj)
+
+    def has_delete_permission(self, request, obj=None):
+        # Guideline.trust is DO_NOTHING: deleting a trust would orphan its guidelines
+        return False
@@ -0,0 +1,215 @@
+"""
+apps/guidelines/analytics.py
+
+Guideline view analytics: hourly view buckets, daily rollups and trending.
+
+Write path: ``view_recorder.record(pk)`` only increments an in-process
+counter keyed by (guideline, hour). The buffer is flushed as one bulk
+INSERT into GuidelineViewEvent once it holds ``VIEW_EVENTS_FLUSH_SIZE``
+views or is ``VIEW_EVENTS_FLUSH_INTERVAL`` seconds old, so a view costs a
+dict update plus an amortised share of one batch insert.
+
+``rollup()`` (``manage.py rollup_guideline_views``, run hourly) folds the
+events of completed hours into GuidelineViewDaily and deletes them, so the
+raw table only ever holds the last hour or two. ``trending()`` reads the
+daily rows of its window (bounded by guidelines x days, not by traffic),
+weights each day by exponential decay and is cached for
+``TRENDING_CACHE_TTL`` seconds.
+"""
+import atexit
+import hashlib
+import logging
+import threading
+import time
+from collections import Counter
+from datetime import timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Case, F, FloatField, Max, Sum, Value, When
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import Guideline, GuidelineViewDaily, GuidelineViewEvent
+
+logger = logging.getLogger(__name__)
+
+TRENDING_DEFAULT_DAYS = 14
+TRENDING_MAX_DAYS = 90
+TRENDING_HALF_LIFE_DAYS = 3
+ROLLUP_CHUNK_SIZE = 1000
+
+
+def hour_bucket(moment):
+    return moment.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+class ViewRecorder:
+    """Per-process buffer of view counts, flushed to GuidelineViewEvent in batches."""
+
+    def __init__(self):
+        self._counts = Counter()
+        self._pending = 0
+        self._started = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def flush_size(self):
+        return getattr(settings, 'VIEW_EVENTS_FLUSH_SIZE', 500)
+
+    @property
+    def flush_interval(self):
+        return getattr(settings, 'VIEW_EVENTS_FLUSH_INTERVAL', 10)
+
+    def record(self, pk, now=None):
+        bucket = hour_bucket(now or timezone.now())
+        with self._lock:
+            self._counts[(int(pk), bucket)] += 1
+            self._pending += 1
+            due = self._pending >= self.flush_size or time.monotonic() - self._started >= self.flush_interval
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered counts; returns the number of rows inserted."""
+        with self._lock:
+            counts, self._counts = self._counts, Counter()
+            self._pending = 0
+            self._started = time.monotonic()
+        if not counts:
+            return 0
+        try:
+            GuidelineViewEvent.objects.bulk_create(
+                (GuidelineViewEvent(guideline_id=pk, bucket=bucket, views=views) for (pk, bucket), views in counts.items()),
+                batch_size=ROLLUP_CHUNK_SIZE,
+            )
+        except Exception:
+            # Analytics are best effort: never fail the request that triggered the flush
+            logger.exception("Dropped %d buffered guideline view counts", sum(counts.values()))
+            return 0
+        return len(counts)
+
+
+view_recorder = ViewRecorder()
+atexit.register(view_recorder.flush)
+
+
+def rollup(now=None, retain_days=None):
+    """
+    Fold view events of completed hours into daily rows and delete them.
+
+    Daily rows older than ``retain_days`` are purged. Returns counts of
+    events folded, daily rows created/updated and daily rows purged.
+    """
+    cutoff = hour_bucket(now or timezone.now())
+    stats = {'events': 0, 'created': 0, 'updated': 0, 'purged': 0}
+    with transaction.atomic():
+        events = GuidelineViewEvent.objects.filter(bucket__lt=cutoff)
+        # Rows flushed while we run are left for the next rollup
+        last_id = events.aggregate(last=Max('id'))['last']
+        if last_id is not None:
+            events = events.filter(id__lte=last_id)
+            totals = list(
+                events.annotate(day=TruncDate('bucket', tzinfo=dt_timezone.utc))
+                .values('day', 'guideline_id')
+                .annotate(total=Sum('views'))
+                .order_by()
+            )
+            for start in range(0, len(totals), ROLLUP_CHUNK_SIZE):
+                _merge_daily(totals[start:start + ROLLUP_CHUNK_SIZE], stats)
+            stats['events'], _ = events.delete()
+        if retain_days:
+            oldest = cutoff.date() - timedelta(days=retain_days)
+            stats['purged'], _ = GuidelineViewDaily.objects.filter(day__lt=oldest).delete()
+    return stats
+
+
+def _merge_daily(totals, stats):
+    guideline_ids = {row['guideline_id'] for row in totals}
+    days = {row['day'] for row in totals}
+    meta = {
+        pk: (speciality, trust_id)
+        for pk, speciality, trust_id in Guideline.objects.filter(pk__in=guideline_ids)
+        .values_list('id', 'medical_speciality', 'trust_id')
+    }
+    existing = {
+        (row.day, row.guideline_id): row
+        for row in GuidelineViewDaily.objects.select_for_update()
+        .filter(day__in=days, guideline_id__in=guideline_ids)
+    }
+    to_create, to_update = [], []
+    for row in totals:
+        daily = existing.get((row['day'], row['guideline_id']))
+        if daily is not None:
+            daily.views += row['total']
+            to_update.append(daily)
+        else:
+            speciality, trust_id = meta.get(row['guideline_id'], (None, None))
+            to_create.append(GuidelineViewDaily(
+                day=row['day'], guideline_id=row['guideline_id'], views=row['total'],
+                medical_speciality=speciality, trust_id=trust_id,
+            ))
+    GuidelineViewDaily.objects.bulk_create(to_create)
+    GuidelineViewDaily.objects.bulk_update(to_update, ['views'])
+    stats['created'] += len(to_create)
+    stats['updated'] += len(to_update)
+
+
+def _trending_key(medical_speciality, trust, days, limit):
+    params = f'{medical_speciality}|{trust}|{days}|{limit}'
+    return f'guideline:trending:{hashlib.sha256(params.encode()).hexdigest()[:32]}'
+
+
+def trending(medical_speciality=None, trust=None, days=TRENDING_DEFAULT_DAYS, limit=10):
+    """
+    Return the ``limit`` most viewed guidelines over the last ``days`` days.
+
+    Each day's views are weighted by ``0.5 ** (age / TRENDING_HALF_LIFE_DAYS)``
+    (today has age 0). Optionally restricted to one speciality and/or trust.
+    Served from the shared cache for ``TRENDING_CACHE_TTL`` seconds.
+    """
+    cache = caches[getattr(settings, 'GUIDELINE_CACHE_ALIAS', 'default')]
+    key = _trending_key(medical_speciality, trust, days, limit)
+    result = cache.get(key)
+    if result is None:
+        result = _compute_trending(medical_speciality, trust, days, limit)
+        cache.set(key, result, getattr(settings, 'TRENDING_CACHE_TTL', 300))
+    return result
+
+
+def _compute_trending(medical_speciality, trust, days, limit):
+    today = timezone.now().astimezone(dt_timezone.utc).date()
+    queryset = GuidelineViewDaily.objects.filter(day__gt=today - timedelta(days=days))
+    if medical_speciality is not None:
+        queryset = queryset.filter(medical_speciality=medical_speciality)
+    if trust is not None:
+        queryset = queryset.filter(trust_id=trust)
+    weight = Case(
+        *(
+            When(day=today - timedelta(days=age), then=Value(0.5 ** (age / TRENDING_HALF_LIFE_DAYS)))
+            for age in range(days)
+        ),
+        default=Value(0.0),
+        output_field=FloatField(),
+    )
+    rows = list(
+        queryset.values('guideline_id')
+        .annotate(score=Sum(F('views') * weight, output_field=FloatField()), views=Sum('views'))
+        .order_by('-score', 'guideline_id')[:limit]
+    )
+    guidelines = Guideline.objects.only('id', 'name', 'medical_speciality', 'trust_id').in_bulk(
+        [row['guideline_id'] for row in rows]
+    )
+    return [
+        {
+            'id': row['guideline_id'],
+            'name': guidelines[row['guideline_id']].name,
+            'medical_speciality': guidelines[row['guideline_id']].medical_speciality,
+            'trust': guidelines[row['guideline_id']].trust_id,
+            'views': row['views'],
+            'score': round(row['score'], 3),
+        }
+        for row in rows
+        if row['guideline_id'] in guidelines
+    ]
@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class GuidelinesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.guidelines'
+
+    def ready(self):
+        from .cache import invalidate_guideline_cache
+        from .signals import guidelines_changed
+
+        guidelines_changed.connect(invalidate_guideline_cache, dispatch_uid='guidelines.invalidate_cache')
@@ -0,0 +1,369 @@
+"""
+apps/guidelines/benchmarks.py
+
+Micro-benchmarks for guideline serializers and GuidelineService.
+Run with ``python manage.py benchmark run -k 'guidelines.*'``.
+"""
+import itertools
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import CharField, Value
+from django.db.models.functions import Cast, Concat
+from django.test import override_settings
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from apps.core import signing
+from apps.core.benchmarking import Benchmark, register
+
+from . import analytics, changes, search, suggest, whitespace
+from .models import Guideline, GuidelineChange, GuidelineViewDaily, GuidelineViewEvent, Trust
+from .serializers import GuidelineMinimalSerializer, GuidelineSerializer
+from .services import GuidelineService
+
+SPECIALITIES = ['Cardiology', 'Dermatology', 'Emergency Medicine', 'Paediatrics', 'Respiratory']
+
+
+def create_trusts(count=10):
+    Trust.objects.bulk_create(Trust(id=i, name=f'Trust {i}') for i in range(1, count + 1))
+
+
+def create_guidelines(rows, trusts=10):
+    """Insert ``rows`` deterministic guidelines spread across ``trusts`` trusts."""
+    Guideline.objects.bulk_create(
+        (
+            Guideline(
+                name=f'Guideline {i}',
+                description=f'Management of condition {i} in adults and children.',
+                external_url=f'https://example.com/guidelines/{i}/guideline_{i}_v1.pdf',
+                metadata='{"source": "benchmark"}',
+                medical_speciality=SPECIALITIES[i % len(SPECIALITIES)],
+                trust_id=i % trusts + 1,
+                locality='North',
+                original_filename=f'guideline_{i}.pdf',
+                viewcount=i % 997,
+                version_number='1',
+                authors='A. Author',
+                creation_date='2024-01-01',
+                review_date='2027-01-01',
+            )
+            for i in range(rows)
+        ),
+        batch_size=5000,
+    )
+
+
+def clear_tables():
+    Guideline.objects.all().delete()
+    Trust.objects.all().delete()
+
+
+class _SerializerBenchmark(Benchmark):
+    params = {'rows': [1_000, 10_000, 100_000]}
+    serializer_class = None
+
+    def get_repeat(self):
+        return {1_000: 20, 10_000: 5, 100_000: 2}[self.kwargs['rows']]
+
+    def setup(self):
+        create_trusts()
+        create_guidelines(self.kwargs['rows'])
+
+    def run(self):
+        self.serializer_class(GuidelineService.list_guidelines(), many=True).data
+
+    def teardown(self):
+        clear_tables()
+
+
+@register
+class GuidelineSerializerBenchmark(_SerializerBenchmark):
+    name = 'guidelines.serializer.full'
+    serializer_class = GuidelineSerializer
+
+
+@register
+class GuidelineMinimalSerializerBenchmark(_SerializerBenchmark):
+    name = 'guidelines.serializer.minimal'
+    serializer_class = GuidelineMinimalSerializer
+
+
+@register
+class SignedURLSerializerBenchmark(Benchmark):
+    """Minimal list of 10k guidelines stored in our bucket, with and without S3 URL signing."""
+    name = 'guidelines.serializer.signed'
+    params = {'mode': ['unsigned', 'signed', 'signed_cold']}
+    repeat = 5
+
+    def setup(self):
+        create_trusts()
+        create_guidelines(10_000)
+        Guideline.objects.update(external_url=Concat(
+            Value(f'https://{settings.AWS_S3_CUSTOM_DOMAIN}/guidelines/'),
+            Cast('id', CharField()), Value('/guideline_v1.pdf'),
+        ))
+        self.settings = override_settings(DOCUMENT_URL_SIGNING=None if self.kwargs['mode'] == 'unsigned' else 's3')
+        self.settings.enable()
+
+    def setup_iteration(self):
+        if self.kwargs['mode'] == 'signed_cold':
+            # Every URL signed afresh, as on the first request of a new bucket
+            signing._sign.cache_clear()
+
+    def run(self):
+        GuidelineMinimalSerializer(GuidelineService.list_guidelines(), many=True).data
+
+    def teardown(self):
+        self.settings.disable()
+        clear_tables()
+
+
+# Typical ?fields= / ?expand= combinations: (fields param, expand param)
+FIELDSETS = {
+    'full': (None, None),
+    'card': ('id,name,medical_speciality', None),
+    'card_trust_id': ('id,name,medical_speciality,trust', None),
+    'card_trust': ('id,name,medical_speciality,trust', 'trust'),
+}
+
+
+@register
+class GuidelineFieldsetBenchmark(Benchmark):
+    """List query + serialization + JSON rendering of 10k rows; reports response bytes."""
+    name = 'guidelines.list.fieldset'
+    params = {'fieldset': list(FIELDSETS)}
+    repeat = 5
+
+    def setup(self):
+        create_trusts()
+        create_guidelines(10_000)
+        self.fields, self.expand = GuidelineService.parse_sparse_fields(*FIELDSETS[self.kwargs['fieldset']])
+
+    def run(self):
+        queryset = GuidelineService.list_guidelines(self.fields, self.expand)
+        data = GuidelineSerializer(queryset, many=True, fields=self.fields, expand=self.expand).data
+        self.extra['bytes'] = len(JSONRenderer().render(data))
+
+    def teardown(self):
+        clear_tables()
+
+
+SEARCH_QUERIES = ['cardiology', 'condition 4217 adults', 'management of children', 'respiratory north guideline']
+
+
+@register
+class GuidelineSearchBenchmark(Benchmark):
+    """BM25 top-20 query against a freshly built index; reports its size on disk."""
+    name = 'guidelines.search'
+    params = {'rows': [10_000, 100_000]}
+    number = len(SEARCH_QUERIES)
+
+    def setup(self):
+        create_trusts()
+        create_guidelines(self.kwargs['rows'])
+        self.directory = tempfile.mkdtemp(prefix='bench_search_')
+        search.build(self.directory, full=True)
+        self.index = search.SearchIndex(self.directory, search.read_manifest(self.directory))
+        self.queries = itertools.cycle(SEARCH_QUERIES)
+        self.extra['index_bytes'] = sum(
+            entry.stat().st_size for segment in self.index.segments for entry in os.scandir(segment.path)
+        )
+
+    def run(self):
+        self.index.search(next(self.queries), 20)
+
+    def teardown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+        clear_tables()
+
+
+SUGGEST_PREFIXES = ['g', 'gu', 'guideline 4', 'guideline 4217', 'ideline 99', 'zzz']
+
+
+@register
+class GuidelineSuggestBenchmark(Benchmark):
+    """Typeahead lookups (top 10) on a built suggestion index; reports its estimated size."""
+    name = 'guidelines.suggest'
+    params = {'rows': [10_000, 100_000]}
+    number = len(SUGGEST_PREFIXES)
+
+    def setup(self):
+        create_trusts()
+        create_guidelines(self.kwargs['rows'])
+        self.index = suggest.SuggestIndex(suggest._load())
+        self.prefixes = itertools.cycle(SUGGEST_PREFIXES)
+        self.extra['index_bytes'] = self.index.nbytes
+
+    def run(self):
+        self.index.search(next(self.prefixes), 10)
+
+    def teardown(self):
+        clear_tables()
+
+
+@register
+class GuidelineViewRecordBenchmark(Benchmark):
+    """Recording 1000 views over 100 guidelines, including the batched flushes."""
+    name = 'guidelines.views.record'
+    number = 1000
+
+    def setup(self):
+        self.recorder = analytics.ViewRecorder()
+        self.pks = itertools.cycle(range(1, 101))
+
+    def run(self):
+        self.recorder.record(next(self.pks))
+
+    def teardown(self):
+        self.recorder.flush()
+        GuidelineViewEvent.objects.all().delete()
+
+
+@register
+class GuidelineTrendingBenchmark(Benchmark):
+    """Uncached trending query over 30 days of rollups for 2k guidelines."""
+    name = 'guidelines.views.trending'
+    params = {'scope': ['all', 'speciality']}
+    repeat = 10
+
+    def setup(self):
+        create_trusts()
+        create_guidelines(2_000)
+        today = timezone.now().date()
+        GuidelineViewDaily.objects.bulk_create(
+            (
+                GuidelineViewDaily(
+                    day=today - timedelta(days=age), guideline_id=pk, views=(pk * 7 + age) % 50,
+                    medical_speciality=speciality, trust_id=trust_id,
+                )
+                for pk, speciality, trust_id in Guideline.objects.values_list('id', 'medical_speciality', 'trust_id')
+                for age in range(30)
+            ),
+            batch_size=5000,
+        )
+        self.speciality = SPECIALITIES[0] if self.kwargs['scope'] == 'speciality' else None
+
+    def run(self):
+        analytics._compute_trending(self.speciality, None, 30, 10)
+
+    def teardown(self):
+        GuidelineViewDaily.objects.all().delete()
+        clear_tables()
+
+
+@register
+class WhitespaceBatchBenchmark(Benchmark):
+    """Decode, apply and settle one batch of 100 Whitespace update messages."""
+    name = 'guidelines.whitespace.batch'
+    repeat = 10
+
+    def setup(self):
+        create_trusts()
+        create_guidelines(1_000)
+        self.queue = whitespace.InMemoryQueue()
+        self.consumer = whitespace.Consumer(self.queue, batch_size=100, concurrency=8, max_wait=0)
+        self.revision = itertools.count()
+
+    def setup_iteration(self):
+        revision = next(self.revision)
+        for pk in range(1, 101):
+            self.queue.send({
+                'type': 'guideline.upserted', 'id': pk,
+                'data': {'version_number': str(revision), 'trust': f'Trust {pk % 10 + 1}'},
+            })
+        self.messages = self.queue.receive(100, 0)
+
+    def run(self):
+        self.consumer.handle_batch(self.messages)
+
+    def teardown(self):
+        self.consumer.pool.shutdown()
+        clear_tables()
+
+
+class _ServiceBenchmark(Benchmark):
+    repeat = 10
+    number = 200
+
+    def setup(self):
+        create_trusts()
+        create_guidelines(1_000)
+
+    def teardown(self):
+        clear_tables()
+
+
+@register
+class GuidelineServiceCreateBenchmark(_ServiceBenchmark):
+    name = 'guidelines.service.create'
+
+    def run(self):
+        GuidelineService.create_guideline(
+            {'name': 'New guideline', 'medical_speciality': 'Cardiology'}, None
+        )
+
+
+@register
+class GuidelineServiceGetBenchmark(_ServiceBenchmark):
+    name = 'guidelines.service.get'
+
+    def setup_iteration(self):
+        self.pks = iter(Guideline.objects.values_list('pk', flat=True)[:self.number])
+
+    def run(self):
+        GuidelineService.get_guideline(next(self.pks))
+
+
+@register
+class GuidelineServiceUpdateBenchmark(_ServiceBenchmark):
+    name = 'guidelines.service.update'
+
+    def setup(self):
+        super().setup()
+        # A new value every iteration, since unchanged fields are not written
+        self.days = itertools.cycle(range(1, 29))
+
+    def setup_iteration(self):
+        self.guidelines = iter(list(Guideline.objects.all()[:self.number]))
+        self.review_date = f'2028-01-{next(self.days):02d}'
+
+    def run(self):
+        GuidelineService.update_guideline(next(self.guidelines), {'review_date': self.review_date})
+
+
+@register
+class GuidelineServiceDeleteBenchmark(_ServiceBenchmark):
+    name = 'guidelines.service.delete'
+
+    def setup_iteration(self):
+        create_guidelines(self.number)
+        self.guidelines = iter(list(Guideline.objects.order_by('-pk')[:self.number]))
+
+    def run(self):
+        GuidelineService.delete_guideline(next(self.guidelines))
+
+
+@register
+class ChangeFeedBenchmark(Benchmark):
+    """A 500-change page of the sync feed against catalogues of growing size."""
+    name = 'guidelines.changes.page'
+    params = {'rows': [10_000, 100_000]}
+    repeat = 20
+
+    def setup(self):
+        create_trusts()
+        create_guidelines(self.kwargs['rows'])
+        self.cursor = changes.latest()
+        pks = Guideline.objects.order_by('pk').values_list('pk', flat=True)[:500]
+        GuidelineService.set_fields(Guideline.objects.filter(pk__in=list(pks)), {'locality': 'South'})
+
+    def run(self):
+        GuidelineService.get_changes(self.cursor, 500)
+
+    def teardown(self):
+        GuidelineChange.objects.all().delete()
+        clear_tables()
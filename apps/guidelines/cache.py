@@ -0,0 +1,147 @@
+"""
+apps/guidelines/cache.py
+
+Two-tier cache for serialized guideline detail payloads.
+
+Tier 1 is a bounded LRU with a TTL inside each worker process. Tier 2 is the
+shared ``default`` Django cache (file-based or Redis), visible to all
+workers. Payloads are stored under the version the caller read from the
+database (the guideline's conditional-GET validators, built from its and
+its trust's ``row_version`` and ``updated_at``), which the detail view
+fetches anyway. A local hit therefore costs no shared-cache round trip, and once a
+guideline changes its old payloads are simply never asked for again, so a
+stale payload is never served after a write.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from prometheus_client import Counter, Gauge
+
+CACHE_EVENTS = Counter(
+    'guideline_cache_events_total',
+    'Guideline detail cache lookups by tier and result.',
+    ['tier', 'result'],
+)
+CACHE_EVICTIONS = Counter(
+    'guideline_cache_evictions_total',
+    'Entries evicted from the in-process guideline cache because it was full.',
+)
+CACHE_LOCAL_SIZE = Gauge(
+    'guideline_cache_local_entries',
+    'Entries held in the in-process guideline cache.',
+    multiprocess_mode='livesum',
+)
+
+_MISSING = object()
+
+
+class LocalLRUCache:
+    """Thread-safe LRU mapping with a per-entry TTL."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                return default
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+                CACHE_EVICTIONS.inc()
+            CACHE_LOCAL_SIZE.set(len(self._data))
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class GuidelineDetailCache:
+    """Look up, fill and invalidate cached guideline detail payloads."""
+
+    key_prefix = 'guideline:detail'
+
+    def __init__(self):
+        self.local = LocalLRUCache(
+            maxsize=getattr(settings, 'GUIDELINE_CACHE_LOCAL_MAXSIZE', 1024),
+            ttl=getattr(settings, 'GUIDELINE_CACHE_LOCAL_TTL', 60),
+        )
+        self.timeout = getattr(settings, 'GUIDELINE_CACHE_TTL', 3600)
+
+    @property
+    def shared(self):
+        return caches[getattr(settings, 'GUIDELINE_CACHE_ALIAS', 'default')]
+
+    def payload_key(self, pk, version):
+        return f'{self.key_prefix}:{pk}:{version}'
+
+    def get_or_set(self, pk, version, compute):
+        """Return the payload of ``pk`` at ``version``, calling ``compute()`` on a miss."""
+        pk = str(pk)
+        entry = self.local.get(pk)
+        if entry is not None and entry[0] == version:
+            CACHE_EVENTS.labels('local', 'hit').inc()
+            return entry[1]
+        CACHE_EVENTS.labels('local', 'miss').inc()
+
+        payload = self.shared.get(self.payload_key(pk, version))
+        if payload is not None:
+            CACHE_EVENTS.labels('shared', 'hit').inc()
+        else:
+            CACHE_EVENTS.labels('shared', 'miss').inc()
+            payload = compute()
+            self.shared.set(self.payload_key(pk, version), payload, self.timeout)
+        self.local.set(pk, (version, payload))
+        return payload
+
+    def invalidate(self, pks):
+        """
+        Drop this worker's copies of ``pks``.
+
+        Not needed for correctness (a changed guideline has a new version);
+        it frees the entries early. Other workers' copies age out.
+        """
+        for pk in pks:
+            self.local.delete(str(pk))
+
+    def stats(self):
+        return {
+            'local_entries': len(self.local),
+            'local_maxsize': self.local.maxsize,
+            'local_evictions': self.local.evictions,
+        }
+
+
+detail_cache = GuidelineDetailCache()
+
+
+def invalidate_guideline_cache(sender, action, pks, **kwargs):
+    """``guidelines_changed`` receiver."""
+    if action != 'create':
+        detail_cache.invalidate(pks)
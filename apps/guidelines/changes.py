@@ -0,0 +1,133 @@
+"""
+apps/guidelines/changes.py
+
+Incremental sync feed of the guideline catalogue.
+
+Every write made through GuidelineService / TrustService appends one
+GuidelineChange row per object inside the writing transaction, so the feed
+commits (or rolls back) with the change itself. ``seq`` is the cursor:
+clients take a starting cursor from the ``X-Changes-Cursor`` header of the
+guideline list, then poll ``/api/guidelines/changes/?since=<seq>`` and apply
+the deltas. Each poll costs one range scan of the primary key from the
+cursor, whatever the size of the catalogue.
+
+Sequence values are allocated at INSERT but become visible at COMMIT. On
+PostgreSQL, writers take a transaction-scoped advisory lock before
+appending, so rows become visible in ``seq`` order and a reader never moves
+its cursor past a row that commits later. SQLite serialises writers anyway.
+
+Compaction (``manage.py compact_guideline_changes``) removes rows superseded
+by a newer row for the same object, which never changes what a client ends
+up with, and truncates rows older than the retention window. Cursors from
+before the truncation point get 410 and must resync from the full list.
+"""
+from datetime import timedelta
+
+from django.db import connections, router, transaction
+from django.db.models import Exists, Max, OuterRef
+from django.utils import timezone
+
+from .models import GuidelineChange, GuidelineChangeCompaction
+
+CURSOR_HEADER = 'X-Changes-Cursor'
+RETENTION_DAYS = 30
+COMPACT_BATCH_SIZE = 5000
+# pg_advisory_xact_lock key serialising writers to the feed
+_LOCK_KEY = 0x67636873
+
+
+def record(kind, action, pks):
+    """Append a feed row per id in ``pks``; call inside the writing transaction."""
+    if not pks:
+        return
+    using = router.db_for_write(GuidelineChange)
+    connection = connections[using]
+    if connection.vendor == 'postgresql' and connection.in_atomic_block:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_xact_lock(%s)', [_LOCK_KEY])
+    now = timezone.now()
+    GuidelineChange.objects.using(using).bulk_create(
+        [GuidelineChange(kind=kind, object_id=pk, action=action, changed_at=now) for pk in pks],
+        batch_size=1000,
+    )
+
+
+def floor():
+    """Highest seq compaction may have removed; older cursors can't be served."""
+    return GuidelineChangeCompaction.objects.order_by('-id').values_list('truncated_through', flat=True).first() or 0
+
+
+def latest():
+    """The current cursor: the newest seq handed out (or truncated)."""
+    newest = GuidelineChange.objects.aggregate(seq=Max('seq'))['seq'] or 0
+    return max(newest, floor())
+
+
+def read(since, limit):
+    """
+    Return ``(entries, next, has_more)`` for the rows after cursor ``since``,
+    or None if the cursor expired (or is ahead of this database).
+
+    ``entries`` are ``(seq, kind, object_id, action)``, one per object (its
+    newest row in the page), in seq order. ``next`` is the cursor to send
+    next time.
+    """
+    if since < floor():
+        return None
+    rows = list(
+        GuidelineChange.objects.filter(seq__gt=since)
+        .order_by('seq')
+        .values_list('seq', 'kind', 'object_id', 'action')[:limit + 1]
+    )
+    if not rows and since > latest():
+        return None
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    newest = {}
+    for row in rows:
+        newest.pop(row[1:3], None)
+        newest[row[1:3]] = row
+    return list(newest.values()), rows[-1][0] if rows else since, has_more
+
+
+def _delete_ranges(queryset, start, stop, batch_size):
+    """Delete the rows of ``queryset`` with ``start < seq <= stop``, ``batch_size`` seqs per DELETE."""
+    deleted = 0
+    first = GuidelineChange.objects.filter(seq__gt=start).order_by('seq').values_list('seq', flat=True).first()
+    start = max(start, (first or stop + 1) - 1)
+    while start < stop:
+        with transaction.atomic():
+            count, _ = queryset.filter(seq__gt=start, seq__lte=min(start + batch_size, stop)).delete()
+        deleted += count
+        start += batch_size
+    return deleted
+
+
+def compact(keep_days=RETENTION_DAYS, batch_size=COMPACT_BATCH_SIZE, dry_run=False):
+    """
+    Drop rows older than ``keep_days`` and rows superseded by a newer row
+    for the same object.
+
+    Works through the feed in seq ranges of ``batch_size``, one DELETE per
+    range. Returns ``(truncated, superseded, truncated_through)``.
+    """
+    cutoff = timezone.now() - timedelta(days=keep_days)
+    end = GuidelineChange.objects.aggregate(seq=Max('seq'))['seq'] or 0
+    first_kept = GuidelineChange.objects.filter(changed_at__gte=cutoff).order_by('seq').values_list('seq', flat=True).first()
+    through = max(end if first_kept is None else first_kept - 1, floor())
+
+    later = GuidelineChange.objects.filter(kind=OuterRef('kind'), object_id=OuterRef('object_id'), seq__gt=OuterRef('seq'))
+    superseded = GuidelineChange.objects.filter(Exists(later))
+    if dry_run:
+        return (
+            GuidelineChange.objects.filter(seq__lte=through).count(),
+            superseded.filter(seq__gt=through).count(),
+            through,
+        )
+    # Raise the floor before deleting, so readers get 410 rather than a gap
+    run = GuidelineChangeCompaction.objects.create(ran_at=timezone.now(), truncated_through=through)
+    truncated = _delete_ranges(GuidelineChange.objects.all(), 0, through, batch_size)
+    removed = _delete_ranges(superseded, through, end, batch_size)
+    run.removed = truncated + removed
+    run.save(update_fields=['removed'])
+    return truncated, removed, through
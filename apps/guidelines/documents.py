@@ -0,0 +1,68 @@
+"""
+apps/guidelines/documents.py
+
+Guideline documents streamed from a local LRU disk cache in front of
+``default_storage`` (S3), so repeat downloads cost no S3 egress and access
+goes through our authentication instead of public bucket URLs.
+
+Keys are versioned (uploads are saved as ``<name>_v<N>.<ext>`` and never
+overwritten), so a cached file never goes stale.
+"""
+import mimetypes
+import shutil
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+
+from apps.core import http
+from apps.core.filecache import DiskLRUCache
+
+from .utils import sanitize_filename
+
+document_cache = DiskLRUCache(
+    'documents',
+    getattr(settings, 'DOCUMENT_CACHE_DIR', '/tmp/djangomvp_documents'),
+    getattr(settings, 'DOCUMENT_CACHE_MAX_BYTES', 2 * 1024 ** 3),
+)
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def _download(key):
+    def fetch(out):
+        if not default_storage.exists(key):
+            raise FileNotFoundError(key)
+        with default_storage.open(key, 'rb') as source:
+            shutil.copyfileobj(source, out, CHUNK_SIZE)
+    return fetch
+
+
+def document_path(key):
+    """
+    Return the local path of the stored object ``key``, downloading it on a miss.
+
+    Raises FileNotFoundError if the object doesn't exist in storage.
+    """
+    return document_cache.get_or_fetch(key, _download(key))
+
+
+def document_response(request, key, filename=None):
+    """
+    Return a (ranged) FileResponse for the stored object ``key``.
+
+    Raises FileNotFoundError if the object doesn't exist in storage.
+    """
+    content_type = mimetypes.guess_type(key)[0] or 'application/octet-stream'
+    etag = f'"{document_cache.entry_name(key)[:32]}"'
+    filename = sanitize_filename(filename or key.rsplit('/', 1)[-1])
+    for attempt in range(2):
+        path = document_path(key)
+        try:
+            return http.file_response(
+                request, path, content_type, etag=etag, filename=filename,
+                cache_control={'private': True, 'max_age': 3600},
+            )
+        except FileNotFoundError:
+            # Evicted between lookup and open; fetch again once
+            if attempt:
+                raise
@@ -0,0 +1,102 @@
+"""
+apps/guidelines/geo.py
+
+Trust locations and radius queries.
+
+Trusts carry WGS84 coordinates (``latitude`` / ``longitude``, loaded by
+``manage.py import_trust_locations``). ``trusts_near()`` answers a radius
+query in two steps: a bounding box around the point, which is a range scan of
+the ``trust_location_idx`` index (latitude, longitude), then the exact
+great-circle (haversine) distance of the trusts inside the box. No spatial
+extension is needed, and the cost grows with the number of trusts near the
+point rather than with the size of the table.
+"""
+import math
+
+from django.db.models import Case, IntegerField, Q, Value, When
+from rest_framework.exceptions import ValidationError
+
+from .models import Trust
+
+EARTH_RADIUS_KM = 6371.0088
+NEAR_DEFAULT_RADIUS_KM = 25
+NEAR_MAX_RADIUS_KM = 500
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    """Great-circle distance in kilometres between two points given in degrees."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi, dlambda = phi2 - phi1, math.radians(lng2 - lng1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bounding_box(lat, lng, radius_km):
+    """
+    Return ``(min_lat, max_lat, lng_ranges)`` enclosing the circle.
+
+    ``lng_ranges`` is a list of ``(min_lng, max_lng)`` (two when the box
+    crosses the antimeridian), or None when the circle reaches a pole and
+    every longitude qualifies.
+    """
+    dlat = math.degrees(radius_km / EARTH_RADIUS_KM)
+    min_lat, max_lat = lat - dlat, lat + dlat
+    if min_lat <= -90 or max_lat >= 90:
+        return max(min_lat, -90.0), min(max_lat, 90.0), None
+    dlng = math.degrees(math.asin(min(1.0, math.sin(radius_km / EARTH_RADIUS_KM) / math.cos(math.radians(lat)))))
+    min_lng, max_lng = lng - dlng, lng + dlng
+    if min_lng < -180:
+        return min_lat, max_lat, [(min_lng + 360, 180.0), (-180.0, max_lng)]
+    if max_lng > 180:
+        return min_lat, max_lat, [(min_lng, 180.0), (-180.0, max_lng - 360)]
+    return min_lat, max_lat, [(min_lng, max_lng)]
+
+
+def trusts_near(lat, lng, radius_km):
+    """Return ``[(trust_id, distance_km)]`` of trusts within ``radius_km``, nearest first."""
+    min_lat, max_lat, lng_ranges = bounding_box(lat, lng, radius_km)
+    queryset = Trust.objects.filter(latitude__range=(min_lat, max_lat))
+    if lng_ranges is not None:
+        box = Q()
+        for min_lng, max_lng in lng_ranges:
+            box |= Q(longitude__range=(min_lng, max_lng))
+        queryset = queryset.filter(box)
+    found = []
+    for pk, trust_lat, trust_lng in queryset.values_list('id', 'latitude', 'longitude'):
+        distance = haversine_km(lat, lng, trust_lat, trust_lng)
+        if distance <= radius_km:
+            found.append((pk, distance))
+    found.sort(key=lambda item: (item[1], item[0]))
+    return found
+
+
+def distance_ordering(nearby):
+    """Order guidelines by the distance of their trust (``nearby`` from ``trusts_near``)."""
+    return Case(
+        *(When(trust_id=pk, then=Value(rank)) for rank, (pk, _) in enumerate(nearby)),
+        default=Value(len(nearby)),
+        output_field=IntegerField(),
+    )
+
+
+def parse_near(near, radius=None):
+    """
+    Validate ``?near=lat,lng`` and ``?radius=`` (kilometres).
+
+    Returns ``(lat, lng, radius_km)``; raises ValidationError (400).
+    """
+    try:
+        lat, lng = (float(part) for part in near.split(','))
+    except ValueError:
+        raise ValidationError({'near': ['Expected "latitude,longitude" in decimal degrees.']})
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        raise ValidationError({'near': ['Latitude must be within ±90 and longitude within ±180.']})
+    if radius is None or radius == '':
+        return lat, lng, NEAR_DEFAULT_RADIUS_KM
+    try:
+        radius_km = float(radius)
+    except ValueError:
+        radius_km = -1
+    if not 0 < radius_km <= NEAR_MAX_RADIUS_KM:
+        raise ValidationError({'radius': [f'Expected a distance in km, at most {NEAR_MAX_RADIUS_KM}.']})
+    return lat, lng, radius_km
@@ -0,0 +1,212 @@
+"""
+apps/guidelines/history.py
+
+Change history for guidelines, recorded by GuidelineService.
+
+History rows are not written as each change happens. They are collected in a
+per-transaction buffer and inserted with one ``bulk_create`` when the
+transaction commits, so a write costs a single extra INSERT per transaction
+(however many guidelines it touched) and a rolled-back transaction leaves no
+history behind. A savepoint (nested ``atomic()``) gets its own buffer, whose
+flush Django discards if the savepoint rolls back.
+
+Row formats (``GuidelineHistory.changes``):
+
+- ``+`` created / ``=`` compacted snapshot: ``{field: value}`` for every field
+- ``~`` changed: ``{field: [old, new]}`` for the changed fields only
+- ``-`` deleted: ``{}``
+"""
+import threading
+from datetime import datetime
+
+from django.db import router, transaction
+from django.utils import timezone
+from simple_history.models import HistoricalRecords
+
+from .models import Guideline, GuidelineHistory
+
+_local = threading.local()
+
+# Bookkeeping columns maintained by GuidelineService, not part of the content
+# (metadata_json is derived from metadata)
+UNTRACKED_FIELDS = {'updated_at', 'row_version', 'metadata_json'}
+
+
+def tracked_fields():
+    return [f for f in Guideline._meta.concrete_fields if not f.primary_key and f.name not in UNTRACKED_FIELDS]
+
+
+def snapshot(guideline):
+    """Return ``{attname: value}`` for every tracked field of ``guideline``."""
+    return {f.attname: f.value_from_object(guideline) for f in tracked_fields()}
+
+
+def diff(before, after):
+    """Return ``{attname: [old, new]}`` for the fields that differ."""
+    return {name: [before.get(name), value] for name, value in after.items() if before.get(name) != value}
+
+
+def _current_user():
+    # Set by simple_history.middleware.HistoryRequestMiddleware
+    request = getattr(HistoricalRecords.context, 'request', None)
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return user
+    return None
+
+
+def _pending(connection, buffer):
+    """True if ``buffer``'s flush is queued and is discarded by a rollback of any active savepoint."""
+    active = set(connection.savepoint_ids)
+    return any(
+        getattr(func, 'buffer', None) is buffer and active <= sids
+        for sids, func, _ in connection.run_on_commit
+    )
+
+
+def _buffer_for(connection, using):
+    """Return the buffer of the current transaction or savepoint, registering its flush on first use."""
+    buffers = _local.__dict__.setdefault('buffers', {})
+    buffer = buffers.get(using)
+    if buffer is not None and _pending(connection, buffer):
+        return buffer
+    buffer = buffers[using] = []
+
+    def flush():
+        if buffers.get(using) is buffer:
+            del buffers[using]
+        GuidelineHistory.objects.using(using).bulk_create(buffer)
+
+    flush.buffer = buffer
+    transaction.on_commit(flush, using=using)
+    return buffer
+
+
+def record(history_type, guideline_id, changes, user=None):
+    """Queue a history row; it is written when the current transaction commits."""
+    using = router.db_for_write(GuidelineHistory)
+    entry = GuidelineHistory(
+        guideline_id=guideline_id,
+        history_type=history_type,
+        history_date=timezone.now(),
+        history_user=user if user is not None else _current_user(),
+        changes=changes,
+    )
+    connection = transaction.get_connection(using)
+    if not connection.in_atomic_block:
+        # Autocommit: the change is already committed
+        entry.save(using=using)
+        return
+    _buffer_for(connection, using).append(entry)
+
+
+def record_created(guideline, user=None):
+    record(GuidelineHistory.CREATED, guideline.pk, snapshot(guideline), user)
+
+
+def record_changed(guideline, changes, user=None):
+    if changes:
+        record(GuidelineHistory.CHANGED, guideline.pk, changes, user)
+
+
+def record_deleted(pk, user=None):
+    record(GuidelineHistory.DELETED, pk, {}, user)
+
+
+def fold(rows, state=None):
+    """
+    Apply history ``rows`` (oldest first) to ``state``.
+
+    Returns the resulting ``{attname: value}`` dict, or None if the last row
+    deleted the guideline (or there is no snapshot to start from).
+    """
+    for row in rows:
+        if row.history_type in (GuidelineHistory.CREATED, GuidelineHistory.SNAPSHOT):
+            state = dict(row.changes)
+        elif row.history_type == GuidelineHistory.DELETED:
+            state = None
+        elif state is not None:
+            state.update({name: new for name, (old, new) in row.changes.items()})
+    return state
+
+
+def guideline_as_of(pk, when):
+    """
+    Return the guideline's fields as they were at ``when``, or None.
+
+    Uses the (guideline_id, history_date) index twice: once to find the
+    newest full snapshot at or before ``when`` and once to read the diffs
+    between it and ``when``. Guidelines that predate history recording have
+    no snapshot; for those the current row is walked back through the diffs
+    made after ``when``.
+    """
+    history = GuidelineHistory.objects.filter(guideline_id=pk)
+    base = (
+        history.filter(
+            history_date__lte=when,
+            history_type__in=[GuidelineHistory.CREATED, GuidelineHistory.SNAPSHOT],
+        )
+        .order_by('-history_date', '-id')
+        .first()
+    )
+    if base is not None:
+        rows = history.filter(history_date__gt=base.history_date, history_date__lte=when).order_by('history_date', 'id')
+        return fold(rows, dict(base.changes))
+
+    if history.filter(history_date__lte=when, history_type=GuidelineHistory.DELETED).exists():
+        return None
+    guideline = Guideline.objects.filter(pk=pk).first()
+    if guideline is None:
+        return None
+    state = snapshot(guideline)
+    later = history.filter(history_date__gt=when).order_by('-history_date', '-id')
+    for row in later:
+        if row.history_type == GuidelineHistory.CREATED:
+            return None
+        if row.history_type == GuidelineHistory.CHANGED:
+            state.update({name: old for name, (old, new) in row.changes.items()})
+    return state
+
+
+def compact(guideline_id, before):
+    """
+    Collapse the guideline's history rows older than ``before``.
+
+    If the newest of them is a deletion only that ``-`` row is kept. With a
+    full snapshot among them they are replaced by one ``=`` snapshot;
+    without one, the diffs are merged into a single ``~`` row. Returns the
+    number of rows removed.
+    """
+    rows = list(
+        GuidelineHistory.objects.filter(guideline_id=guideline_id, history_date__lt=before).order_by('history_date', 'id')
+    )
+    if len(rows) < 2:
+        return 0
+    last = rows[-1]
+    if last.history_type == GuidelineHistory.DELETED:
+        keep = GuidelineHistory(guideline_id=guideline_id, history_type=GuidelineHistory.DELETED, changes={})
+    elif any(row.history_type in (GuidelineHistory.CREATED, GuidelineHistory.SNAPSHOT) for row in rows):
+        keep = GuidelineHistory(guideline_id=guideline_id, history_type=GuidelineHistory.SNAPSHOT, changes=fold(rows))
+    else:
+        merged = {}
+        for row in rows:
+            if row.history_type != GuidelineHistory.CHANGED:
+                continue
+            for name, (old, new) in row.changes.items():
+                merged[name] = [merged[name][0] if name in merged else old, new]
+        merged = {name: pair for name, pair in merged.items() if pair[0] != pair[1]}
+        keep = GuidelineHistory(guideline_id=guideline_id, history_type=GuidelineHistory.CHANGED, changes=merged)
+    keep.history_date = last.history_date
+    keep.history_user_id = last.history_user_id
+    with transaction.atomic():
+        GuidelineHistory.objects.filter(pk__in=[row.pk for row in rows]).delete()
+        keep.save()
+    return len(rows) - 1
+
+
+def parse_as_of(value):
+    """Parse an ISO 8601 date or datetime; naive values use the current timezone."""
+    when = datetime.fromisoformat(value)
+    if timezone.is_naive(when):
+        when = timezone.make_aware(when)
+    return when
@@ -0,0 +1,38 @@
+"""
+Build or refresh the BM25 guideline search index (apps.guidelines.search).
+
+By default only guidelines changed since the previous run are indexed, into
+a new segment; deleted guidelines are masked. ``--full`` (or reaching the
+segment limit) rebuilds everything into a single segment. Workers pick up
+the new index within a few seconds. Run it periodically, e.g. every few
+minutes:
+
+    python manage.py build_search_index
+    python manage.py build_search_index --full --with-documents
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from apps.guidelines import search
+
+
+class Command(BaseCommand):
+    help = "Build or incrementally refresh the guideline search index."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Rebuild the whole index into one segment.')
+        parser.add_argument(
+            '--with-documents', action='store_true',
+            help='Also index the text of guideline PDFs kept in our storage.',
+        )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        directory = search.search_index.directory
+        stats = search.build(directory, full=options['full'], with_documents=options['with_documents'])
+        self.stdout.write(self.style.SUCCESS(
+            f"{stats['mode'].capitalize()} build of {directory} in "
+            f"{time.perf_counter() - started:.2f}s: {stats['documents']} guideline(s) indexed, "
+            f"{stats['deleted']} removed, {stats['segments']} segment(s)."
+        ))
@@ -0,0 +1,38 @@
+"""
+Apply the retention policy of the guideline sync feed (apps.guidelines.changes).
+
+Rows older than ``--keep-days`` are removed and the feed's floor is raised
+past them: clients with an older cursor get 410 and reload the list. Newer
+rows superseded by a later row for the same object are removed too, which
+leaves the feed holding at most one row per object changed inside the
+window.
+
+Run it periodically, e.g. nightly:
+
+    python manage.py compact_guideline_changes --keep-days 30
+"""
+from django.core.management.base import BaseCommand
+
+from apps.guidelines import changes
+
+
+class Command(BaseCommand):
+    help = "Truncate the guideline change feed to N days and drop superseded rows."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep-days', type=int, default=changes.RETENTION_DAYS)
+        parser.add_argument('--batch-size', type=int, default=changes.COMPACT_BATCH_SIZE)
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        truncated, superseded, through = changes.compact(
+            options['keep_days'], options['batch_size'], dry_run=options['dry_run']
+        )
+        if options['dry_run']:
+            self.stdout.write(
+                f"Would remove {truncated} row(s) up to seq {through} and {superseded} superseded row(s)."
+            )
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f"Removed {truncated} row(s) up to seq {through} and {superseded} superseded row(s)."
+        ))
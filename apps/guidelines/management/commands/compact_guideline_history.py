@@ -0,0 +1,62 @@
+"""
+Collapse old guideline history rows and apply the retention policy.
+
+For every guideline with more than one history row older than
+``--older-than-days``, those rows are replaced by a single snapshot (see
+``apps.guidelines.history.compact``). Recent history is left untouched, so
+"as of" lookups stay exact inside the window and resolve to the compacted
+state before it. ``--purge-deleted`` additionally drops all history of
+guidelines deleted before the cutoff.
+
+Run it periodically, e.g. nightly:
+
+    python manage.py compact_guideline_history --older-than-days 90
+"""
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+from django.utils import timezone
+
+from apps.guidelines import history
+from apps.guidelines.models import GuidelineHistory
+
+
+class Command(BaseCommand):
+    help = "Collapse guideline history older than N days into snapshots."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=int, default=90)
+        parser.add_argument(
+            '--purge-deleted', action='store_true',
+            help='Remove all history of guidelines deleted before the cutoff.',
+        )
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['older_than_days'])
+        old = GuidelineHistory.objects.filter(history_date__lt=cutoff)
+        guideline_ids = list(
+            old.values('guideline_id').annotate(rows=Count('id')).filter(rows__gt=1).values_list('guideline_id', flat=True)
+        )
+        purge_ids = []
+        if options['purge_deleted']:
+            purge_ids = list(
+                old.filter(history_type=GuidelineHistory.DELETED).values_list('guideline_id', flat=True).distinct()
+            )
+
+        if options['dry_run']:
+            self.stdout.write(
+                f"Would compact {len(guideline_ids)} guideline(s) and purge {len(purge_ids)} deleted guideline(s) "
+                f"older than {cutoff:%Y-%m-%d}."
+            )
+            return
+
+        purged = 0
+        if purge_ids:
+            purged, _ = GuidelineHistory.objects.filter(guideline_id__in=purge_ids).delete()
+        removed = sum(history.compact(pk, cutoff) for pk in set(guideline_ids) - set(purge_ids))
+        self.stdout.write(self.style.SUCCESS(
+            f"Compacted {len(set(guideline_ids) - set(purge_ids))} guideline(s), removed {removed} row(s); "
+            f"purged {purged} row(s) of {len(purge_ids)} deleted guideline(s)."
+        ))
@@ -0,0 +1,71 @@
+"""
+Consume the Whitespace change queue and apply it to guidelines and trusts.
+
+See apps.guidelines.whitespace for the message format and delivery
+guarantees. Runs until SIGTERM/SIGINT, finishing the current batch first:
+
+    python manage.py consume_whitespace --batch-size 100 --concurrency 8
+
+``--queue-class`` (or the ``WHITESPACE_QUEUE_CLASS`` setting) selects the
+queue implementation; the default is Azure Service Bus.
+"""
+import signal
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.module_loading import import_string
+
+from apps.guidelines.whitespace import Consumer
+
+
+class Command(BaseCommand):
+    help = "Consume Whitespace queue messages in batches and apply them as bulk upserts."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='Messages received per batch.')
+        parser.add_argument(
+            '--prefetch', type=int, default=None,
+            help='Messages the client buffers ahead of the current batch (default: batch size).',
+        )
+        parser.add_argument('--concurrency', type=int, default=8, help='Threads decoding/fetching a batch.')
+        parser.add_argument('--max-wait', type=float, default=5.0, help='Seconds to wait for a batch to fill.')
+        parser.add_argument('--max-batches', type=int, default=None, help='Stop after this many batches.')
+        parser.add_argument('--exit-when-idle', action='store_true', help='Stop when the queue is empty.')
+        parser.add_argument(
+            '--queue-class',
+            default=getattr(settings, 'WHITESPACE_QUEUE_CLASS', 'apps.guidelines.whitespace.ServiceBusQueue'),
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1 or options['concurrency'] < 1:
+            raise CommandError('--batch-size and --concurrency must be at least 1.')
+        queue_class = import_string(options['queue_class'])
+        if queue_class.__name__ == 'ServiceBusQueue' and not (
+            getattr(settings, 'AZURE_SERVICE_BUS_CONNECTION_STRING', None)
+            and getattr(settings, 'WHITESPACE_QUEUE_NAME', None)
+        ):
+            raise CommandError('AZURE_SERVICE_BUS_CONNECTION_STRING and WHITESPACE_QUEUE_NAME must be set.')
+        prefetch = options['prefetch'] if options['prefetch'] is not None else options['batch_size']
+        consumer = Consumer(
+            queue_class(prefetch=prefetch),
+            batch_size=options['batch_size'],
+            concurrency=options['concurrency'],
+            max_wait=options['max_wait'],
+        )
+
+        def shutdown(signum, frame):
+            self.stderr.write(f"Received {signal.Signals(signum).name}; finishing the current batch")
+            consumer.stop()
+
+        signal.signal(signal.SIGTERM, shutdown)
+        signal.signal(signal.SIGINT, shutdown)
+
+        started = time.perf_counter()
+        totals = consumer.run(max_batches=options['max_batches'], exit_when_idle=options['exit_when_idle'])
+        elapsed = time.perf_counter() - started
+        handled = sum(totals.values())
+        self.stdout.write(self.style.SUCCESS(
+            f"Handled {handled} message(s) in {elapsed:.1f}s ({handled / elapsed if elapsed else 0:.1f}/s): "
+            f"{totals['applied']} applied, {totals['dead_lettered']} dead-lettered, {totals['abandoned']} abandoned."
+        ))
@@ -0,0 +1,143 @@
+"""
+Load trust coordinates from a local reference file (apps.guidelines.geo).
+
+The trusts file is a CSV with a ``name`` column (matched exactly against
+Trust.name) and either ``latitude``/``longitude`` columns or a ``postcode``
+column. Postcodes are geocoded offline against ``--postcodes``, a CSV with
+``postcode``, ``latitude`` and ``longitude`` columns (e.g. an extract of the
+ONS Postcode Directory). Only the postcodes the trusts file needs are kept
+from it, so the directory can be streamed whatever its size.
+
+    python manage.py import_trust_locations trusts.csv
+    python manage.py import_trust_locations etr.csv --postcodes onspd.csv
+
+Rows are matched and written in batches of ``--batch-size`` trusts: one
+SELECT and one bulk UPDATE per batch.
+"""
+import csv
+import itertools
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from apps.guidelines.models import Trust
+
+LATITUDE_COLUMNS = ('latitude', 'lat')
+LONGITUDE_COLUMNS = ('longitude', 'lng', 'lon', 'long')
+
+
+def _normalize_postcode(value):
+    return ''.join((value or '').split()).upper()
+
+
+def _column(header, names, path, required=True):
+    """Return the first of ``names`` present in ``header`` (case-insensitive)."""
+    columns = {name.strip().lower(): name for name in header or ()}
+    for name in names:
+        if name in columns:
+            return columns[name]
+    if required:
+        raise CommandError(f"{path}: expected a column named {' or '.join(names)}.")
+    return None
+
+
+def _coordinates(lat, lng):
+    try:
+        lat, lng = float(lat), float(lng)
+    except (TypeError, ValueError):
+        return None
+    if -90 <= lat <= 90 and -180 <= lng <= 180:
+        return lat, lng
+    return None
+
+
+class Command(BaseCommand):
+    help = "Set trust latitude/longitude from a CSV of coordinates or postcodes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV with name and latitude/longitude or postcode columns.')
+        parser.add_argument('--postcodes', help='CSV of postcode, latitude, longitude used to geocode postcodes.')
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--dry-run', action='store_true', help='Match and report without writing.')
+
+    def handle(self, *args, **options):
+        rows = self.read_trusts(options['path'])
+        postcodes = {row['postcode'] for row in rows if row['coordinates'] is None and row['postcode']}
+        if postcodes:
+            if not options['postcodes']:
+                raise CommandError(f"{len(postcodes)} trust(s) have only a postcode: pass --postcodes.")
+            located = self.read_postcodes(options['postcodes'], postcodes)
+            for row in rows:
+                if row['coordinates'] is None:
+                    row['coordinates'] = located.get(row['postcode'])
+
+        stats = {'updated': 0, 'unchanged': 0, 'unknown': [], 'ungeocoded': []}
+        batches = iter(rows)
+        while batch := list(itertools.islice(batches, options['batch_size'])):
+            self.import_batch(batch, stats, options['dry_run'])
+
+        verb = 'Would update' if options['dry_run'] else 'Updated'
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {stats['updated']} trust(s); {stats['unchanged']} unchanged, "
+            f"{len(stats['unknown'])} not found, {len(stats['ungeocoded'])} without coordinates."
+        ))
+        for label, names in (('Not found', stats['unknown']), ('Without coordinates', stats['ungeocoded'])):
+            if names:
+                self.stdout.write(f"{label}: {', '.join(names[:20])}{' ...' if len(names) > 20 else ''}")
+
+    def read_trusts(self, path):
+        with open(path, newline='', encoding='utf-8-sig') as handle:
+            reader = csv.DictReader(handle)
+            name = _column(reader.fieldnames, ('name',), path)
+            lat = _column(reader.fieldnames, LATITUDE_COLUMNS, path, required=False)
+            lng = _column(reader.fieldnames, LONGITUDE_COLUMNS, path, required=False)
+            postcode = _column(reader.fieldnames, ('postcode',), path, required=False)
+            if postcode is None and (lat is None or lng is None):
+                raise CommandError(f"{path}: expected latitude/longitude or postcode columns.")
+            rows = []
+            for record in reader:
+                if not (record.get(name) or '').strip():
+                    continue
+                rows.append({
+                    'name': record[name].strip(),
+                    'coordinates': _coordinates(record.get(lat), record.get(lng)) if lat and lng else None,
+                    'postcode': _normalize_postcode(record.get(postcode)) if postcode else '',
+                })
+        return rows
+
+    def read_postcodes(self, path, wanted):
+        """Return ``{postcode: (lat, lng)}`` for the ``wanted`` postcodes, streaming ``path``."""
+        located = {}
+        with open(path, newline='', encoding='utf-8-sig') as handle:
+            reader = csv.DictReader(handle)
+            code = _column(reader.fieldnames, ('postcode', 'pcds', 'pcd'), path)
+            lat = _column(reader.fieldnames, LATITUDE_COLUMNS, path)
+            lng = _column(reader.fieldnames, LONGITUDE_COLUMNS, path)
+            for record in reader:
+                postcode = _normalize_postcode(record[code])
+                if postcode in wanted:
+                    coordinates = _coordinates(record[lat], record[lng])
+                    if coordinates is not None:
+                        located[postcode] = coordinates
+                        if len(located) == len(wanted):
+                            break
+        return located
+
+    def import_batch(self, batch, stats, dry_run):
+        trusts = Trust.objects.in_bulk([row['name'] for row in batch], field_name='name')
+        changed = []
+        for row in batch:
+            trust = trusts.get(row['name'])
+            if trust is None:
+                stats['unknown'].append(row['name'])
+            elif row['coordinates'] is None:
+                stats['ungeocoded'].append(row['name'])
+            elif (trust.latitude, trust.longitude) == row['coordinates']:
+                stats['unchanged'] += 1
+            else:
+                trust.latitude, trust.longitude = row['coordinates']
+                changed.append(trust)
+        stats['updated'] += len(changed)
+        if changed and not dry_run:
+            with transaction.atomic():
+                Trust.objects.bulk_update(changed, ['latitude', 'longitude'])
@@ -0,0 +1,79 @@
+"""
+Fill Guideline.metadata_json from the free-text metadata (apps.guidelines.metadata).
+
+Walks the table in primary-key order, ``--batch-size`` rows at a time (one
+keyset SELECT and one bulk UPDATE per batch), so it can run against a live
+database and be interrupted and resumed. Rows whose text isn't valid JSON
+keep a NULL metadata_json and are reported.
+
+    python manage.py migrate_guideline_metadata
+    python manage.py migrate_guideline_metadata --dry-run --report invalid.csv
+"""
+import csv
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from apps.guidelines import metadata
+from apps.guidelines.models import Guideline
+
+REPORT_PREVIEW = 60
+
+
+class Command(BaseCommand):
+    help = "Parse Guideline.metadata into metadata_json in batches, reporting rows that aren't JSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--start-id', type=int, default=0, help='Resume after this guideline id.')
+        parser.add_argument('--sleep', type=float, default=0, help='Seconds to pause between batches.')
+        parser.add_argument('--report', help='Write the invalid rows (id, metadata) to this CSV file.')
+        parser.add_argument('--dry-run', action='store_true', help='Parse and report without writing.')
+
+    def handle(self, *args, **options):
+        last_id = options['start_id']
+        stats = {'scanned': 0, 'updated': 0}
+        invalid = []
+        while True:
+            batch = list(
+                Guideline.objects.filter(pk__gt=last_id, metadata__isnull=False, metadata_json__isnull=True)
+                .order_by('pk')
+                .only('id', 'metadata')[:options['batch_size']]
+            )
+            if not batch:
+                break
+            last_id = batch[-1].pk
+            changed = []
+            for guideline in batch:
+                value, valid = metadata.parse(guideline.metadata)
+                if not valid:
+                    invalid.append((guideline.pk, guideline.metadata))
+                elif value is not None:
+                    guideline.metadata_json = value
+                    changed.append(guideline)
+            stats['scanned'] += len(batch)
+            stats['updated'] += len(changed)
+            if changed and not options['dry_run']:
+                with transaction.atomic():
+                    Guideline.objects.bulk_update(changed, ['metadata_json'])
+            if options['verbosity'] > 1:
+                self.stdout.write(f"... up to id {last_id}: {stats['updated']} updated, {len(invalid)} invalid")
+            if options['sleep']:
+                time.sleep(options['sleep'])
+
+        verb = 'Would update' if options['dry_run'] else 'Updated'
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {stats['updated']} of {stats['scanned']} guideline(s); {len(invalid)} with invalid JSON."
+        ))
+        if options['report'] and invalid:
+            with open(options['report'], 'w', newline='', encoding='utf-8') as handle:
+                writer = csv.writer(handle)
+                writer.writerow(['id', 'metadata'])
+                writer.writerows(invalid)
+            self.stdout.write(f"Invalid rows written to {options['report']}")
+        for pk, text in invalid[:20]:
+            preview = text if len(text) <= REPORT_PREVIEW else f'{text[:REPORT_PREVIEW]}...'
+            self.stdout.write(self.style.WARNING(f"  id {pk}: {preview!r}"))
+        if len(invalid) > 20:
+            self.stdout.write(self.style.WARNING(f"  ... and {len(invalid) - 20} more"))
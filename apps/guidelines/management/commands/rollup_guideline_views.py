@@ -0,0 +1,28 @@
+"""
+Fold raw guideline view events into daily totals (apps.guidelines.analytics).
+
+Events of completed hours are added to GuidelineViewDaily and deleted;
+daily rows older than ``--retain-days`` are dropped. Run it hourly:
+
+    python manage.py rollup_guideline_views
+"""
+from django.core.management.base import BaseCommand
+
+from apps.guidelines import analytics
+
+
+class Command(BaseCommand):
+    help = "Roll up guideline view events of completed hours into daily totals."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--retain-days', type=int, default=400,
+            help='Delete daily totals older than this many days (0 keeps everything).',
+        )
+
+    def handle(self, *args, **options):
+        stats = analytics.rollup(retain_days=options['retain_days'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Rolled up {stats['events']} view event row(s): {stats['created']} daily row(s) created, "
+            f"{stats['updated']} updated, {stats['purged']} purged."
+        ))
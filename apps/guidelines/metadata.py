@@ -0,0 +1,137 @@
+"""
+apps/guidelines/metadata.py
+
+Structured guideline metadata and metadata filters.
+
+``Guideline.metadata`` stays the free-text field the API reads and writes.
+GuidelineService keeps ``Guideline.metadata_json`` in step with it: the
+parsed JSON, or NULL when the text isn't valid JSON. Rows written before the
+column existed are filled in by ``manage.py migrate_guideline_metadata``.
+
+Filters run in the database:
+
+* ``?meta.<key>=<value>`` compares the text value of a top-level key.
+  ``MetadataKey`` inlines the key as a literal so the expression matches the
+  expression indexes on ``INDEXED_KEYS`` (on SQLite the equivalent of an
+  indexed virtual generated column); other keys are evaluated per row.
+* ``?metadata__contains=<json>`` is JSON containment. On PostgreSQL it is
+  ``@>`` served by the ``jsonb_path_ops`` GIN index; elsewhere a flat object
+  of scalars is rewritten to one ``meta.<key>`` comparison per key.
+"""
+import json
+import re
+
+from django.db import NotSupportedError
+from django.db.models import F, Func, Q, TextField
+from django.db.models.lookups import Exact
+from rest_framework.exceptions import ValidationError
+
+# Keys with an expression index (Guideline.Meta.indexes, migration 0007).
+# Adding one here needs a migration adding its index.
+INDEXED_KEYS = ('source', 'type')
+MAX_KEY_FILTERS = 5
+META_PARAM_PREFIX = 'meta.'
+
+_KEY_RE = re.compile(r'[A-Za-z_][A-Za-z0-9_]{0,63}')
+
+
+def parse(text):
+    """Return ``(value, valid)``: the JSON value of ``text``, or ``(None, False)`` if it isn't JSON."""
+    if text is None or not text.strip():
+        return None, True
+    try:
+        return json.loads(text), True
+    except ValueError:
+        return None, False
+
+
+def with_json(data):
+    """Add ``metadata_json`` to validated write ``data`` that sets ``metadata``."""
+    if 'metadata' in data:
+        data['metadata_json'] = parse(data['metadata'])[0]
+    return data
+
+
+class MetadataKey(Func):
+    """
+    Text value of top-level ``key`` of ``metadata_json``.
+
+    The JSON path is written into the SQL as a literal (Django's key
+    transforms pass it as a parameter), which is what lets SQLite match the
+    expression against an expression index. Booleans read as ``true`` /
+    ``false`` and numbers in their JSON spelling on every backend.
+    """
+    output_field = TextField()
+
+    def __init__(self, key):
+        if not _KEY_RE.fullmatch(key):
+            raise ValueError(f'Invalid metadata key {key!r}.')
+        self.key = key
+        super().__init__(F('metadata_json'))
+
+    def as_sql(self, compiler, connection, **extra_context):
+        raise NotSupportedError(f'Metadata key lookups are not implemented for {connection.vendor}.')
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        column, params = compiler.compile(self.source_expressions[0])
+        return f"({column} ->> '{self.key}')", params
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        column, params = compiler.compile(self.source_expressions[0])
+        path = f"'$.\"{self.key}\"'"
+        return (
+            f"(CASE JSON_TYPE({column}, {path}) WHEN 'true' THEN 'true' WHEN 'false' THEN 'false' "
+            f"ELSE CAST(JSON_EXTRACT({column}, {path}) AS TEXT) END)"
+        ), params * 3
+
+
+def key_index_name(key):
+    return f'guideline_meta_{key}_idx'
+
+
+def _text(value):
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (int, float, str)):
+        return str(value)
+    return None
+
+
+def key_condition(key, value):
+    return Exact(MetadataKey(key), value)
+
+
+def parse_filters(params, connection):
+    """
+    Validate ``?meta.<key>=`` and ``?metadata__contains=``; return a list of
+    conditions for a query on ``connection``.
+
+    Raises ValidationError (400) for bad keys or JSON, and for containment
+    the database can't evaluate.
+    """
+    conditions = []
+    keys = [name for name in params if name.startswith(META_PARAM_PREFIX)]
+    if len(keys) > MAX_KEY_FILTERS:
+        raise ValidationError({'meta': [f'At most {MAX_KEY_FILTERS} meta.<key> filters.']})
+    for name in keys:
+        key = name[len(META_PARAM_PREFIX):]
+        if not _KEY_RE.fullmatch(key):
+            raise ValidationError({name: ['Metadata keys are letters, digits and underscores.']})
+        conditions.append(key_condition(key, params.get(name)))
+
+    contains = params.get('metadata__contains')
+    if contains:
+        try:
+            value = json.loads(contains)
+        except ValueError:
+            raise ValidationError({'metadata__contains': ['Expected a JSON value.']})
+        if connection.features.supports_json_field_contains:
+            conditions.append(Q(metadata_json__contains=value))
+        else:
+            texts = {key: _text(item) for key, item in value.items()} if isinstance(value, dict) else None
+            if not texts or any(text is None or not _KEY_RE.fullmatch(key) for key, text in texts.items()):
+                raise ValidationError({'metadata__contains': [
+                    'Expected a JSON object of top-level keys with string, number or boolean values.'
+                ]})
+            conditions.extend(key_condition(key, text) for key, text in texts.items())
+    return conditions
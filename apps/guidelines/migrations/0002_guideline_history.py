@@ -0,0 +1,73 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:46
+
+import django.core.serializers.json
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('guidelines', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Trust',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=100, unique=True)),
+            ],
+            options={
+                'db_table': 'tableapp_trust',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='Guideline',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=1025)),
+                ('description', models.TextField(blank=True, null=True)),
+                ('external_url', models.CharField(blank=True, max_length=1025, null=True)),
+                ('metadata', models.TextField(blank=True, null=True)),
+                ('medical_speciality', models.CharField(blank=True, max_length=255, null=True)),
+                ('locality', models.CharField(blank=True, max_length=255, null=True)),
+                ('original_filename', models.CharField(blank=True, max_length=1025, null=True)),
+                ('viewcount', models.IntegerField(default=0)),
+                ('authors', models.CharField(blank=True, max_length=1025, null=True)),
+                ('creation_date', models.CharField(blank=True, max_length=255, null=True)),
+                ('review_date', models.CharField(blank=True, max_length=255, null=True)),
+                ('version_number', models.CharField(blank=True, max_length=255, null=True)),
+                ('last_updated_date', models.CharField(blank=True, max_length=255, null=True)),
+                ('trust', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, to='guidelines.trust')),
+            ],
+            options={
+                'db_table': 'tableapp_trustguideline',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='GuidelineHistory',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('guideline_id', models.BigIntegerField()),
+                ('history_type', models.CharField(choices=[('+', 'Created'), ('~', 'Changed'), ('-', 'Deleted'), ('=', 'Compacted snapshot')], max_length=1)),
+                ('history_date', models.DateTimeField()),
+                ('changes', models.JSONField(default=dict, encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('history_user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.DeleteModel(
+            name='TableappTrust',
+        ),
+        migrations.DeleteModel(
+            name='TableappTrustguideline',
+        ),
+        migrations.AddIndex(
+            model_name='guidelinehistory',
+            index=models.Index(fields=['guideline_id', 'history_date'], name='guideline_history_date_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+from django.db import migrations, models
+
+from apps.core.db.operations import AddUnmanagedField
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('guidelines', '0002_guideline_history'),
+    ]
+
+    operations = [
+        AddUnmanagedField(
+            model_name='trust',
+            name='updated_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        AddUnmanagedField(
+            model_name='trust',
+            name='row_version',
+            field=models.PositiveIntegerField(db_default=1, default=1, editable=False),
+        ),
+        AddUnmanagedField(
+            model_name='guideline',
+            name='updated_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        AddUnmanagedField(
+            model_name='guideline',
+            name='row_version',
+            field=models.PositiveIntegerField(db_default=1, default=1, editable=False),
+        ),
+    ]
@@ -0,0 +1,40 @@
+from django.db import migrations, models
+
+from apps.core.db.operations import AddUnmanagedIndex
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('guidelines', '0003_row_version'),
+    ]
+
+    operations = [
+        AddUnmanagedIndex(
+            model_name='guideline',
+            index=models.Index(fields=['trust', 'medical_speciality'], name='guideline_trust_spec_idx'),
+            concurrently=True,
+        ),
+        AddUnmanagedIndex(
+            model_name='guideline',
+            index=models.Index(fields=['medical_speciality', 'name'], name='guideline_spec_name_idx'),
+            concurrently=True,
+        ),
+        AddUnmanagedIndex(
+            model_name='guideline',
+            index=models.Index(fields=['locality', 'name'], name='guideline_locality_name_idx'),
+            concurrently=True,
+        ),
+        AddUnmanagedIndex(
+            model_name='guideline',
+            index=models.Index(fields=['name'], name='guideline_name_idx'),
+            concurrently=True,
+        ),
+        AddUnmanagedIndex(
+            model_name='guideline',
+            index=models.Index(fields=['-viewcount'], name='guideline_viewcount_idx'),
+            concurrently=True,
+        ),
+    ]
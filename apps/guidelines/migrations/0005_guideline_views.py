@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('guidelines', '0004_guideline_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GuidelineViewDaily',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('day', models.DateField()),
+                ('guideline_id', models.BigIntegerField()),
+                ('medical_speciality', models.CharField(blank=True, max_length=255, null=True)),
+                ('trust_id', models.BigIntegerField(blank=True, null=True)),
+                ('views', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['medical_speciality', 'day'], name='guideline_view_spec_day_idx'), models.Index(fields=['trust_id', 'day'], name='guideline_view_trust_day_idx')],
+                'constraints': [models.UniqueConstraint(fields=('day', 'guideline_id'), name='guideline_view_daily_unique')],
+            },
+        ),
+        migrations.CreateModel(
+            name='GuidelineViewEvent',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('guideline_id', models.BigIntegerField()),
+                ('bucket', models.DateTimeField(help_text='Start of the hour (UTC).')),
+                ('views', models.PositiveIntegerField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['bucket'], name='guideline_view_bucket_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+from django.db import migrations, models
+
+from apps.core.db.operations import AddUnmanagedField, AddUnmanagedIndex
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('guidelines', '0005_guideline_views'),
+    ]
+
+    operations = [
+        AddUnmanagedField(
+            model_name='trust',
+            name='latitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        AddUnmanagedField(
+            model_name='trust',
+            name='longitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        AddUnmanagedIndex(
+            model_name='trust',
+            index=models.Index(fields=['latitude', 'longitude'], name='trust_location_idx'),
+            concurrently=True,
+        ),
+    ]
@@ -0,0 +1,41 @@
+from django.contrib.postgres.indexes import GinIndex
+from django.db import migrations, models
+
+import apps.guidelines.metadata
+from apps.core.db.operations import AddUnmanagedField, AddUnmanagedIndex
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('guidelines', '0006_trust_location'),
+    ]
+
+    operations = [
+        # Filled from metadata by `manage.py migrate_guideline_metadata`
+        AddUnmanagedField(
+            model_name='guideline',
+            name='metadata_json',
+            field=models.JSONField(blank=True, editable=False, null=True),
+        ),
+        AddUnmanagedIndex(
+            model_name='guideline',
+            index=models.Index(apps.guidelines.metadata.MetadataKey('source'), name='guideline_meta_source_idx'),
+            concurrently=True,
+        ),
+        AddUnmanagedIndex(
+            model_name='guideline',
+            index=models.Index(apps.guidelines.metadata.MetadataKey('type'), name='guideline_meta_type_idx'),
+            concurrently=True,
+        ),
+        # ?metadata__contains= (jsonb @>); not in Guideline.Meta.indexes since
+        # other databases have no GIN indexes
+        AddUnmanagedIndex(
+            model_name='guideline',
+            index=GinIndex(fields=['metadata_json'], name='guideline_metadata_gin', opclasses=['jsonb_path_ops']),
+            concurrently=True,
+            vendor='postgresql',
+        ),
+    ]
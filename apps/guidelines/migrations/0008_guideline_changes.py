@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('guidelines', '0007_guideline_metadata_json'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GuidelineChangeCompaction',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('ran_at', models.DateTimeField()),
+                ('truncated_through', models.BigIntegerField(default=0)),
+                ('removed', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='GuidelineChange',
+            fields=[
+                ('seq', models.BigAutoField(primary_key=True, serialize=False)),
+                ('kind', models.CharField(choices=[('guideline', 'Guideline'), ('trust', 'Trust')], max_length=16)),
+                ('object_id', models.BigIntegerField()),
+                ('action', models.CharField(choices=[('create', 'Created'), ('update', 'Updated'), ('delete', 'Deleted')], max_length=8)),
+                ('changed_at', models.DateTimeField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['kind', 'object_id', 'seq'], name='guideline_change_object_idx')],
+            },
+        ),
+    ]
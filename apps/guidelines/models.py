@@ -5,15 +5,32 @@
 #   * Make sure each ForeignKey and OneToOneField has `on_delete` set to the desired behavior
 #   * Remove `managed = False` lines if you wish to allow Django to create, modify, and delete the table
 # Feel free to rename the models, but don't rename db_table values or field names.
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 
+from .metadata import INDEXED_KEYS, MetadataKey, key_index_name
+
 class Trust(models.Model):
     id = models.BigAutoField(primary_key=True)
     name = models.CharField(unique=True, max_length=100)
+    # Server-maintained validators for conditional GETs (ETag / Last-Modified)
+    updated_at = models.DateTimeField(auto_now=True, null=True, blank=True)
+    row_version = models.PositiveIntegerField(default=1, db_default=1, editable=False)
+    # WGS84 degrees, loaded by import_trust_locations; see apps.guidelines.geo
+    latitude = models.FloatField(blank=True, null=True)
+    longitude = models.FloatField(blank=True, null=True)
 
     class Meta:
         managed = False
         db_table = 'tableapp_trust'
+        # Bounding-box lookups of apps.guidelines.geo.trusts_near (migration 0006)
+        indexes = [
+            models.Index(fields=['latitude', 'longitude'], name='trust_location_idx'),
+        ]
+
+    def __str__(self):
+        return self.name
 
 
 class Guideline(models.Model):
@@ -22,6 +39,9 @@ class Guideline(models.Model):
     description = models.TextField(blank=True, null=True)
     external_url = models.CharField(max_length=1025, blank=True, null=True)
     metadata = models.TextField(blank=True, null=True)
+    # Parsed ``metadata`` (NULL if it isn't JSON), kept in step by GuidelineService;
+    # see apps.guidelines.metadata
+    metadata_json = models.JSONField(blank=True, null=True, editable=False)
     medical_speciality = models.CharField(max_length=255, blank=True, null=True)
     trust = models.ForeignKey(Trust, models.DO_NOTHING)
     locality = models.CharField(max_length=255, blank=True, null=True)
@@ -32,7 +52,144 @@ class Guideline(models.Model):
     review_date = models.CharField(max_length=255, blank=True, null=True)
     version_number = models.CharField(max_length=255, blank=True, null=True)
     last_updated_date = models.CharField(max_length=255, blank=True, null=True)
+    # Server-maintained validators for conditional GETs (ETag / Last-Modified);
+    # last_updated_date above is free text describing the document itself
+    updated_at = models.DateTimeField(auto_now=True, null=True, blank=True)
+    row_version = models.PositiveIntegerField(default=1, db_default=1, editable=False)
 
     class Meta:
         managed = False
-        db_table = 'tableapp_trustguideline'
\ No newline at end of file
+        db_table = 'tableapp_trustguideline'
+        # Created on the existing table by AddUnmanagedIndex (migration 0004);
+        # they back the list filters and orderings in GuidelineService
+        indexes = [
+            models.Index(fields=['trust', 'medical_speciality'], name='guideline_trust_spec_idx'),
+            models.Index(fields=['medical_speciality', 'name'], name='guideline_spec_name_idx'),
+            models.Index(fields=['locality', 'name'], name='guideline_locality_name_idx'),
+            models.Index(fields=['name'], name='guideline_name_idx'),
+            models.Index(fields=['-viewcount'], name='guideline_viewcount_idx'),
+            # ?meta.<key>= filters on hot metadata keys (migration 0007). The GIN
+            # index for ?metadata__contains= is PostgreSQL-only and declared there.
+            *(models.Index(MetadataKey(key), name=key_index_name(key)) for key in INDEXED_KEYS),
+        ]
+
+    def __str__(self):
+        return self.name
+
+class GuidelineHistory(models.Model):
+    """
+    Change history for Guideline, written by apps.guidelines.history.
+
+    Rows store only the fields that changed (``changes``); creations and
+    compacted rows hold a full snapshot. Guideline is unmanaged and edited
+    through GuidelineService, so this replaces simple_history's full-row copies.
+    """
+    CREATED = '+'
+    CHANGED = '~'
+    DELETED = '-'
+    SNAPSHOT = '='
+    HISTORY_TYPES = [
+        (CREATED, 'Created'),
+        (CHANGED, 'Changed'),
+        (DELETED, 'Deleted'),
+        (SNAPSHOT, 'Compacted snapshot'),
+    ]
+
+    id = models.BigAutoField(primary_key=True)
+    guideline_id = models.BigIntegerField()
+    history_type = models.CharField(max_length=1, choices=HISTORY_TYPES)
+    history_date = models.DateTimeField()
+    history_user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, models.SET_NULL, null=True, blank=True, related_name='+'
+    )
+    changes = models.JSONField(default=dict, encoder=DjangoJSONEncoder)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['guideline_id', 'history_date'], name='guideline_history_date_idx'),
+        ]
+
+
+class GuidelineViewEvent(models.Model):
+    """
+    Raw guideline views counted per hour, written by apps.guidelines.analytics.
+
+    Append-only: every flush of a worker's buffer inserts one row per
+    (guideline, hour) it saw, so several rows may share a bucket.
+    ``rollup_guideline_views`` folds completed hours into GuidelineViewDaily
+    and deletes them.
+    """
+    id = models.BigAutoField(primary_key=True)
+    guideline_id = models.BigIntegerField()
+    bucket = models.DateTimeField(help_text='Start of the hour (UTC).')
+    views = models.PositiveIntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['bucket'], name='guideline_view_bucket_idx'),
+        ]
+
+
+class GuidelineViewDaily(models.Model):
+    """
+    Views per guideline per day (UTC), rolled up from GuidelineViewEvent.
+
+    The guideline's speciality and trust are copied in at rollup time so
+    trending queries read only this table.
+    """
+    id = models.BigAutoField(primary_key=True)
+    day = models.DateField()
+    guideline_id = models.BigIntegerField()
+    medical_speciality = models.CharField(max_length=255, blank=True, null=True)
+    trust_id = models.BigIntegerField(blank=True, null=True)
+    views = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'guideline_id'], name='guideline_view_daily_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['medical_speciality', 'day'], name='guideline_view_spec_day_idx'),
+            models.Index(fields=['trust_id', 'day'], name='guideline_view_trust_day_idx'),
+        ]
+
+
+class GuidelineChange(models.Model):
+    """
+    Change feed of the guideline catalogue, written by apps.guidelines.changes.
+
+    One row per created, updated or deleted guideline or trust; ``seq`` is
+    the feed cursor. ``compact_guideline_changes`` keeps only the newest row
+    per object and drops rows past the retention window.
+    """
+    GUIDELINE = 'guideline'
+    TRUST = 'trust'
+    KINDS = [(GUIDELINE, 'Guideline'), (TRUST, 'Trust')]
+    CREATE = 'create'
+    UPDATE = 'update'
+    DELETE = 'delete'
+    ACTIONS = [(CREATE, 'Created'), (UPDATE, 'Updated'), (DELETE, 'Deleted')]
+
+    seq = models.BigAutoField(primary_key=True)
+    kind = models.CharField(max_length=16, choices=KINDS)
+    object_id = models.BigIntegerField()
+    action = models.CharField(max_length=8, choices=ACTIONS)
+    changed_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['kind', 'object_id', 'seq'], name='guideline_change_object_idx'),
+        ]
+
+
+class GuidelineChangeCompaction(models.Model):
+    """
+    A run of ``compact_guideline_changes``.
+
+    Feed rows up to ``truncated_through`` may have been removed, so cursors
+    below it can no longer be served (410) and the client resyncs.
+    """
+    id = models.BigAutoField(primary_key=True)
+    ran_at = models.DateTimeField()
+    truncated_through = models.BigIntegerField(default=0)
+    removed = models.PositiveIntegerField(default=0)
@@ -0,0 +1,379 @@
+"""
+apps/guidelines/search.py
+
+In-process BM25 search over guidelines, with no external search service.
+
+The index is a directory of immutable segments plus a ``manifest.json``
+listing the live ones. A segment is a set of ``.npy`` arrays opened with
+``mmap_mode='r'``, so every gunicorn worker reads the same pages from the
+page cache instead of holding its own copy:
+
+    terms.npy       sorted vocabulary (fixed-width unicode)
+    offsets.npy     the postings of term i are [offsets[i], offsets[i + 1])
+    postings.npy    local document numbers, ascending within a term
+    tfs.npy         term frequencies, parallel to postings
+    doc_ids.npy     guideline id of each local document
+    doc_lens.npy    document length in tokens
+    deleted.npy     guideline ids deleted since the previous segment
+
+A full build writes one segment. Later builds append a segment holding the
+guidelines changed since the previous build (``updated_at``) and the ids
+deleted since; a guideline in a newer segment, or in a newer ``deleted``
+list, masks its copy in older segments. Segments are written under a
+temporary name and published by replacing the manifest, so a reader sees
+either the old or the new set. Document frequencies (hence idf) and the
+average document length are taken over the live documents of all segments
+when a process loads the manifest.
+
+Build and refresh with ``manage.py build_search_index``.
+"""
+import json
+import logging
+import math
+import os
+import re
+import shutil
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Guideline
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+MANIFEST = 'manifest.json'
+# BM25 parameters (the usual defaults)
+K1 = 1.2
+B = 0.75
+# The name is counted this many times, so title matches rank first
+NAME_WEIGHT = 2
+MAX_TERM_LENGTH = 32
+MAX_SEGMENTS = 8
+# Unreferenced segments are deleted by a later build once older than this,
+# leaving workers time to switch to the new manifest
+SEGMENT_GRACE_SECONDS = 300
+MAX_DOCUMENT_CHARS = 500_000
+
+_TOKEN_RE = re.compile(r'[^\W_]+')
+STOPWORDS = frozenset(
+    'a an and are as at be by for from in into is it of on or that the this to with'.split()
+)
+
+
+def tokenize(text):
+    """Lower-cased word tokens of ``text``, without stopwords."""
+    if not text:
+        return []
+    return [
+        token for token in _TOKEN_RE.findall(text.lower())
+        if token not in STOPWORDS and len(token) <= MAX_TERM_LENGTH
+    ]
+
+
+def _load_array(path):
+    try:
+        return np.load(path, mmap_mode='r')
+    except ValueError:
+        # Empty arrays can't be memory-mapped
+        return np.load(path)
+
+
+class Segment:
+    """One immutable, memory-mapped segment."""
+
+    ARRAYS = ('terms', 'offsets', 'postings', 'tfs', 'doc_ids', 'doc_lens', 'deleted')
+
+    def __init__(self, path):
+        self.path = path
+        for name in self.ARRAYS:
+            setattr(self, name, _load_array(os.path.join(path, f'{name}.npy')))
+        # Filled in by SearchIndex once all segments are known
+        self.live = None
+        self.all_live = True
+        self.live_df = None
+        self.norm = None
+
+    def lookup(self, term):
+        """Row of ``term`` in the vocabulary, or None."""
+        row = int(np.searchsorted(self.terms, term))
+        if row < len(self.terms) and self.terms[row] == term:
+            return row
+        return None
+
+
+class SearchIndex:
+    """The segments named by one manifest, ready to answer queries."""
+
+    def __init__(self, directory, manifest):
+        self.directory = directory
+        self.manifest = manifest
+        self.segments = [Segment(os.path.join(directory, name)) for name in manifest['segments']]
+        masked = np.empty(0, dtype=np.int64)
+        for segment in reversed(self.segments):
+            segment.live = ~np.isin(segment.doc_ids, masked)
+            segment.all_live = bool(segment.live.all())
+            masked = np.union1d(masked, np.concatenate([segment.doc_ids, segment.deleted]))
+        self.doc_count = int(sum(segment.live.sum() for segment in self.segments))
+        total_length = sum(int(segment.doc_lens[segment.live].sum()) for segment in self.segments)
+        avgdl = total_length / self.doc_count if self.doc_count else 1.0
+        for segment in self.segments:
+            counts = np.diff(segment.offsets)
+            if segment.all_live or not len(segment.terms):
+                segment.live_df = counts
+            else:
+                # Every term has at least one posting, so reduceat's slices are non-empty
+                segment.live_df = np.add.reduceat(segment.live[segment.postings].astype(np.int64), segment.offsets[:-1])
+            segment.norm = (K1 * (1 - B + B * segment.doc_lens / avgdl)).astype(np.float32)
+
+    def live_ids(self):
+        return np.concatenate(
+            [segment.doc_ids[segment.live] for segment in self.segments] or [np.empty(0, dtype=np.int64)]
+        )
+
+    def search(self, query, limit=20):
+        """Return up to ``limit`` ``(guideline_id, score)`` pairs, best first."""
+        terms = set(tokenize(query))
+        if not terms or not self.doc_count or limit <= 0:
+            return []
+        matches = []
+        df = Counter()
+        for term in terms:
+            for segment in self.segments:
+                row = segment.lookup(term)
+                if row is not None:
+                    matches.append((segment, term, row))
+                    df[term] += int(segment.live_df[row])
+        idf = {
+            term: math.log(1 + (self.doc_count - count + 0.5) / (count + 0.5))
+            for term, count in df.items()
+        }
+
+        found_ids, found_scores = [], []
+        for segment in self.segments:
+            scores = None
+            for match_segment, term, row in matches:
+                if match_segment is not segment:
+                    continue
+                start, stop = segment.offsets[row], segment.offsets[row + 1]
+                docs = segment.postings[start:stop]
+                tf = segment.tfs[start:stop].astype(np.float32)
+                if scores is None:
+                    scores = np.zeros(len(segment.doc_ids), dtype=np.float32)
+                # A document appears once per term, so plain fancy-index += is safe
+                scores[docs] += idf[term] * tf * (K1 + 1) / (tf + segment.norm[docs])
+            if scores is None:
+                continue
+            if not segment.all_live:
+                scores[~segment.live] = 0
+            candidates = np.flatnonzero(scores)
+            if len(candidates) > limit:
+                candidates = candidates[np.argpartition(scores[candidates], -limit)[-limit:]]
+            found_ids.append(segment.doc_ids[candidates])
+            found_scores.append(scores[candidates])
+        if not found_ids:
+            return []
+        ids = np.concatenate(found_ids)
+        scores = np.concatenate(found_scores)
+        if len(ids) > limit:
+            top = np.argpartition(scores, -limit)[-limit:]
+            ids, scores = ids[top], scores[top]
+        order = np.lexsort((ids, -scores))
+        return [(int(ids[i]), float(scores[i])) for i in order]
+
+
+def read_manifest(directory):
+    try:
+        with open(os.path.join(directory, MANIFEST)) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return None
+    if manifest.get('version') != FORMAT_VERSION:
+        logger.warning("Ignoring search index manifest with version %s", manifest.get('version'))
+        return None
+    return manifest
+
+
+def _document_text(external_url):
+    """Text of the guideline's stored PDF, or '' if there is none or pypdf is missing."""
+    from .documents import document_path
+    from .utils import get_s3_key
+
+    key = get_s3_key(external_url)
+    if not key or not key.lower().endswith('.pdf'):
+        return ''
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        logger.warning("pypdf is not installed; indexing guidelines without document text")
+        return ''
+    try:
+        reader = PdfReader(document_path(key))
+        parts, length = [], 0
+        for page in reader.pages:
+            text = page.extract_text() or ''
+            parts.append(text)
+            length += len(text)
+            if length >= MAX_DOCUMENT_CHARS:
+                break
+        return ' '.join(parts)[:MAX_DOCUMENT_CHARS]
+    except Exception:
+        logger.warning("Could not extract text from %s", key, exc_info=True)
+        return ''
+
+
+TEXT_COLUMNS = ('name', 'description', 'medical_speciality', 'locality', 'authors', 'trust__name')
+
+
+def _documents(queryset, with_documents):
+    """Yield ``(guideline_id, tokens)`` for each guideline in ``queryset``."""
+    columns = ('id', 'external_url') + TEXT_COLUMNS
+    for row in queryset.values_list(*columns).order_by('id').iterator(chunk_size=2000):
+        values = dict(zip(columns, row))
+        tokens = tokenize(values['name']) * NAME_WEIGHT
+        for column in TEXT_COLUMNS[1:]:
+            tokens += tokenize(values[column])
+        if with_documents:
+            tokens += tokenize(_document_text(values['external_url']))
+        yield values['id'], tokens
+
+
+def _write_segment(path, documents, deleted):
+    postings = defaultdict(list)
+    doc_ids, doc_lens = [], []
+    for local, (guideline_id, tokens) in enumerate(documents):
+        doc_ids.append(guideline_id)
+        doc_lens.append(len(tokens))
+        for term, tf in Counter(tokens).items():
+            postings[term].append((local, tf))
+    terms = sorted(postings)
+    offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(postings[term]) for term in terms])
+    flat = [posting for term in terms for posting in postings[term]]
+    arrays = {
+        'terms': np.array(terms, dtype=f'<U{MAX_TERM_LENGTH}'),
+        'offsets': offsets,
+        'postings': np.array([local for local, _ in flat], dtype=np.int32),
+        'tfs': np.minimum([tf for _, tf in flat], np.iinfo(np.uint16).max).astype(np.uint16),
+        'doc_ids': np.array(doc_ids, dtype=np.int64),
+        'doc_lens': np.array(doc_lens, dtype=np.int32),
+        'deleted': np.array(sorted(deleted), dtype=np.int64),
+    }
+    os.makedirs(path)
+    for name, array in arrays.items():
+        with open(os.path.join(path, f'{name}.npy'), 'wb') as f:
+            np.save(f, array)
+            f.flush()
+            os.fsync(f.fileno())
+    return len(doc_ids)
+
+
+def _publish(directory, manifest):
+    tmp_path = os.path.join(directory, f'{MANIFEST}.{os.getpid()}.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, os.path.join(directory, MANIFEST))
+
+
+def _remove_stale_segments(directory, keep):
+    cutoff = time.time() - SEGMENT_GRACE_SECONDS
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_dir() and entry.name not in keep and entry.stat().st_mtime < cutoff:
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+
+def build(directory, full=False, with_documents=False):
+    """
+    Write a new segment and publish it; return build statistics.
+
+    Without ``full`` only guidelines changed or added since the last build
+    are indexed, unless there is no index yet or it already has
+    ``MAX_SEGMENTS`` segments, in which case everything is rebuilt into one.
+    """
+    os.makedirs(directory, exist_ok=True)
+    manifest = read_manifest(directory)
+    full = full or manifest is None or len(manifest['segments']) >= MAX_SEGMENTS
+    started = timezone.now()
+    generation = manifest['generation'] + 1 if manifest else 1
+    queryset = Guideline.objects.all()
+    deleted = ()
+    segments = []
+    if not full:
+        previous = SearchIndex(directory, manifest)
+        indexed = previous.live_ids()
+        current = np.fromiter(Guideline.objects.values_list('id', flat=True), dtype=np.int64)
+        deleted = np.setdiff1d(indexed, current).tolist()
+        missing = np.setdiff1d(current, indexed).tolist()
+        since = datetime.fromisoformat(manifest['indexed_until'])
+        queryset = queryset.filter(Q(updated_at__gte=since) | Q(id__in=missing))
+        segments = list(manifest['segments'])
+
+    name = f'seg-{generation:06d}'
+    tmp_path = os.path.join(directory, f'{name}.{os.getpid()}.tmp')
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    try:
+        documents = _write_segment(tmp_path, _documents(queryset, with_documents), deleted)
+        os.rename(tmp_path, os.path.join(directory, name))
+    finally:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+    segments.append(name)
+    _publish(directory, {
+        'version': FORMAT_VERSION,
+        'generation': generation,
+        'segments': segments,
+        'indexed_until': started.isoformat(),
+    })
+    _remove_stale_segments(directory, set(segments))
+    return {
+        'mode': 'full' if full else 'incremental',
+        'documents': documents,
+        'deleted': len(deleted),
+        'segments': len(segments),
+    }
+
+
+class SearchIndexHandle:
+    """
+    Per-process access to the current index, reloaded when the manifest is replaced.
+
+    The manifest is re-stat'ed at most every ``check_interval`` seconds.
+    ``get()`` returns None until the index has been built.
+    """
+
+    def __init__(self, directory, check_interval=5.0):
+        self.directory = directory
+        self.check_interval = check_interval
+        self._index = None
+        self._identity = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    def get(self):
+        now = time.monotonic()
+        if self._index is not None and now - self._checked < self.check_interval:
+            return self._index
+        with self._lock:
+            self._checked = now
+            try:
+                stat = os.stat(os.path.join(self.directory, MANIFEST))
+            except FileNotFoundError:
+                return self._index
+            identity = (stat.st_ino, stat.st_mtime_ns)
+            if identity != self._identity:
+                manifest = read_manifest(self.directory)
+                if manifest is not None:
+                    self._index = SearchIndex(self.directory, manifest)
+                    self._identity = identity
+            return self._index
+
+
+search_index = SearchIndexHandle(getattr(settings, 'SEARCH_INDEX_DIR', '/tmp/djangomvp_search'))
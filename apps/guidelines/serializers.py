@@ -1,9 +1,9 @@
 # apps/guidelines/serializers.py
 
 from rest_framework import serializers
-from .models import Guideline, Trust
+from .models import Guideline, GuidelineHistory, Trust
 from django.core.files.storage import default_storage
-# from .utils import sanitize_filename, get_s3_key
+from .utils import sanitize_filename, get_s3_key, sign_document_url
 import logging
 import os
 import re
@@ -25,7 +25,22 @@ class TrustSerializer(serializers.ModelSerializer):
         fields = ['id', 'name']  # Include other Trust fields if necessary
 
 
-class GuidelineMinimalSerializer(serializers.ModelSerializer):
+class SignedURLMixin:
+    """
+    Serializer mixin emitting ``external_url`` in signed form (see apps.core.signing).
+
+    Pass ``context={'sign_urls': False}`` for the stored URL, e.g. when the
+    output is cached longer than a signature lives.
+    """
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if data.get('external_url') and self.context.get('sign_urls', True):
+            data['external_url'] = sign_document_url(data['external_url'])
+        return data
+
+
+class GuidelineMinimalSerializer(SignedURLMixin, serializers.ModelSerializer):
     # trust = TrustSerializer(read_only=True)
 
     class Meta:
@@ -58,8 +73,31 @@ class GuidelineAdminSerializer(serializers.ModelSerializer):
 
 
 
-class GuidelineSerializer(serializers.ModelSerializer):
+class SparseFieldsMixin:
+    """
+    Serializer mixin for sparse fieldsets (``?fields=`` / ``?expand=``).
+
+    ``fields`` limits the output to the given field names; ``expand`` lists
+    relations to nest. When ``fields`` is given, a relation that is not
+    expanded is rendered as its primary key. Without ``fields`` the
+    serializer is unchanged, so existing clients keep the nested trust.
+    """
+    expandable = ()
+
+    def __init__(self, *args, fields=None, expand=(), **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is None:
+            return
+        for name in set(self.fields) - set(fields):
+            self.fields.pop(name)
+        for name in self.expandable:
+            if name in self.fields and name not in expand:
+                self.fields[name] = serializers.PrimaryKeyRelatedField(read_only=True)
+
+
+class GuidelineSerializer(SignedURLMixin, SparseFieldsMixin, serializers.ModelSerializer):
     trust = TrustSerializer(read_only=True)
+    expandable = ('trust',)
     # pdf_file_url = serializers.SerializerMethodField()
 
     class Meta:
@@ -95,6 +133,17 @@ class GuidelineSerializer(serializers.ModelSerializer):
         }
 
 
+class GuidelineWriteSerializer(GuidelineSerializer):
+    """GuidelineSerializer that accepts ``trust`` as a primary key (batch endpoint)."""
+    trust = serializers.IntegerField(source='trust_id', required=False)
+
+
+class GuidelineHistorySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = GuidelineHistory
+        fields = ['id', 'history_type', 'history_date', 'history_user', 'changes']
+
+
 class UploadPDFSerializer(serializers.Serializer):
     """
     A minimal serializer for uploading a new PDF and updating the external_url.
@@ -142,8 +191,8 @@ class UploadPDFSerializer(serializers.Serializer):
 
         try:
             # If an old URL exists, delete the old file from S3
-            if old_url:
-                old_key = get_s3_key(old_url)
+            old_key = get_s3_key(old_url)
+            if old_key:
                 logger.debug(f"Attempting to delete old S3 object: {old_key}")
                 if default_storage.exists(old_key):
                     default_storage.delete(old_key)
@@ -1,34 +1,558 @@
-from .models import Guideline
+from .models import Guideline, GuidelineChange, GuidelineHistory, Trust
+from . import analytics, changes, geo, history, metadata, search
+from .suggest import suggest_index
+from .cache import detail_cache
+from .serializers import GuidelineMinimalSerializer, GuidelineSerializer, GuidelineWriteSerializer, TrustSerializer
+from .signals import guidelines_changed
+from .utils import get_s3_key, sign_document_url
+from apps.core import signing
+from django.db import connections, router, transaction
+from django.db.models import F, Q
+from django.http import Http404
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+# Columns written on every update; see Guideline.updated_at / row_version
+VERSION_FIELDS = ['updated_at', 'row_version']
+DEFAULT_TRUST_ID = 2
+BATCH_MAX_OPERATIONS = 500
+BATCH_SIZE = 200
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 100
+SUGGEST_DEFAULT_LIMIT = 10
+SUGGEST_MAX_LIMIT = 25
+ADMIN_SEARCH_LIMIT = 500
+CHANGES_DEFAULT_LIMIT = 500
+CHANGES_MAX_LIMIT = 5000
+
+# ?fields= / ?expand= whitelists: serializer field names, which are also model fields
+SPARSE_FIELDS = tuple(GuidelineSerializer.Meta.fields)
+EXPANDABLE_FIELDS = GuidelineSerializer.expandable
+
+# List filters: query parameter -> model lookup. Every combination is served
+# by one of the composite indexes declared on Guideline.Meta.indexes.
+FILTERS = {
+    'trust': 'trust_id',
+    'medical_speciality': 'medical_speciality',
+    'locality': 'locality',
+}
+ORDERINGS = ('name', '-name', 'viewcount', '-viewcount')
+
+
+def _derived_fields(changed):
+    """Untracked columns computed from the ``changed`` fields (see metadata.with_json)."""
+    return ['metadata_json'] if 'metadata' in changed else []
+
+
+def _notify(action, pks, feed=True):
+    """
+    Append the change to the sync feed (apps.guidelines.changes) and send
+    ``guidelines_changed`` once the surrounding transaction commits.
+    """
+    if feed:
+        changes.record(GuidelineChange.GUIDELINE, action, pks)
+    transaction.on_commit(
+        lambda: guidelines_changed.send(sender=Guideline, action=action, pks=list(pks))
+    )
+
 
 class GuidelineService:
     @staticmethod
-    def list_guidelines():
-        """Return a queryset of all guidelines."""
-        return Guideline.objects.all()
+    def list_guidelines(fields=None, expand=(), filters=None, ordering=None):
+        """
+        Return a queryset of all guidelines, optionally filtered and ordered.
+
+        ``filters`` and ``ordering`` come from ``parse_filters()``. With
+        ``fields`` only those columns are selected (``.only()``); the trust is
+        joined only when it will be nested in the output, which is always the
+        case without ``fields``.
+        """
+        queryset = Guideline.objects.filter(filters) if filters is not None else Guideline.objects.all()
+        if ordering:
+            queryset = queryset.order_by(ordering)
+        if fields is None:
+            return queryset.select_related('trust')
+        columns = list(fields)
+        if 'trust' in fields and 'trust' in expand:
+            queryset = queryset.select_related('trust')
+            columns += ['trust__name']
+        return queryset.only(*columns)
+
+    @staticmethod
+    def parse_filters(params):
+        """
+        Validate ``?trust=``, ``?medical_speciality=``, ``?locality=`` and
+        ``?ordering=`` (``name``/``viewcount``, ``-`` for descending).
+
+        ``?near=lat,lng`` (with ``?radius=`` in km) restricts the list to
+        guidelines of trusts within the radius, looked up through the trust
+        location index (apps.guidelines.geo); without ``?ordering=`` the
+        nearest trusts' guidelines come first. ``?meta.<key>=`` and
+        ``?metadata__contains=`` filter on the structured metadata
+        (apps.guidelines.metadata).
+
+        Returns ``(filters, ordering)`` for ``list_guidelines()``; ``filters``
+        is a Q object.
+        """
+        filters = {}
+        for param, lookup in FILTERS.items():
+            value = params.get(param)
+            if value is None or value == '':
+                continue
+            if param == 'trust':
+                if not value.isdigit():
+                    raise ValidationError({'trust': ['Expected a trust id.']})
+                value = int(value)
+            filters[lookup] = value
+        ordering = params.get('ordering') or None
+        if ordering is not None and ordering not in ORDERINGS:
+            raise ValidationError({'ordering': [f"Expected one of: {', '.join(ORDERINGS)}."]})
+        if params.get('near'):
+            nearby = geo.trusts_near(*geo.parse_near(params['near'], params.get('radius')))
+            filters['trust_id__in'] = [pk for pk, _ in nearby]
+            if ordering is None:
+                ordering = geo.distance_ordering(nearby)
+        elif params.get('radius'):
+            raise ValidationError({'radius': ['radius requires near=latitude,longitude.']})
+        conditions = metadata.parse_filters(params, connections[router.db_for_read(Guideline)])
+        return Q(*conditions, **filters), ordering
+
+    @staticmethod
+    def parse_sparse_fields(fields_param, expand_param):
+        """
+        Validate ``?fields=a,b`` / ``?expand=trust`` against the whitelists.
+
+        Returns ``(fields, expand)``; ``fields`` is None when not given.
+        """
+        fields = None
+        if fields_param:
+            fields = [name for name in (part.strip() for part in fields_param.split(',')) if name]
+            unknown = sorted(set(fields) - set(SPARSE_FIELDS))
+            if unknown:
+                raise ValidationError({'fields': [f"Unknown field(s): {', '.join(unknown)}."]})
+            if 'id' not in fields:
+                fields.insert(0, 'id')
+        expand = {name for name in (part.strip() for part in (expand_param or '').split(',')) if name}
+        unknown = sorted(expand - set(EXPANDABLE_FIELDS))
+        if unknown:
+            raise ValidationError({'expand': [f"Cannot expand: {', '.join(unknown)}."]})
+        return fields, expand
 
     @staticmethod
     def get_guideline(pk):
         """Return a single guideline by primary key."""
         return get_object_or_404(Guideline, pk=pk)
 
+    @staticmethod
+    def get_document(pk):
+        """
+        Return ``(storage_key, original_filename)`` of a guideline's document.
+
+        Raises Http404 if the guideline doesn't exist or its ``external_url``
+        doesn't point into our storage.
+        """
+        row = Guideline.objects.filter(pk=pk).values_list('external_url', 'original_filename').first()
+        key = get_s3_key(row[0]) if row else None
+        if key is None:
+            raise Http404
+        return key, row[1]
+
+    @staticmethod
+    def get_guideline_validators(pk):
+        """
+        Return ``(etag, last_modified)`` for a guideline, or None if it doesn't exist.
+
+        One primary-key lookup of the version columns (the guideline's and
+        its trust's, since the detail payload embeds the trust); the row
+        itself is not loaded.
+        """
+        row = (
+            Guideline.objects.filter(pk=pk)
+            .values_list('row_version', 'updated_at', 'trust__row_version', 'trust__updated_at')
+            .first()
+        )
+        if row is None:
+            return None
+        version, updated_at, trust_version, trust_updated_at = row
+        last_modified = max(filter(None, (updated_at, trust_updated_at)), default=None)
+        if signing.signing_mode() is None:
+            return f'"{version}.{trust_version}"', last_modified
+        # The payload embeds a signed URL that changes with every signing bucket
+        bucket = signing.current_bucket()
+        last_modified = max(filter(None, (last_modified, signing.bucket_start(bucket))))
+        return f'"{version}.{trust_version}.{bucket}"', last_modified
+
+    @staticmethod
+    def get_guideline_detail(pk, fields=None, expand=(), validators=None):
+        """
+        Return the serialized guideline, served from the two-tier detail cache.
+
+        The payload is cached under ``validators`` (from
+        ``get_guideline_validators()``, read here when not passed): any
+        write changes them, so a cached copy is used only while it is
+        current. Sparse fieldsets are cut from the cached full payload
+        rather than queried, so they never touch the database on a cache
+        hit. The cache holds the stored document URL; it is signed on the
+        way out.
+        """
+        if validators is None:
+            validators = GuidelineService.get_guideline_validators(pk)
+            if validators is None:
+                raise Http404
+        etag, last_modified = validators
+        # updated_at tells apart rows that reuse a deleted guideline's id
+        version = etag.strip('"') + (f'.{last_modified.timestamp()}' if last_modified else '')
+        data = detail_cache.get_or_set(
+            pk, version, lambda: GuidelineSerializer(GuidelineService.get_guideline(pk), context={'sign_urls': False}).data
+        )
+        if data.get('external_url'):
+            data = {**data, 'external_url': sign_document_url(data['external_url'])}
+        if fields is None:
+            return data
+        data = {name: value for name, value in data.items() if name in fields}
+        if data.get('trust') is not None and 'trust' not in expand:
+            data['trust'] = data['trust']['id']
+        return data
+
+    @staticmethod
+    def search_guidelines(query, limit=SEARCH_DEFAULT_LIMIT):
+        """
+        Return ``[(guideline, score)]`` for ``query``, best match first.
+
+        Ranked by the BM25 index (apps.guidelines.search); returns None if
+        the index hasn't been built. Hits for guidelines deleted since the
+        last build are dropped.
+        """
+        index = search.search_index.get()
+        if index is None:
+            return None
+        hits = index.search(query, limit)
+        guidelines = Guideline.objects.select_related('trust').in_bulk([pk for pk, _ in hits])
+        return [(guidelines[pk], score) for pk, score in hits if pk in guidelines]
+
+    @staticmethod
+    def suggest_guidelines(prefix, limit=SUGGEST_DEFAULT_LIMIT):
+        """
+        Return ``[{'id', 'name', 'viewcount'}]`` of guidelines whose name starts
+        with or contains ``prefix``, most viewed first.
+
+        Served from the worker's in-memory name index (apps.guidelines.suggest);
+        no query runs unless the index needs building or refreshing.
+        """
+        return [
+            {'id': pk, 'name': name, 'viewcount': viewcount}
+            for pk, name, viewcount in suggest_index.get().search(prefix, limit)
+        ]
+
+    @staticmethod
+    def search_guideline_ids(term, limit=ADMIN_SEARCH_LIMIT):
+        """
+        Return the ids of up to ``limit`` name matches plus ``limit`` full-text
+        matches of ``term`` (and ``term`` itself if it is a number).
+
+        Both come from the in-memory indexes (suggest and, once built, BM25),
+        so no ``LIKE`` scan of the table runs.
+        """
+        pks = {pk for pk, _, _ in suggest_index.get().search(term, limit)}
+        index = search.search_index.get()
+        if index is not None:
+            pks.update(pk for pk, _ in index.search(term, limit))
+        if term.strip().isdigit():
+            pks.add(int(term))
+        return pks
+
+    @staticmethod
+    def record_view(pk):
+        """Count a view of guideline ``pk`` (buffered; see apps.guidelines.analytics)."""
+        analytics.view_recorder.record(pk)
+
+    @staticmethod
+    def get_trending(medical_speciality=None, trust=None, days=analytics.TRENDING_DEFAULT_DAYS, limit=10):
+        """Return the top ``limit`` guidelines by time-decayed views (cached)."""
+        return analytics.trending(medical_speciality, trust, days, limit)
+
+    @staticmethod
+    def get_changes(since, limit=CHANGES_DEFAULT_LIMIT):
+        """
+        Return the sync feed page after cursor ``since``, or None if the
+        cursor has expired (see apps.guidelines.changes).
+
+        Creates and updates carry the object as the minimal list (guidelines)
+        or trust list serializes it; deletes are tombstones with null data.
+        """
+        page = changes.read(since, limit)
+        if page is None:
+            return None
+        entries, next_seq, has_more = page
+        wanted = {GuidelineChange.GUIDELINE: [], GuidelineChange.TRUST: []}
+        for _, kind, pk, action in entries:
+            if action != GuidelineChange.DELETE:
+                wanted[kind].append(pk)
+        payloads = {}
+        if wanted[GuidelineChange.GUIDELINE]:
+            guidelines = Guideline.objects.filter(pk__in=wanted[GuidelineChange.GUIDELINE]).only(
+                *GuidelineMinimalSerializer.Meta.fields
+            )
+            payloads.update(
+                ((GuidelineChange.GUIDELINE, item['id']), item)
+                for item in GuidelineMinimalSerializer(guidelines, many=True).data
+            )
+        if wanted[GuidelineChange.TRUST]:
+            trusts = Trust.objects.filter(pk__in=wanted[GuidelineChange.TRUST])
+            payloads.update(((GuidelineChange.TRUST, item['id']), item) for item in TrustSerializer(trusts, many=True).data)
+        results = []
+        for seq, kind, pk, action in entries:
+            data = None
+            if action != GuidelineChange.DELETE:
+                data = payloads.get((kind, pk))
+                if data is None:
+                    # Deleted since: its tombstone comes later in the feed
+                    continue
+            results.append({'seq': seq, 'type': kind, 'id': pk, 'action': action, 'data': data})
+        return {'changes': results, 'next': next_seq, 'has_more': has_more}
+
+    @staticmethod
+    def get_guideline_history(pk, limit=100):
+        """Return the newest ``limit`` history rows of a guideline."""
+        return GuidelineHistory.objects.filter(guideline_id=pk).order_by('-history_date', '-id')[:limit]
+
     @staticmethod
     def create_guideline(validated_data, user):
         """Create and return a new guideline."""
         # Set default trust_id=2 if not provided
         if 'trust' not in validated_data or validated_data['trust'] is None:
             validated_data['trust_id'] = 2
-        return Guideline.objects.create(**validated_data)
+        with transaction.atomic():
+            guideline = Guideline.objects.create(**metadata.with_json(validated_data))
+            history.record_created(guideline, user)
+            _notify('create', [guideline.pk])
+        return guideline
 
     @staticmethod
     def update_guideline(guideline, validated_data):
-        """Update and return the guideline instance."""
-        for attr, value in validated_data.items():
+        """Update and return the guideline instance, saving only the changed fields."""
+        before = history.snapshot(guideline)
+        for attr, value in metadata.with_json(dict(validated_data)).items():
             setattr(guideline, attr, value)
-        guideline.save()
+        changed_fields = history.diff(before, history.snapshot(guideline))
+        if not changed_fields:
+            return guideline
+        guideline.row_version = F('row_version') + 1
+        with transaction.atomic():
+            guideline.save(update_fields=[*changed_fields, *_derived_fields(changed_fields), *VERSION_FIELDS])
+            guideline.refresh_from_db(fields=['row_version'])
+            history.record_changed(guideline, changed_fields)
+            _notify('update', [guideline.pk])
         return guideline
 
+    @staticmethod
+    def apply_batch(operations, user, atomic=True):
+        """
+        Validate and apply a list of create/update/delete operations.
+
+        Each operation is ``{"op": "create", "data": {...}}``,
+        ``{"op": "update", "id": 1, "data": {...}}`` (partial update) or
+        ``{"op": "delete", "id": 1}``. Returns ``(applied, results)`` with one
+        result dict per operation, in order.
+
+        All operations are validated up front with one query for the targeted
+        guidelines and one for the referenced trusts. With ``atomic`` any
+        invalid operation means nothing is applied; otherwise the valid ones
+        are. Writes run in one transaction using bulk_create / bulk_update /
+        a single DELETE, and history rows and the change signal are sent
+        once per batch.
+        """
+        results = [
+            {'index': i, 'op': item.get('op') if isinstance(item, dict) else None}
+            for i, item in enumerate(operations)
+        ]
+        ids = {}
+        for item, result in zip(operations, results):
+            if not isinstance(item, dict) or item.get('op') not in ('create', 'update', 'delete'):
+                result['errors'] = {'op': ['Expected "create", "update" or "delete".']}
+            elif item['op'] != 'create':
+                pk = item.get('id')
+                if not isinstance(pk, int) or isinstance(pk, bool):
+                    result['errors'] = {'id': ['A guideline id is required.']}
+                elif pk in ids:
+                    result['errors'] = {'id': [f'Guideline {pk} already appears at index {ids[pk]}.']}
+                else:
+                    ids[pk] = result['index']
+                    result['id'] = pk
+
+        existing = Guideline.objects.in_bulk(list(ids))
+        to_create, to_update, to_delete = [], [], []
+        for item, result in zip(operations, results):
+            if 'errors' in result:
+                continue
+            if item['op'] == 'create':
+                serializer = GuidelineWriteSerializer(data=item.get('data', {}))
+            else:
+                instance = existing.get(result['id'])
+                if instance is None:
+                    result['errors'] = {'id': ['Guideline not found.']}
+                    continue
+                if item['op'] == 'delete':
+                    to_delete.append((result, instance))
+                    continue
+                serializer = GuidelineWriteSerializer(instance, data=item.get('data', {}), partial=True)
+            if not serializer.is_valid():
+                result['errors'] = serializer.errors
+            elif item['op'] == 'create':
+                to_create.append((result, serializer.validated_data))
+            else:
+                to_update.append((result, serializer.instance, serializer.validated_data))
+
+        trust_ids = {data.get('trust_id', DEFAULT_TRUST_ID) for _, data in to_create}
+        trust_ids |= {data['trust_id'] for _, _, data in to_update if 'trust_id' in data}
+        known_trusts = set(Trust.objects.filter(pk__in=trust_ids).values_list('pk', flat=True))
+        for result, data in to_create:
+            if data.get('trust_id', DEFAULT_TRUST_ID) not in known_trusts:
+                result['errors'] = {'trust': ['Trust not found.']}
+        for result, _, data in to_update:
+            if 'trust_id' in data and data['trust_id'] not in known_trusts:
+                result['errors'] = {'trust': ['Trust not found.']}
+
+        failed = False
+        for result in results:
+            if 'errors' in result:
+                result['status'] = 'error'
+                failed = True
+        if failed and atomic:
+            for result in results:
+                result.setdefault('status', 'skipped')
+            return False, results
+        to_create = [(r, data) for r, data in to_create if 'errors' not in r]
+        to_update = [(r, obj, data) for r, obj, data in to_update if 'errors' not in r]
+
+        now = timezone.now()
+        with transaction.atomic():
+            if to_create:
+                created = Guideline.objects.bulk_create(
+                    [Guideline(**metadata.with_json({'trust_id': DEFAULT_TRUST_ID, **data})) for _, data in to_create],
+                    batch_size=BATCH_SIZE,
+                )
+                for (result, _), guideline in zip(to_create, created):
+                    result.update(status='created', id=guideline.pk)
+                    history.record_created(guideline, user)
+                _notify('create', [guideline.pk for guideline in created])
+
+            changed, fields = [], set()
+            for result, guideline, data in to_update:
+                before = history.snapshot(guideline)
+                for attr, value in metadata.with_json(dict(data)).items():
+                    setattr(guideline, attr, value)
+                changed_fields = history.diff(before, history.snapshot(guideline))
+                if not changed_fields:
+                    result['status'] = 'unchanged'
+                    continue
+                guideline.updated_at = now
+                guideline.row_version = F('row_version') + 1
+                fields.update(changed_fields)
+                changed.append(guideline)
+                history.record_changed(guideline, changed_fields, user)
+                result['status'] = 'updated'
+            if changed:
+                Guideline.objects.bulk_update(
+                    changed, [*fields, *_derived_fields(fields), *VERSION_FIELDS], batch_size=BATCH_SIZE
+                )
+                _notify('update', [guideline.pk for guideline in changed])
+
+            if to_delete:
+                pks = [guideline.pk for _, guideline in to_delete]
+                Guideline.objects.filter(pk__in=pks).delete()
+                for result, guideline in to_delete:
+                    result['status'] = 'deleted'
+                    history.record_deleted(guideline.pk, user)
+                _notify('delete', pks)
+        return not failed, results
+
+    @staticmethod
+    def set_fields(queryset, values, user=None):
+        """
+        Set ``values`` (``{attname: value}``) on every guideline in ``queryset``.
+
+        Guidelines that already hold the values are left alone. The others
+        are written by one UPDATE that also bumps their version, after one
+        SELECT of their old values for the history rows; ``guidelines_changed``
+        is sent once. Returns the number of guidelines changed.
+        """
+        targets = queryset.exclude(**values)
+        with transaction.atomic():
+            rows = list(targets.select_for_update(of=('self',)).values_list('pk', *values).order_by())
+            if not rows:
+                return 0
+            targets.update(**values, updated_at=timezone.now(), row_version=F('row_version') + 1)
+            for pk, *old in rows:
+                changed_fields = history.diff(dict(zip(values, old)), values)
+                history.record(GuidelineHistory.CHANGED, pk, changed_fields, user)
+            _notify('update', [row[0] for row in rows])
+        return len(rows)
+
+    @staticmethod
+    def delete_guidelines(queryset, user=None):
+        """Delete every guideline in ``queryset`` with one DELETE; returns the number deleted."""
+        targets = queryset.order_by()
+        with transaction.atomic():
+            pks = list(targets.select_for_update(of=('self',)).values_list('pk', flat=True))
+            if not pks:
+                return 0
+            targets.delete()
+            for pk in pks:
+                history.record_deleted(pk, user)
+            _notify('delete', pks)
+        return len(pks)
+
     @staticmethod
     def delete_guideline(guideline):
         """Delete the guideline instance."""
-        guideline.delete()
+        pk = guideline.pk
+        with transaction.atomic():
+            guideline.delete()
+            history.record_deleted(pk)
+            _notify('delete', [pk])
+
+
+class TrustService:
+    @staticmethod
+    def list_trusts():
+        """Return a queryset of all trusts."""
+        return Trust.objects.order_by('name')
+
+    @staticmethod
+    def get_trust(pk):
+        """Return a single trust by primary key."""
+        return get_object_or_404(Trust, pk=pk)
+
+    @staticmethod
+    def save_trust(trust):
+        """
+        Create or update ``trust``, bumping its version on update.
+
+        Guideline detail payloads embed the trust, so its guidelines are
+        reported as changed (which drops their cached payloads).
+        """
+        with transaction.atomic():
+            if trust.pk is None or trust._state.adding:
+                trust.save()
+                changes.record(GuidelineChange.TRUST, GuidelineChange.CREATE, [trust.pk])
+                return trust
+            trust.row_version = F('row_version') + 1
+            trust.save()
+            trust.refresh_from_db(fields=['row_version'])
+            changes.record(GuidelineChange.TRUST, GuidelineChange.UPDATE, [trust.pk])
+            pks = list(Guideline.objects.filter(trust_id=trust.pk).values_list('pk', flat=True))
+            if pks:
+                # The feed's guideline payloads don't embed the trust: its own row covers it
+                _notify('update', pks, feed=False)
+        return trust
+
+    @staticmethod
+    def get_trust_validators(pk):
+        """Return ``(etag, last_modified)`` for a trust, or None if it doesn't exist."""
+        row = Trust.objects.filter(pk=pk).values_list('row_version', 'updated_at').first()
+        if row is None:
+            return None
+        version, updated_at = row
+        return f'"{version}"', updated_at
@@ -0,0 +1,10 @@
+"""
+apps/guidelines/signals.py
+
+Signals sent by GuidelineService after guideline changes are committed.
+"""
+from django.dispatch import Signal
+
+# Sent once per committed write with ``action`` ("create", "update" or
+# "delete") and ``pks``, the list of affected guideline primary keys.
+guidelines_changed = Signal()
@@ -0,0 +1,263 @@
+"""
+apps/guidelines/suggest.py
+
+In-process typeahead index of guideline names.
+
+Each worker holds a compact index of (normalised name, viewcount) built
+lazily on the first suggestion request:
+
+* a sorted list of normalised names with a parallel array of entry
+  positions, so a name prefix is a ``bisect`` range;
+* trigram postings (trigram -> ascending entry positions) for infix
+  matches of three or more characters, verified with a substring test;
+* all entries ordered by viewcount, so broad queries (more candidates than
+  ``SCAN_THRESHOLD``) scan in rank order and stop after ``limit`` matches.
+
+Results are ranked by viewcount. Matching uses at most ``MAX_KEY_LENGTH``
+characters of each name, which bounds the postings per entry; the estimated
+size is exported as ``guideline_suggest_index_bytes``.
+
+GuidelineService writes are applied incrementally from the change feed
+(apps.guidelines.changes): before its next lookup every worker reads the
+feed rows after its cursor and re-reads just the guidelines they name. The
+feed's sequence is allocated by the database, so concurrent writers on any
+cache backend can't lose each other's changes. Changed entries are
+tombstoned and re-appended; the index is rebuilt when a quarter of it is
+dead, when it is older than ``SUGGEST_MAX_AGE`` (viewcounts drift), when the
+worker's cursor fell behind a feed compaction or when more than
+``MAX_REPLAY`` changes are pending.
+"""
+import heapq
+import re
+import sys
+import threading
+import time
+import unicodedata
+from array import array
+from bisect import bisect_left
+
+from django.conf import settings
+from prometheus_client import Gauge
+
+from . import changes
+from .models import Guideline, GuidelineChange
+
+SUGGEST_INDEX_BYTES = Gauge(
+    'guideline_suggest_index_bytes',
+    'Estimated memory held by the in-process guideline suggestion index.',
+    multiprocess_mode='livesum',
+)
+SUGGEST_INDEX_ENTRIES = Gauge(
+    'guideline_suggest_index_entries',
+    'Live guidelines in the in-process suggestion index.',
+    multiprocess_mode='livesum',
+)
+
+MAX_KEY_LENGTH = 64
+SCAN_THRESHOLD = 2000
+MAX_DEAD_FRACTION = 0.25
+MAX_REPLAY = 5000
+
+_WORD_RE = re.compile(r'[^\W_]+')
+
+
+def normalize(text):
+    """Lower-case ``text``, strip accents and collapse punctuation to single spaces."""
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    return ' '.join(_WORD_RE.findall(text.lower()))
+
+
+def trigrams(key):
+    return {key[i:i + 3] for i in range(len(key) - 2)}
+
+
+class SuggestIndex:
+    """Name index of one snapshot of the guideline table plus applied changes."""
+
+    def __init__(self, rows):
+        self.ids = array('q')
+        self.viewcounts = array('q')
+        self.names = []
+        self.keys = []
+        self.alive = bytearray()
+        self.position = {}
+        self.postings = {}
+        self.dead = 0
+        for pk, name, viewcount in rows:
+            self._append(pk, name, viewcount)
+        self.base_size = len(self.ids)
+        order = sorted(range(self.base_size), key=self.keys.__getitem__)
+        self.sorted_keys = [self.keys[pos] for pos in order]
+        self.sorted_positions = array('I', order)
+        self.by_rank = array('I', sorted(range(self.base_size), key=lambda pos: (-self.viewcounts[pos], self.ids[pos])))
+        self.built_at = time.monotonic()
+        self.nbytes = self._measure()
+
+    def __len__(self):
+        return len(self.position)
+
+    def _append(self, pk, name, viewcount):
+        pos = len(self.ids)
+        key = normalize(name)[:MAX_KEY_LENGTH]
+        self.viewcounts.append(viewcount or 0)
+        self.names.append(name)
+        self.keys.append(key)
+        self.alive.append(1)
+        # ids last: lock-free readers use len(ids) as the number of complete entries
+        self.ids.append(pk)
+        self.position[pk] = pos
+        for gram in trigrams(key):
+            self.postings.setdefault(gram, array('I')).append(pos)
+        return pos, key
+
+    def _remove(self, pk):
+        pos = self.position.pop(pk, None)
+        if pos is not None:
+            self.alive[pos] = 0
+            self.dead += 1
+
+    def apply(self, rows, removed):
+        """Replace the entries of changed guidelines (``rows``) and drop ``removed`` ids."""
+        for pk in removed:
+            self._remove(pk)
+        for pk, name, viewcount in rows:
+            self._remove(pk)
+            pos, key = self._append(pk, name, viewcount)
+            index = bisect_left(self.sorted_keys, key)
+            self.sorted_keys.insert(index, key)
+            self.sorted_positions.insert(index, pos)
+        self.nbytes = self._measure()
+
+    @property
+    def dead_fraction(self):
+        return self.dead / len(self.ids) if self.ids else 0.0
+
+    def _measure(self):
+        """Approximate bytes held: containers, strings and arrays."""
+        size = sum(sys.getsizeof(value) for value in (
+            self.ids, self.viewcounts, self.names, self.keys, self.alive, self.position,
+            self.postings, self.sorted_keys, self.sorted_positions, self.by_rank,
+        ))
+        size += sum(sys.getsizeof(name) for name in self.names)
+        size += sum(sys.getsizeof(key) for key in self.keys)
+        size += sum(sys.getsizeof(gram) + sys.getsizeof(positions) for gram, positions in self.postings.items())
+        return size
+
+    def _rank(self, positions, limit):
+        return heapq.nsmallest(limit, positions, key=lambda pos: (-self.viewcounts[pos], self.ids[pos]))
+
+    def _scan(self, matches, limit):
+        """Walk entries in viewcount order, keeping the first ``limit`` that match."""
+        found = []
+        for pos in self.by_rank:
+            if self.alive[pos] and matches(self.keys[pos]):
+                found.append(pos)
+                if len(found) == limit:
+                    break
+        # Entries appended since the build are not in by_rank
+        found += [pos for pos in range(self.base_size, len(self.ids)) if self.alive[pos] and matches(self.keys[pos])]
+        return self._rank(found, limit)
+
+    def search(self, text, limit=10):
+        """Return ``[(id, name, viewcount)]`` for names starting with or containing ``text``."""
+        query = normalize(text)[:MAX_KEY_LENGTH]
+        if not query or limit <= 0:
+            return []
+        if len(query) < 3:
+            lo = bisect_left(self.sorted_keys, query)
+            hi = bisect_left(self.sorted_keys, query + '\U0010ffff', lo)
+            if hi - lo > SCAN_THRESHOLD:
+                positions = self._scan(lambda key: key.startswith(query), limit)
+            else:
+                positions = self._rank((pos for pos in self.sorted_positions[lo:hi] if self.alive[pos]), limit)
+        else:
+            lists = sorted((self.postings.get(gram, ()) for gram in trigrams(query)), key=len)
+            if len(lists[0]) > SCAN_THRESHOLD:
+                positions = self._scan(lambda key: query in key, limit)
+            else:
+                candidates = set(lists[0])
+                for other in lists[1:]:
+                    if len(candidates) * 8 < len(other):
+                        # Cheaper to verify the few candidates than to walk a long list
+                        break
+                    candidates.intersection_update(other)
+                positions = self._rank(
+                    (pos for pos in candidates if self.alive[pos] and query in self.keys[pos]), limit
+                )
+        return [(self.ids[pos], self.names[pos], self.viewcounts[pos]) for pos in positions]
+
+
+def _load(pks=None):
+    queryset = Guideline.objects.all()
+    if pks is not None:
+        queryset = queryset.filter(pk__in=pks)
+    return queryset.values_list('id', 'name', 'viewcount').iterator(chunk_size=5000)
+
+
+class SuggestIndexHandle:
+    """
+    The worker's SuggestIndex, built on first use and kept in sync.
+
+    ``get()`` replays the change feed after the index's cursor (checking at
+    most every ``check_interval`` seconds) before returning the index.
+    """
+
+    def __init__(self, check_interval=1.0):
+        self.check_interval = check_interval
+        self._index = None
+        self._seq = 0
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def max_age(self):
+        return getattr(settings, 'SUGGEST_MAX_AGE', 600)
+
+    def get(self):
+        now = time.monotonic()
+        index = self._index
+        if index is not None and now - self._checked < self.check_interval:
+            return index
+        # While another thread refreshes, keep serving the current index
+        if not self._lock.acquire(blocking=index is None):
+            return index
+        try:
+            self._checked = now
+            index = self._index
+            if (
+                index is None or now - index.built_at > self.max_age
+                or index.dead_fraction > MAX_DEAD_FRACTION or self._seq < changes.floor()
+            ):
+                return self._rebuild()
+            pending = list(
+                GuidelineChange.objects.filter(seq__gt=self._seq)
+                .order_by('seq')
+                .values_list('seq', 'kind', 'object_id')[:MAX_REPLAY + 1]
+            )
+            if len(pending) > MAX_REPLAY:
+                return self._rebuild()
+            if pending:
+                pks = {pk for _, kind, pk in pending if kind == GuidelineChange.GUIDELINE}
+                rows = list(_load(pks))
+                index.apply(rows, pks - {row[0] for row in rows})
+                self._seq = pending[-1][0]
+                self._report(index)
+            return index
+        finally:
+            self._lock.release()
+
+    def _rebuild(self):
+        # Cursor first: changes committed during the build are replayed after it
+        seq = changes.latest()
+        index = SuggestIndex(_load())
+        self._index, self._seq = index, seq
+        self._report(index)
+        return index
+
+    def _report(self, index):
+        SUGGEST_INDEX_BYTES.set(index.nbytes)
+        SUGGEST_INDEX_ENTRIES.set(len(index))
+
+
+suggest_index = SuggestIndexHandle()
@@ -1,3 +1,844 @@
+import os
+import tempfile
+from datetime import datetime, timedelta, timezone as dt_timezone
+from io import StringIO
+from itertools import combinations
+from unittest import mock
+
+from django.core.management import call_command
+from django.db import DatabaseError, connection, transaction
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from apps.core import pagination
+from apps.users.models import User
+
+from . import analytics, changes, geo, history, metadata, search, suggest, whitespace
+from .cache import GuidelineDetailCache, detail_cache
+from .models import Guideline, GuidelineChange, GuidelineHistory, GuidelineViewDaily, GuidelineViewEvent, Trust
+from .services import FILTERS, ORDERINGS, GuidelineService, TrustService
+
+
+class UnmanagedTablesMixin:
+    """Create the unmanaged Trust/Guideline tables (with their Meta.indexes) for the test."""
+
+    @classmethod
+    def setUpClass(cls):
+        with connection.schema_editor() as editor:
+            for model in (Trust, Guideline):
+                editor.create_model(model)
+                # create_model() skips indexes of unmanaged models
+                for index in model._meta.indexes:
+                    editor.add_index(model, index)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        with connection.schema_editor() as editor:
+            editor.delete_model(Guideline)
+            editor.delete_model(Trust)
+
+
+class GuidelineFilterIndexTests(UnmanagedTablesMixin, TestCase):
+    """Every supported filter combination and ordering is answered from an index."""
+
+    VALUES = {'trust': '1', 'medical_speciality': 'Cardiology', 'locality': 'North'}
+    INDEXES = {index.name for index in Guideline._meta.indexes}
+
+    def plan(self, params):
+        filters, ordering = GuidelineService.parse_filters(params)
+        queryset = GuidelineService.list_guidelines(filters=filters, ordering=ordering)
+        if connection.vendor == 'postgresql':
+            # The test tables are tiny; make the planner show which index it would use
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        return queryset.explain()
+
+    def assertUsesIndex(self, params):
+        plan = self.plan(params)
+        self.assertTrue(
+            any(name in plan for name in self.INDEXES),
+            f'{params} does not use a guideline index:\n{plan}',
+        )
+
+    def test_filter_combinations_use_an_index(self):
+        for size in range(1, len(FILTERS) + 1):
+            for names in combinations(FILTERS, size):
+                params = {name: self.VALUES[name] for name in names}
+                with self.subTest(params=params):
+                    self.assertUsesIndex(params)
+
+    def test_filter_with_ordering_uses_an_index(self):
+        for name in FILTERS:
+            for ordering in ('name', '-name'):
+                params = {name: self.VALUES[name], 'ordering': ordering}
+                with self.subTest(params=params):
+                    self.assertUsesIndex(params)
+
+    def test_orderings_use_an_index(self):
+        for ordering in ORDERINGS:
+            with self.subTest(ordering=ordering):
+                self.assertUsesIndex({'ordering': ordering})
+
+
+class TrustLocationTests(UnmanagedTablesMixin, TestCase):
+    """Radius queries use the trust location index and exact distances."""
+
+    @classmethod
+    def setUpTestData(cls):
+        Trust.objects.bulk_create([
+            Trust(id=1, name='Leeds', latitude=53.8008, longitude=-1.5491),
+            Trust(id=2, name='Bradford', latitude=53.7960, longitude=-1.7594),
+            Trust(id=3, name='London', latitude=51.5074, longitude=-0.1278),
+            Trust(id=4, name='Unlocated'),
+        ])
+        Guideline.objects.bulk_create([
+            Guideline(id=pk, name=f'Guideline {pk}', trust_id=pk) for pk in (1, 2, 3, 4)
+        ])
+
+    def test_bounding_box_uses_the_location_index(self):
+        min_lat, max_lat, ((min_lng, max_lng),) = geo.bounding_box(53.8, -1.55, 25)
+        queryset = Trust.objects.filter(latitude__range=(min_lat, max_lat), longitude__range=(min_lng, max_lng))
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        self.assertIn('trust_location_idx', queryset.explain())
+
+    def test_trusts_near_filters_by_exact_distance(self):
+        nearby = geo.trusts_near(53.8008, -1.5491, 25)
+        self.assertEqual([pk for pk, _ in nearby], [1, 2])
+        self.assertAlmostEqual(nearby[1][1], 13.9, places=0)
+
+    def test_near_filter_orders_guidelines_by_distance(self):
+        filters, ordering = GuidelineService.parse_filters({'near': '53.79,-1.75', 'radius': '50'})
+        queryset = GuidelineService.list_guidelines(filters=filters, ordering=ordering)
+        self.assertEqual([guideline.pk for guideline in queryset], [2, 1])
+
+    def test_bounding_box_crossing_the_antimeridian(self):
+        _, _, ranges = geo.bounding_box(0, 179.9, 50)
+        self.assertEqual(len(ranges), 2)
+        self.assertEqual(ranges[0][1], 180.0)
+        self.assertEqual(ranges[1][0], -180.0)
+
+
+class MetadataFilterTests(UnmanagedTablesMixin, TestCase):
+    """Metadata filters run in the database; hot keys use their expression index."""
+
+    @classmethod
+    def setUpTestData(cls):
+        trust = Trust.objects.create(id=1, name='Trust')
+        for pk, text in enumerate(['{"source": "nice", "year": 2020, "flag": true}', '{"source": "local"}', 'free text'], 1):
+            GuidelineService.create_guideline({'name': f'Guideline {pk}', 'trust': trust, 'metadata': text}, None)
+
+    def ids(self, params):
+        filters, ordering = GuidelineService.parse_filters(params)
+        return sorted(GuidelineService.list_guidelines(filters=filters, ordering=ordering).values_list('id', flat=True))
+
+    def test_metadata_json_follows_metadata(self):
+        self.assertEqual(
+            list(Guideline.objects.order_by('id').values_list('metadata_json', flat=True)),
+            [{'source': 'nice', 'year': 2020, 'flag': True}, {'source': 'local'}, None],
+        )
+
+    def test_key_and_containment_filters(self):
+        self.assertEqual(self.ids({'meta.source': 'local'}), [2])
+        self.assertEqual(self.ids({'meta.year': '2020', 'meta.flag': 'true'}), [1])
+        self.assertEqual(self.ids({'metadata__contains': '{"source": "nice", "year": 2020}'}), [1])
+
+    def test_indexed_key_uses_its_index(self):
+        filters, _ = GuidelineService.parse_filters({'meta.source': 'nice'})
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        self.assertIn(metadata.key_index_name('source'), Guideline.objects.filter(filters).explain())
+
+
+class ChangeFeedTests(UnmanagedTablesMixin, TestCase):
+    """Service writes append to the sync feed; compaction keeps it bounded."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.trust = TrustService.save_trust(Trust(name='Trust'))
+        cls.kept = GuidelineService.create_guideline({'name': 'Kept', 'trust': cls.trust}, None)
+        removed = GuidelineService.create_guideline({'name': 'Removed', 'trust': cls.trust}, None)
+        cls.removed_id = removed.pk
+        GuidelineService.update_guideline(cls.kept, {'name': 'Kept 2'})
+        GuidelineService.delete_guideline(removed)
+
+    def entries(self, since=0, limit=100):
+        return [(c['type'], c['id'], c['action']) for c in GuidelineService.get_changes(since, limit)['changes']]
+
+    def test_feed_coalesces_to_the_latest_change_per_object(self):
+        self.assertEqual(self.entries(), [
+            ('trust', self.trust.pk, 'create'),
+            ('guideline', self.kept.pk, 'update'),
+            ('guideline', self.removed_id, 'delete'),
+        ])
+        page = GuidelineService.get_changes(0, 2)
+        self.assertTrue(page['has_more'])
+        self.assertEqual(self.entries(page['next']), [('guideline', self.kept.pk, 'update'), ('guideline', self.removed_id, 'delete')])
+
+    def test_compaction_drops_superseded_rows_and_expires_old_cursors(self):
+        changes.compact(keep_days=1)
+        self.assertEqual(GuidelineChange.objects.count(), 3)
+        self.assertEqual(len(self.entries()), 3)
+        GuidelineChange.objects.update(changed_at=GuidelineChange.objects.first().changed_at.replace(year=2000))
+        changes.compact(keep_days=1)
+        self.assertIsNone(GuidelineService.get_changes(0))
+        self.assertEqual(GuidelineService.get_changes(changes.latest())['changes'], [])
+
+
+class TrustAPITests(UnmanagedTablesMixin, TestCase):
+    """Trust endpoints, including conditional GETs."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.trust = Trust.objects.create(name='Trust')
+
+    def setUp(self):
+        self.client = APIClient(HTTP_HOST='localhost')
+
+    def test_retrieve_and_revalidate(self):
+        response = self.client.get(f'/api/trusts/{self.trust.pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'id': self.trust.pk, 'name': 'Trust'})
+        response = self.client.get(f'/api/trusts/{self.trust.pk}/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_unknown_trust_is_404(self):
+        self.assertEqual(self.client.get('/api/trusts/999/').status_code, 404)
+
+
+class SuggestIndexTests(UnmanagedTablesMixin, TestCase):
+    """Typeahead matching, ranking and replay of service writes."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.trust = Trust.objects.create(name='Trust')
+        for name, viewcount in [('Asthma in adults', 5), ('Acute asthma', 9), ('Crohn\'s disease', 1), ('Anaphylaxis', 3)]:
+            Guideline.objects.create(name=name, viewcount=viewcount, trust=cls.trust)
+
+    def names(self, index, text):
+        return [name for _, name, _ in index.search(text)]
+
+    def test_prefix_and_infix_matches_ranked_by_viewcount(self):
+        index = suggest.SuggestIndex(suggest._load())
+        self.assertEqual(self.names(index, 'a'), ['Acute asthma', 'Asthma in adults', 'Anaphylaxis'])
+        self.assertEqual(self.names(index, 'sthm'), ['Acute asthma', 'Asthma in adults'])
+        self.assertEqual(self.names(index, 'x'), [])
+
+    def test_accents_case_and_punctuation_are_folded(self):
+        index = suggest.SuggestIndex(suggest._load())
+        self.assertEqual(self.names(index, 'CROHN S'), ["Crohn's disease"])
+        self.assertEqual(self.names(index, 'anaphylaxïs'), ['Anaphylaxis'])
+
+    def test_service_writes_are_applied_after_the_write(self):
+        handle = suggest.SuggestIndexHandle(check_interval=0)
+        self.assertEqual(self.names(handle.get(), 'bronch'), [])
+        created = GuidelineService.create_guideline({'name': 'Bronchiolitis', 'trust': self.trust}, None)
+        self.assertEqual(self.names(handle.get(), 'bronch'), ['Bronchiolitis'])
+        GuidelineService.update_guideline(created, {'name': 'Croup'})
+        self.assertEqual(self.names(handle.get(), 'bronch'), [])
+        self.assertEqual(self.names(handle.get(), 'croup'), ['Croup'])
+        GuidelineService.delete_guideline(Guideline.objects.get(name='Anaphylaxis'))
+        self.assertEqual(self.names(handle.get(), 'anaph'), [])
+
+
+class GuidelineDetailCacheTests(UnmanagedTablesMixin, TestCase):
+    """Detail payloads are cached under the validators, so writes invalidate both tiers."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.trust = Trust.objects.create(name='Trust')
+        cls.guideline = GuidelineService.create_guideline({'name': 'Before', 'trust': cls.trust}, None)
+
+    def setUp(self):
+        detail_cache.local.clear()
+
+    def detail(self):
+        return GuidelineService.get_guideline_detail(self.guideline.pk)['name']
+
+    def test_local_hit_skips_the_shared_cache(self):
+        self.detail()
+        with mock.patch.object(detail_cache.shared, 'get', side_effect=AssertionError('shared cache read')):
+            with self.assertNumQueries(1):  # the validators
+                self.assertEqual(self.detail(), 'Before')
+
+    def test_write_invalidates_both_tiers(self):
+        other_worker = GuidelineDetailCache()
+        with mock.patch('apps.guidelines.services.detail_cache', other_worker):
+            self.assertEqual(self.detail(), 'Before')
+        self.assertEqual(self.detail(), 'Before')
+        GuidelineService.update_guideline(Guideline.objects.get(pk=self.guideline.pk), {'name': 'After'})
+        self.assertEqual(self.detail(), 'After')
+        with mock.patch('apps.guidelines.services.detail_cache', other_worker):
+            # Its local copy is of the old version, and the shared copy too
+            self.assertEqual(self.detail(), 'After')
+        trust = Trust.objects.get(pk=self.trust.pk)
+        trust.name = 'Renamed'
+        TrustService.save_trust(trust)
+        self.assertEqual(GuidelineService.get_guideline_detail(self.guideline.pk)['trust']['name'], 'Renamed')
+
+
+class WhitespaceConsumerTests(UnmanagedTablesMixin, TestCase):
+    """The queue consumer against InMemoryQueue: settlement of each outcome."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.trust = Trust.objects.create(name='Trust')
+        cls.guideline = GuidelineService.create_guideline({'name': 'Existing', 'trust': cls.trust}, None)
+
+    def consume(self, *bodies):
+        queue = whitespace.InMemoryQueue(bodies)
+        consumer = whitespace.Consumer(queue, concurrency=2, max_wait=0)
+        try:
+            consumer.handle_batch(queue.receive(len(bodies), 0))
+        finally:
+            consumer.pool.shutdown()
+        return queue, consumer
+
+    def test_applied_dead_lettered_and_abandoned(self):
+        with mock.patch.object(whitespace, '_fetch', side_effect=OSError('unreachable')):
+            queue, consumer = self.consume(
+                {'type': 'guideline.upserted', 'data': {'name': 'New', 'trust': 'New trust'}},
+                {'type': 'guideline.upserted', 'id': self.guideline.pk, 'data': {'name': 'Renamed'}},
+                'not json',
+                {'type': 'guideline.upserted', 'id': self.guideline.pk, 'href': '/guidelines/1'},
+            )
+        self.assertEqual(consumer.totals, {'applied': 2, 'dead_lettered': 1, 'abandoned': 1})
+        self.assertEqual(queue.dead_lettered[0][1:], ('InvalidMessage', 'Body is not JSON'))
+        self.assertEqual(len(queue), 1)  # the failed fetch is back on the queue
+        self.assertEqual(Guideline.objects.get(pk=self.guideline.pk).name, 'Renamed')
+        self.assertEqual(Guideline.objects.get(name='New').trust.name, 'New trust')
+
+    def test_failed_transaction_abandons_the_whole_batch(self):
+        with mock.patch.object(GuidelineService, 'apply_batch', side_effect=DatabaseError('deadlock')):
+            queue, consumer = self.consume(
+                {'type': 'trust.upserted', 'name': 'Rolled back'},
+                {'type': 'guideline.deleted', 'id': self.guideline.pk},
+            )
+        self.assertEqual(consumer.totals['abandoned'], 2)
+        self.assertEqual(len(queue), 2)
+        self.assertGreater(consumer.backoff, 0)
+        self.assertFalse(Trust.objects.filter(name='Rolled back').exists())
+        self.assertTrue(Guideline.objects.filter(pk=self.guideline.pk).exists())
+
+    def test_deletes_are_idempotent(self):
+        deleted = {'type': 'guideline.deleted', 'id': self.guideline.pk}
+        queue, _ = self.consume(deleted, deleted)
+        self.assertEqual(len(queue.completed), 2)
+        queue, _ = self.consume(deleted)
+        self.assertEqual(len(queue.completed), 1)
+        self.assertFalse(Guideline.objects.filter(pk=self.guideline.pk).exists())
+
+    def test_update_after_delete_is_dead_lettered(self):
+        queue, _ = self.consume(
+            {'type': 'guideline.deleted', 'id': self.guideline.pk},
+            {'type': 'guideline.upserted', 'id': self.guideline.pk, 'data': {'name': 'Too late'}},
+        )
+        self.assertEqual(len(queue.completed), 1)
+        self.assertIn('deleted earlier in the same batch', queue.dead_lettered[0][2])
+        self.assertFalse(Guideline.objects.filter(pk=self.guideline.pk).exists())
+
+
+class GuidelineViewAnalyticsTests(UnmanagedTablesMixin, TestCase):
+    """Views are counted once per served body, rolled up daily and ranked with decay."""
+
+    NOW = datetime(2024, 3, 10, 14, 30, tzinfo=dt_timezone.utc)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.trust = Trust.objects.create(name='Trust')
+        cls.first = Guideline.objects.create(name='First', medical_speciality='Cardiology', trust=cls.trust)
+        cls.second = Guideline.objects.create(name='Second', medical_speciality='Cardiology', trust=cls.trust)
+
+    def event(self, guideline, hours_ago, views):
+        return GuidelineViewEvent.objects.create(
+            guideline_id=guideline.pk, bucket=analytics.hour_bucket(self.NOW - timedelta(hours=hours_ago)), views=views,
+        )
+
+    def daily(self):
+        return {(row.day.isoformat(), row.guideline_id): row.views for row in GuidelineViewDaily.objects.all()}
+
+    def test_revalidation_is_not_a_view(self):
+        client = APIClient(HTTP_HOST='localhost')
+        with mock.patch.object(GuidelineService, 'record_view') as record_view:
+            response = client.get(f'/api/guidelines/{self.first.pk}/')
+            self.assertEqual(response.status_code, 200)
+            response = client.get(f'/api/guidelines/{self.first.pk}/', HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(response.status_code, 304)
+        record_view.assert_called_once_with(str(self.first.pk))
+
+    def test_rollup_folds_completed_hours_into_daily_rows(self):
+        GuidelineViewDaily.objects.create(day='2024-03-10', guideline_id=self.first.pk, views=100)
+        self.event(self.first, 1, 3)
+        self.event(self.first, 1, 2)  # a second worker's flush of the same hour
+        self.event(self.first, 20, 4)  # yesterday
+        self.event(self.second, 2, 7)
+        current = self.event(self.second, 0, 5)
+        stats = analytics.rollup(now=self.NOW)
+        self.assertEqual(stats, {'events': 4, 'created': 2, 'updated': 1, 'purged': 0})
+        self.assertEqual(self.daily(), {
+            ('2024-03-10', self.first.pk): 105,
+            ('2024-03-09', self.first.pk): 4,
+            ('2024-03-10', self.second.pk): 7,
+        })
+        row = GuidelineViewDaily.objects.get(day='2024-03-10', guideline_id=self.second.pk)
+        self.assertEqual((row.medical_speciality, row.trust_id), ('Cardiology', self.trust.pk))
+        # The running hour is left for the next rollup
+        self.assertEqual(list(GuidelineViewEvent.objects.values_list('id', flat=True)), [current.id])
+
+    def test_rollup_purges_old_daily_rows(self):
+        GuidelineViewDaily.objects.create(day='2024-01-01', guideline_id=self.first.pk, views=1)
+        GuidelineViewDaily.objects.create(day='2024-03-01', guideline_id=self.first.pk, views=1)
+        stats = analytics.rollup(now=self.NOW, retain_days=30)
+        self.assertEqual(stats['purged'], 1)
+        self.assertEqual(list(self.daily()), [('2024-03-01', self.first.pk)])
+
+    def test_trending_decays_older_views(self):
+        today = self.NOW.date()
+        GuidelineViewDaily.objects.create(day=today, guideline_id=self.first.pk, views=10)
+        # 30 views six days ago (two half-lives) weigh 7.5 today
+        GuidelineViewDaily.objects.create(day=today - timedelta(days=6), guideline_id=self.second.pk, views=30)
+        with mock.patch('django.utils.timezone.now', return_value=self.NOW):
+            ranked = analytics._compute_trending(None, None, 14, 10)
+            self.assertEqual([(row['id'], row['views'], row['score']) for row in ranked], [
+                (self.first.pk, 10, 10.0), (self.second.pk, 30, 7.5),
+            ])
+            # Outside the window the old views no longer count
+            self.assertEqual([row['id'] for row in analytics._compute_trending(None, None, 6, 10)], [self.first.pk])
+            self.assertEqual(analytics._compute_trending('Dermatology', None, 14, 10), [])
+
+
+class SearchIndexBuildTests(UnmanagedTablesMixin, TestCase):
+    """Incremental segments mask stale copies and deletions; --full collapses them."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.trust = Trust.objects.create(name='Trust')
+        cls.asthma = Guideline.objects.create(name='Asthma in adults', medical_speciality='Respiratory', trust=cls.trust)
+        cls.croup = Guideline.objects.create(name='Croup', medical_speciality='Respiratory', trust=cls.trust)
+        cls.sepsis = Guideline.objects.create(name='Sepsis', medical_speciality='Emergency', trust=cls.trust)
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.directory = tmp.name
+        search.build(self.directory)
+
+    def index(self):
+        return search.SearchIndex(self.directory, search.read_manifest(self.directory))
+
+    def ids(self, query):
+        return [pk for pk, _ in self.index().search(query)]
+
+    def test_updated_guideline_masks_its_old_copy(self):
+        guideline = Guideline.objects.get(pk=self.asthma.pk)
+        guideline.name = 'Bronchiolitis'
+        guideline.save()
+        stats = search.build(self.directory)
+        self.assertEqual((stats['mode'], stats['documents'], stats['segments']), ('incremental', 1, 2))
+        index = self.index()
+        self.assertEqual(self.ids('asthma'), [])
+        self.assertEqual(self.ids('bronchiolitis'), [self.asthma.pk])
+        self.assertEqual(index.doc_count, 3)
+        old = index.segments[0]
+        self.assertFalse(old.all_live)
+        # Only croup's copy of 'respiratory' in the old segment is still live
+        self.assertEqual(int(old.live_df[old.lookup('respiratory')]), 1)
+        self.assertEqual(sorted(index.live_ids().tolist()), [self.asthma.pk, self.croup.pk, self.sepsis.pk])
+
+    def test_deleted_guideline_disappears(self):
+        Guideline.objects.filter(pk=self.croup.pk).delete()
+        stats = search.build(self.directory)
+        self.assertEqual((stats['documents'], stats['deleted']), (0, 1))
+        self.assertEqual(self.ids('croup'), [])
+        self.assertEqual(self.ids('respiratory'), [self.asthma.pk])
+        self.assertEqual(self.index().doc_count, 2)
+
+    def test_full_build_collapses_segments(self):
+        Guideline.objects.filter(pk=self.sepsis.pk).delete()
+        search.build(self.directory)
+        self.assertEqual(len(search.read_manifest(self.directory)['segments']), 2)
+        with mock.patch.object(search.search_index, 'directory', self.directory), \
+                mock.patch.object(search, 'SEGMENT_GRACE_SECONDS', -60):
+            call_command('build_search_index', '--full', stdout=StringIO())
+        manifest = search.read_manifest(self.directory)
+        self.assertEqual(len(manifest['segments']), 1)
+        self.assertEqual(sorted(name for name in os.listdir(self.directory) if name != search.MANIFEST), manifest['segments'])
+        self.assertEqual(self.ids('sepsis'), [])
+        self.assertEqual(sorted(self.ids('respiratory')), [self.asthma.pk, self.croup.pk])
+
+
+class GuidelineAdminTests(UnmanagedTablesMixin, TestCase):
+    """Admin writes go through the services; bulk actions are one statement."""
+
+    changelist = '/admin/guidelines/guideline/'
+    FORM_FIELDS = (
+        'name', 'description', 'external_url', 'metadata', 'medical_speciality', 'locality', 'original_filename',
+        'authors', 'creation_date', 'review_date', 'version_number', 'last_updated_date',
+    )
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin@example.com', 'admin@example.com', 'secret')
+        cls.trust = Trust.objects.create(name='Trust')
+        cls.other = Trust.objects.create(name='Other trust')
+        cls.guidelines = [
+            Guideline.objects.create(name=name, medical_speciality='Respiratory', trust=trust)
+            for name, trust in [('Asthma', cls.trust), ('Croup', cls.trust), ('Sepsis', cls.other)]
+        ]
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def form_data(self, guideline, **changed_fields):
+        data = {name: getattr(guideline, name) or '' for name in self.FORM_FIELDS}
+        data['trust'] = guideline.trust_id
+        data.update(changed_fields)
+        return data
+
+    def history(self, history_type):
+        return sorted(
+            (row.guideline_id, row.changes, row.history_user_id)
+            for row in GuidelineHistory.objects.filter(history_type=history_type)
+        )
+
+    def statements(self, queries, verb):
+        return [q['sql'] for q in queries if q['sql'].startswith(f'{verb} ') and '"tableapp_trustguideline"' in q['sql']]
+
+    def action(self, action, **data):
+        with self.captureOnCommitCallbacks(execute=True), CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.changelist, {
+                'action': action, '_selected_action': [g.pk for g in self.guidelines], **data,
+            })
+        self.assertEqual(response.status_code, 302)
+        return queries
+
+    def test_change_form_updates_only_changed_fields(self):
+        guideline = self.guidelines[0]
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                f'{self.changelist}{guideline.pk}/change/', self.form_data(guideline, locality='North'),
+            )
+        self.assertEqual(response.status_code, 302)
+        saved = Guideline.objects.get(pk=guideline.pk)
+        self.assertEqual((saved.locality, saved.row_version), ('North', 2))
+        self.assertEqual(self.history(GuidelineHistory.CHANGED), [(guideline.pk, {'locality': [None, 'North']}, self.admin.pk)])
+
+    def test_add_form_creates_through_the_service(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(f'{self.changelist}add/', {
+                **{name: '' for name in self.FORM_FIELDS}, 'name': 'Bronchiolitis', 'trust': self.trust.pk,
+            })
+        self.assertEqual(response.status_code, 302)
+        created = Guideline.objects.get(name='Bronchiolitis')
+        self.assertEqual([row[0] for row in self.history(GuidelineHistory.CREATED)], [created.pk])
+        self.assertTrue(GuidelineChange.objects.filter(object_id=created.pk, action='create').exists())
+
+    def test_reassign_trust_is_one_update(self):
+        queries = self.action('reassign_trust', trust=self.other.pk)
+        self.assertEqual(len(self.statements(queries, 'UPDATE')), 1)
+        self.assertEqual(set(Guideline.objects.values_list('trust_id', flat=True)), {self.other.pk})
+        # The guideline already on that trust is left alone
+        self.assertEqual(self.history(GuidelineHistory.CHANGED), [
+            (guideline.pk, {'trust_id': [self.trust.pk, self.other.pk]}, self.admin.pk)
+            for guideline in self.guidelines[:2]
+        ])
+
+    def test_reassign_trust_needs_a_trust(self):
+        queries = self.action('reassign_trust')
+        self.assertEqual(self.statements(queries, 'UPDATE'), [])
+        self.assertEqual(Guideline.objects.filter(trust=self.trust).count(), 2)
+
+    def test_set_medical_speciality_is_one_update(self):
+        queries = self.action('set_medical_speciality', medical_speciality=' Paediatrics ')
+        self.assertEqual(len(self.statements(queries, 'UPDATE')), 1)
+        self.assertEqual(set(Guideline.objects.values_list('medical_speciality', flat=True)), {'Paediatrics'})
+        self.assertEqual(len(self.history(GuidelineHistory.CHANGED)), 3)
+
+    def test_delete_selected_is_one_delete(self):
+        queries = self.action('delete_selected', post='yes')
+        self.assertEqual(len(self.statements(queries, 'DELETE')), 1)
+        self.assertFalse(Guideline.objects.exists())
+        self.assertEqual(self.history(GuidelineHistory.DELETED), sorted((g.pk, {}, self.admin.pk) for g in self.guidelines))
+
+    def test_large_unfiltered_changelist_uses_the_estimate(self):
+        estimate = pagination.EXACT_COUNT_THRESHOLD * 5
+        with mock.patch.object(pagination, 'estimated_count', return_value=estimate) as estimated_count:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(self.changelist)
+            self.assertEqual(response.context['cl'].paginator.count, estimate)
+            self.assertFalse([q for q in queries if 'COUNT(' in q['sql'] and '"tableapp_trustguideline"' in q['sql']])
+            estimated_count.assert_called_once()
+            response = self.client.get(self.changelist, {'trust__id__exact': self.trust.pk})
+            self.assertEqual(response.context['cl'].paginator.count, 2)
+            estimated_count.assert_called_once()
+
+    def test_estimated_count_reads_sqlite_stats(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('sqlite_stat1 is SQLite-specific')
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        self.assertEqual(pagination.estimated_count(Guideline), 3)
+        # Below the threshold the exact count is used
+        self.assertEqual(pagination.EstimatedCountPaginator(Guideline.objects.order_by('pk'), 50).count, 3)
+
+
+class GuidelineBatchAPITests(UnmanagedTablesMixin, TestCase):
+    """POST /api/guidelines/batch/ in atomic and partial modes."""
+
+    url = '/api/guidelines/batch/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('editor@example.com', 'editor@example.com', 'secret')
+        cls.trust = Trust.objects.create(name='Trust')
+        cls.asthma = Guideline.objects.create(name='Asthma', trust=cls.trust)
+        cls.croup = Guideline.objects.create(name='Croup', trust=cls.trust)
+
+    def setUp(self):
+        self.client = APIClient(HTTP_HOST='localhost')
+        self.client.force_authenticate(self.user)
+
+    def post(self, operations, mode=None):
+        body = {'operations': operations}
+        if mode is not None:
+            body['mode'] = mode
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(self.url, body, format='json')
+
+    def statuses(self, response):
+        return [result['status'] for result in response.json()['results']]
+
+    def test_atomic_failure_applies_nothing(self):
+        response = self.post([
+            {'op': 'create', 'data': {'name': 'Sepsis', 'trust': self.trust.pk}},
+            {'op': 'update', 'id': self.asthma.pk, 'data': {'name': 'Asthma in adults'}},
+            {'op': 'delete', 'id': 999},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.statuses(response), ['skipped', 'skipped', 'error'])
+        self.assertEqual(response.json()['results'][2]['errors'], {'id': ['Guideline not found.']})
+        self.assertEqual(sorted(Guideline.objects.values_list('name', flat=True)), ['Asthma', 'Croup'])
+        self.assertFalse(GuidelineChange.objects.exists())
+
+    def test_partial_mode_reports_each_operation(self):
+        response = self.post([
+            {'op': 'create', 'data': {'name': 'Sepsis', 'trust': self.trust.pk}},
+            {'op': 'update', 'id': self.asthma.pk, 'data': {'name': 'Asthma in adults'}},
+            {'op': 'delete', 'id': self.croup.pk},
+            {'op': 'rename'},
+        ], mode='partial')
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(self.statuses(response), ['created', 'updated', 'deleted', 'error'])
+        self.assertEqual([result['index'] for result in response.json()['results']], [0, 1, 2, 3])
+        self.assertEqual(sorted(Guideline.objects.values_list('name', flat=True)), ['Asthma in adults', 'Sepsis'])
+
+    def test_all_valid_is_200(self):
+        response = self.post([{'op': 'update', 'id': self.asthma.pk, 'data': {'locality': 'North'}}], mode='partial')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.statuses(response), ['updated'])
+
+    def test_duplicate_id_is_rejected(self):
+        response = self.post([
+            {'op': 'update', 'id': self.asthma.pk, 'data': {'name': 'First'}},
+            {'op': 'delete', 'id': self.asthma.pk},
+        ], mode='partial')
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(self.statuses(response), ['updated', 'error'])
+        self.assertEqual(
+            response.json()['results'][1]['errors'],
+            {'id': [f'Guideline {self.asthma.pk} already appears at index 0.']},
+        )
+        self.assertTrue(Guideline.objects.filter(pk=self.asthma.pk, name='First').exists())
+
+    def test_unknown_trust_is_rejected(self):
+        response = self.post([
+            {'op': 'create', 'data': {'name': 'Sepsis', 'trust': 999}},
+            {'op': 'update', 'id': self.asthma.pk, 'data': {'trust': 999}},
+        ], mode='partial')
+        self.assertEqual(response.status_code, 207)
+        for result in response.json()['results']:
+            self.assertEqual(result['errors'], {'trust': ['Trust not found.']})
+        self.assertEqual(Guideline.objects.get(pk=self.asthma.pk).trust_id, self.trust.pk)
+        self.assertFalse(Guideline.objects.filter(name='Sepsis').exists())
+
+    def test_invalid_requests_are_400(self):
+        self.assertEqual(self.post([{'op': 'delete', 'id': self.asthma.pk}], mode='eventual').status_code, 400)
+        self.assertEqual(self.post([]).status_code, 400)
+        self.assertTrue(Guideline.objects.filter(pk=self.asthma.pk).exists())
+
+    def test_bulk_update_bumps_row_version(self):
+        response = self.post([
+            {'op': 'update', 'id': self.asthma.pk, 'data': {'locality': 'North'}},
+            {'op': 'update', 'id': self.croup.pk, 'data': {'name': 'Croup'}},  # unchanged
+        ])
+        self.assertEqual(self.statuses(response), ['updated', 'unchanged'])
+        versions = dict(Guideline.objects.values_list('pk', 'row_version'))
+        self.assertEqual(versions, {self.asthma.pk: 2, self.croup.pk: 1})
+        self.assertEqual(
+            list(GuidelineChange.objects.values_list('object_id', 'action')), [(self.asthma.pk, 'update')],
+        )
+
+
+class SparseFieldsTests(UnmanagedTablesMixin, TestCase):
+    """?fields= limits the output and the selected columns; ?expand= nests the trust."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.trust = Trust.objects.create(name='Trust')
+        cls.guideline = Guideline.objects.create(name='Asthma', description='Long text', trust=cls.trust)
+
+    def setUp(self):
+        self.client = APIClient(HTTP_HOST='localhost')
+        # Write buffered views while the test database still exists
+        self.addCleanup(analytics.view_recorder.flush)
+
+    def list(self, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/guidelines/', params)
+        selects = [q['sql'] for q in queries if '"tableapp_trustguideline"' in q['sql'] and q['sql'].startswith('SELECT')]
+        return response, selects
+
+    def test_only_selected_fields_are_returned_and_queried(self):
+        response, selects = self.list(fields='name,trust')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), [{'id': self.guideline.pk, 'name': 'Asthma', 'trust': self.trust.pk}])
+        self.assertEqual(len(selects), 1)
+        self.assertNotIn('"description"', selects[0])
+        self.assertNotIn('JOIN', selects[0])
+
+    def test_expand_nests_the_trust_with_a_join(self):
+        response, selects = self.list(fields='name,trust', expand='trust')
+        self.assertEqual(response.json()[0]['trust'], {'id': self.trust.pk, 'name': 'Trust'})
+        self.assertIn('JOIN "tableapp_trust"', selects[0])
+        self.assertNotIn('"description"', selects[0])
+
+    def test_without_fields_the_full_payload_is_unchanged(self):
+        response, _ = self.list()
+        self.assertEqual(response.json()[0]['trust'], {'id': self.trust.pk, 'name': 'Trust'})
+        self.assertEqual(response.json()[0]['description'], 'Long text')
+
+    def test_unknown_names_are_400(self):
+        self.assertEqual(self.list(fields='name,password')[0].status_code, 400)
+        self.assertEqual(self.list(expand='author')[0].status_code, 400)
+        self.assertEqual(self.client.get(f'/api/guidelines/{self.guideline.pk}/', {'fields': 'nope'}).status_code, 400)
+
+    def test_retrieve_cuts_the_cached_payload(self):
+        response = self.client.get(f'/api/guidelines/{self.guideline.pk}/', {'fields': 'name'})
+        self.assertEqual(response.json(), {'id': self.guideline.pk, 'name': 'Asthma'})
+
+
+class GuidelineHistoryTests(UnmanagedTablesMixin, TestCase):
+    """History rows are written on commit and rebuild past states."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.trust = Trust.objects.create(name='Trust')
+
+    def write(self, func, *args):
+        with self.captureOnCommitCallbacks(execute=True):
+            result = func(*args)
+        moment = timezone.now()
+        return result, moment
+
+    def types(self, pk):
+        return [row.history_type for row in GuidelineHistory.objects.filter(guideline_id=pk).order_by('history_date', 'id')]
+
+    def test_rollback_writes_no_history(self):
+        guideline = Guideline.objects.create(name='Asthma', trust=self.trust)
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(DatabaseError), transaction.atomic():
+                GuidelineService.update_guideline(guideline, {'name': 'Lost'})
+                raise DatabaseError
+        self.assertFalse(GuidelineHistory.objects.exists())
+
+    def test_rolled_back_savepoint_drops_only_its_rows(self):
+        kept = Guideline.objects.create(name='Asthma', trust=self.trust)
+        lost = Guideline.objects.create(name='Croup', trust=self.trust)
+        with self.captureOnCommitCallbacks(execute=True), transaction.atomic():
+            GuidelineService.update_guideline(kept, {'name': 'Asthma in adults'})
+            try:
+                with transaction.atomic():
+                    history.record_changed(lost, {'name': ['Croup', 'Lost']})
+                    raise DatabaseError
+            except DatabaseError:
+                pass
+            history.record_changed(kept, {'locality': [None, 'North']})
+        self.assertEqual(
+            list(GuidelineHistory.objects.order_by('id').values_list('guideline_id', 'changes')),
+            [(kept.pk, {'name': ['Asthma', 'Asthma in adults']}), (kept.pk, {'locality': [None, 'North']})],
+        )
+
+    def test_as_of_across_create_update_delete(self):
+        before = timezone.now()
+        guideline, created = self.write(GuidelineService.create_guideline, {'name': 'Asthma', 'trust': self.trust}, None)
+        _, renamed = self.write(GuidelineService.update_guideline, guideline, {'name': 'Asthma in adults'})
+        _, moved = self.write(GuidelineService.update_guideline, guideline, {'locality': 'North'})
+        pk = guideline.pk
+        _, deleted = self.write(GuidelineService.delete_guideline, guideline)
+        self.assertEqual(self.types(pk), ['+', '~', '~', '-'])
+        self.assertIsNone(history.guideline_as_of(pk, before))
+        self.assertEqual(history.guideline_as_of(pk, created)['name'], 'Asthma')
+        state = history.guideline_as_of(pk, renamed)
+        self.assertEqual((state['name'], state['locality']), ('Asthma in adults', None))
+        state = history.guideline_as_of(pk, moved)
+        self.assertEqual((state['name'], state['locality'], state['trust_id']), ('Asthma in adults', 'North', self.trust.pk))
+        self.assertIsNone(history.guideline_as_of(pk, deleted))
+
+    def test_as_of_walks_back_guidelines_without_a_snapshot(self):
+        guideline = Guideline.objects.create(name='Asthma', trust=self.trust)  # predates history
+        before = timezone.now()
+        self.write(GuidelineService.update_guideline, guideline, {'name': 'Asthma in adults'})
+        self.assertEqual(history.guideline_as_of(guideline.pk, before)['name'], 'Asthma')
+        self.assertEqual(history.guideline_as_of(guideline.pk, timezone.now())['name'], 'Asthma in adults')
+
+    def test_compaction_keeps_as_of_results(self):
+        guideline, _ = self.write(GuidelineService.create_guideline, {'name': 'Asthma', 'trust': self.trust}, None)
+        self.write(GuidelineService.update_guideline, guideline, {'name': 'Asthma in adults'})
+        _, moved = self.write(GuidelineService.update_guideline, guideline, {'locality': 'North'})
+        _, described = self.write(GuidelineService.update_guideline, guideline, {'description': 'Acute care'})
+        expected = {moment: history.guideline_as_of(guideline.pk, moment) for moment in (moved, described)}
+        self.assertEqual(history.compact(guideline.pk, moved), 2)
+        self.assertEqual(self.types(guideline.pk), ['=', '~'])
+        for moment, state in expected.items():
+            self.assertEqual(history.guideline_as_of(guideline.pk, moment), state)
+
+    def test_compacting_diffs_merges_them(self):
+        guideline = Guideline.objects.create(name='Asthma', trust=self.trust)
+        self.write(GuidelineService.update_guideline, guideline, {'name': 'Asthma in adults'})
+        self.write(GuidelineService.update_guideline, guideline, {'name': 'Asthma', 'locality': 'North'})
+        _, end = self.write(lambda: None)
+        self.assertEqual(history.compact(guideline.pk, end), 1)
+        row = GuidelineHistory.objects.get(guideline_id=guideline.pk)
+        self.assertEqual((row.history_type, row.changes), ('~', {'locality': [None, 'North']}))
+        self.assertEqual(history.guideline_as_of(guideline.pk, end)['locality'], 'North')
+
+    def test_diff(self):
+        self.assertEqual(history.diff({'name': 'a', 'locality': None}, {'name': 'b', 'locality': None}), {'name': ['a', 'b']})
+
+
+class ServerTimingTests(UnmanagedTablesMixin, TestCase):
+    """Responses carry the request's phases in Server-Timing."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('reader@example.com', 'reader@example.com', 'secret')
+        cls.guideline = Guideline.objects.create(name='Asthma', trust=Trust.objects.create(name='Trust'))
 
-# Create your tests here.
+    def test_guideline_detail_reports_phases(self):
+        self.addCleanup(analytics.view_recorder.flush)
+        client = APIClient(HTTP_HOST='localhost')
+        client.cookies['access_token'] = str(AccessToken.for_user(self.user))
+        response = client.get(f'/api/guidelines/{self.guideline.pk}/')
+        self.assertEqual(response.status_code, 200)
+        entries = dict(entry.split(';', 1) for entry in response['Server-Timing'].split(', '))
+        for name in ('auth', 'db', 'render', 'total'):
+            self.assertIn(name, entries)
+            self.assertRegex(entries[name], r'^dur=\d+\.\d')
+        self.assertIn('calls', entries['db'])
@@ -1,8 +1,9 @@
 # apps/guidelines/urls.py
 from rest_framework.routers import DefaultRouter
-from .views import GuidelineViewSet
+from .views import GuidelineViewSet, TrustViewSet
 
 router = DefaultRouter()
 router.register(r'guidelines', GuidelineViewSet, basename='guideline')
+router.register(r'trusts', TrustViewSet, basename='trust')
 
 urlpatterns = router.urls
\ No newline at end of file
@@ -0,0 +1,82 @@
+"""
+apps/guidelines/utils.py
+
+Helpers for guideline documents stored in S3.
+"""
+import os
+import re
+from urllib.parse import unquote, urlsplit
+
+from django.conf import settings
+
+from apps.core import signing
+
+_UNSAFE_CHARS = re.compile(r'[^A-Za-z0-9._-]+')
+MAX_FILENAME_LENGTH = 200
+
+
+def sanitize_filename(name):
+    """Return a safe S3/file-system file name derived from an uploaded file name."""
+    base, ext = os.path.splitext(os.path.basename(name or ''))
+    base = _UNSAFE_CHARS.sub('_', base).strip('._') or 'document'
+    ext = _UNSAFE_CHARS.sub('', ext.lstrip('.')).lower()
+    base = base[:MAX_FILENAME_LENGTH - len(ext) - 1]
+    return f'{base}.{ext}' if ext else base
+
+
+def _storage_hosts():
+    hosts = {
+        getattr(settings, 'AWS_S3_CUSTOM_DOMAIN', None),
+        f"{settings.AWS_STORAGE_BUCKET_NAME}.s3.amazonaws.com",
+        f"{settings.AWS_STORAGE_BUCKET_NAME}.s3.{settings.AWS_S3_REGION_NAME}.amazonaws.com",
+    }
+    endpoint = getattr(settings, 'AWS_S3_ENDPOINT_URL', None)
+    if endpoint:
+        hosts.add(urlsplit(endpoint).netloc)
+    return {host for host in hosts if host}
+
+
+def get_s3_key(url):
+    """
+    Return the storage key of a URL produced by ``default_storage.url()``.
+
+    Returns None for URLs that don't point into our bucket (external
+    guideline links), so callers never touch objects they didn't store.
+    """
+    if not url:
+        return None
+    parts = urlsplit(url)
+    if not parts.netloc:
+        # Relative URL from a storage without a domain (e.g. local media)
+        path = parts.path
+    elif parts.netloc in _storage_hosts():
+        path = parts.path
+        endpoint = getattr(settings, 'AWS_S3_ENDPOINT_URL', None)
+        bucket_prefix = f'/{settings.AWS_STORAGE_BUCKET_NAME}/'
+        if endpoint and parts.netloc == urlsplit(endpoint).netloc and path.startswith(bucket_prefix):
+            # Path-style URL on an S3-compatible endpoint
+            path = path[len(bucket_prefix) - 1:]
+    else:
+        return None
+    media_url = getattr(settings, 'MEDIA_URL', '') or ''
+    if not parts.netloc and media_url.startswith('/') and path.startswith(media_url):
+        path = path[len(media_url):]
+    key = unquote(path).lstrip('/')
+    if not key or '..' in key.split('/'):
+        return None
+    return key
+
+
+def sign_document_url(url):
+    """
+    Return the signed form of ``url`` when document URL signing is enabled.
+
+    Only URLs into our bucket are signed; external links and all URLs when
+    ``DOCUMENT_URL_SIGNING`` is off are returned unchanged.
+    """
+    if not url or signing.signing_mode() is None:
+        return url
+    key = get_s3_key(url)
+    if key is None:
+        return url
+    return signing.signed_url(key)
@@ -4,12 +4,24 @@ apps/guidelines/views.py
 ViewSet and router for Guideline endpoints.
 Delegates all ORM operations to services for testability.
 """
+import logging
+
+from django.http import Http404
 from rest_framework import viewsets, permissions, status
 from rest_framework.response import Response
 from rest_framework.decorators import action
 from .models import Guideline
-from .serializers import GuidelineSerializer, GuidelineMinimalSerializer
-from .services import GuidelineService
+from .serializers import GuidelineSerializer, GuidelineMinimalSerializer, GuidelineHistorySerializer, TrustSerializer
+from .services import (
+    BATCH_MAX_OPERATIONS, CHANGES_DEFAULT_LIMIT, CHANGES_MAX_LIMIT, SEARCH_DEFAULT_LIMIT, SEARCH_MAX_LIMIT,
+    SUGGEST_DEFAULT_LIMIT, SUGGEST_MAX_LIMIT,
+    GuidelineService, TrustService,
+)
+from . import analytics, changes, documents, history
+from apps.core import conditional, timing
+from apps.core.log import redact_headers
+
+logger = logging.getLogger(__name__)
 
 class GuidelineViewSet(viewsets.ModelViewSet):
     """CRUD endpoints for guidelines."""
@@ -19,27 +31,224 @@ class GuidelineViewSet(viewsets.ModelViewSet):
         return GuidelineService.list_guidelines()
 
     def get_permissions(self):
-        if self.action in ['list', 'retrieve', 'minimal']:
+        if self.action in ['list', 'retrieve', 'minimal', 'change_feed', 'search', 'suggest', 'trending']:
             return []  # Allow unauthenticated access for read-only
         return [permissions.IsAuthenticated()]
 
+    def get_sparse_fields(self):
+        """``(fields, expand)`` from ``?fields=`` / ``?expand=``; 400 on unknown names."""
+        return GuidelineService.parse_sparse_fields(
+            self.request.query_params.get('fields'), self.request.query_params.get('expand')
+        )
+
+    def list(self, request, *args, **kwargs):
+        fields, expand = self.get_sparse_fields()
+        filters, ordering = GuidelineService.parse_filters(request.query_params)
+        # Read before the list, so changes made meanwhile are replayed by the feed
+        cursor = changes.latest()
+        queryset = GuidelineService.list_guidelines(fields, expand, filters, ordering)
+        serializer = self.get_serializer(queryset, many=True, fields=fields, expand=expand)
+        with timing.phase('serialization'):
+            data = serializer.data
+        return Response(data, headers={changes.CURSOR_HEADER: str(cursor)})
+
     def retrieve(self, request, *args, **kwargs):
-        guideline = GuidelineService.get_guideline(kwargs['pk'])
-        serializer = self.get_serializer(guideline)
-        return Response(serializer.data)
+        pk = kwargs['pk']
+        fields, expand = self.get_sparse_fields()
+        validators = GuidelineService.get_guideline_validators(pk) if pk.isdigit() else None
+        if validators is None:
+            raise Http404
+        response = conditional.not_modified(request, *validators)
+        if response is None:
+            # Revalidations (304) aren't new views, as for ranged document requests
+            GuidelineService.record_view(pk)
+            with timing.phase('serialization'):
+                data = GuidelineService.get_guideline_detail(pk, fields, expand, validators)
+            response = Response(data)
+        return conditional.set_validators(response, *validators)
 
     @action(detail=False, methods=['get'], url_path='minimal', permission_classes=[])
     def minimal(self, request):
         """
         Returns a minimal list of guidelines using the GuidelineMinimalSerializer.
         """
-        print(f"[GUIDELINE_VIEW - MINIMAL] Request headers: {request.headers}")
-        print(f"[GUIDELINE_VIEW - MINIMAL] Request GET params: {request.GET}")
-        print(f"[GUIDELINE_VIEW - MINIMAL] Request POST data: {request.POST}")
-        queryset = self.get_queryset()
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "Minimal guideline list requested",
+                extra={'headers': redact_headers(request.headers), 'query': request.GET.dict()},
+            )
+        filters, ordering = GuidelineService.parse_filters(request.query_params)
+        cursor = changes.latest()
+        queryset = GuidelineService.list_guidelines(
+            fields=GuidelineMinimalSerializer.Meta.fields, filters=filters, ordering=ordering
+        )
         serializer = GuidelineMinimalSerializer(queryset, many=True)
-        return Response(serializer.data)
+        with timing.phase('serialization'):
+            data = serializer.data
+        return Response(data, headers={changes.CURSOR_HEADER: str(cursor)})
+
+    @action(detail=False, methods=['get'], url_path='changes')
+    def change_feed(self, request):
+        """
+        Sync feed: what changed after cursor ``?since=<seq>``, ``?limit=`` per page.
+
+        Start from the ``X-Changes-Cursor`` header of the (minimal) list,
+        then apply each page and send its ``next`` until ``has_more`` is
+        false. Entries are ``{seq, type, id, action, data}``; treat
+        ``create`` and ``update`` alike as upserts of ``data`` (a superseded
+        create may have been compacted away), and ``delete`` as a tombstone.
+        A cursor older than the retained feed gets 410: reload the list.
+        """
+        try:
+            since = int(request.query_params['since'])
+            limit = min(max(int(request.query_params.get('limit', CHANGES_DEFAULT_LIMIT)), 1), CHANGES_MAX_LIMIT)
+        except KeyError:
+            return Response({'since': ['This parameter is required.']}, status=status.HTTP_400_BAD_REQUEST)
+        except ValueError:
+            return Response({'detail': 'since and limit must be integers.'}, status=status.HTTP_400_BAD_REQUEST)
+        if since < 0:
+            return Response({'since': ['Expected a cursor of 0 or more.']}, status=status.HTTP_400_BAD_REQUEST)
+        with timing.phase('changes'):
+            data = GuidelineService.get_changes(since, limit)
+        if data is None:
+            return Response(
+                {'detail': 'The cursor has expired; reload the guideline list and resume from its X-Changes-Cursor.'},
+                status=status.HTTP_410_GONE,
+            )
+        return Response(data)
+
+    @action(detail=False, methods=['get'], url_path='search')
+    def search(self, request):
+        """
+        Full-text search: ``?q=<words>&limit=<n>``, ranked by BM25.
+
+        Each result is the full guideline plus its ``score``. Covers the
+        guideline's text fields (and document text, when the index was built
+        with ``--with-documents``) as of the last ``build_search_index`` run.
+        """
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({'q': ['This parameter is required.']}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = min(max(int(request.query_params.get('limit', SEARCH_DEFAULT_LIMIT)), 1), SEARCH_MAX_LIMIT)
+        except ValueError:
+            return Response({'limit': ['Expected an integer.']}, status=status.HTTP_400_BAD_REQUEST)
+        with timing.phase('search'):
+            hits = GuidelineService.search_guidelines(query, limit)
+        if hits is None:
+            return Response({'detail': 'The search index has not been built.'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        with timing.phase('serialization'):
+            data = [{**GuidelineSerializer(guideline).data, 'score': round(score, 4)} for guideline, score in hits]
+        return Response(data)
+
+    @action(detail=False, methods=['get'], url_path='suggest')
+    def suggest(self, request):
+        """
+        Typeahead suggestions: ``?prefix=<text>&limit=<n>``.
+
+        Matches names starting with the text (any length) or containing it
+        (three characters or more), case- and accent-insensitively; most
+        viewed first.
+        """
+        prefix = request.query_params.get('prefix', '')
+        try:
+            limit = min(max(int(request.query_params.get('limit', SUGGEST_DEFAULT_LIMIT)), 1), SUGGEST_MAX_LIMIT)
+        except ValueError:
+            return Response({'limit': ['Expected an integer.']}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(GuidelineService.suggest_guidelines(prefix, limit))
+
+    @action(detail=False, methods=['get'], url_path='trending')
+    def trending(self, request):
+        """
+        Most viewed guidelines lately: ``?medical_speciality=``, ``?trust=``,
+        ``?days=`` (default 14) and ``?limit=`` (default 10).
 
+        Views are weighted by age with a 3-day half-life; computed from the
+        daily rollups and cached for a few minutes.
+        """
+        params = request.query_params
+        try:
+            trust = int(params['trust']) if params.get('trust') else None
+            days = min(max(int(params.get('days', analytics.TRENDING_DEFAULT_DAYS)), 1), analytics.TRENDING_MAX_DAYS)
+            limit = min(max(int(params.get('limit', 10)), 1), 50)
+        except ValueError:
+            return Response({'detail': 'trust, days and limit must be integers.'}, status=status.HTTP_400_BAD_REQUEST)
+        data = GuidelineService.get_trending(params.get('medical_speciality') or None, trust, days, limit)
+        return Response(data)
+
+    @action(detail=True, methods=['get'], url_path='history')
+    def history(self, request, pk=None):
+        """
+        Change history of a guideline, newest first.
+
+        With ``?as_of=<ISO date or datetime>`` returns the guideline's fields
+        as they were at that moment instead.
+        """
+        if not pk.isdigit():
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        as_of = request.query_params.get('as_of')
+        if as_of:
+            try:
+                when = history.parse_as_of(as_of)
+            except ValueError:
+                return Response({'as_of': 'Expected an ISO 8601 date or datetime.'}, status=status.HTTP_400_BAD_REQUEST)
+            state = history.guideline_as_of(pk, when)
+            if state is None:
+                return Response(status=status.HTTP_404_NOT_FOUND)
+            return Response({'id': int(pk), 'as_of': when, **state})
+        rows = GuidelineService.get_guideline_history(pk)
+        return Response(GuidelineHistorySerializer(rows, many=True).data)
+
+    @action(detail=True, methods=['get'], url_path='document')
+    def document(self, request, pk=None):
+        """
+        Stream the guideline's document (PDF) to authenticated users.
+
+        Served from a local disk cache in front of S3; supports Range
+        requests so viewers can load pages incrementally.
+        """
+        if not pk.isdigit():
+            raise Http404
+        key, filename = GuidelineService.get_document(pk)
+        try:
+            response = documents.document_response(request, key, filename)
+        except FileNotFoundError:
+            raise Http404
+        if response.status_code == status.HTTP_200_OK:
+            # Range requests for later parts of the same document aren't new views
+            GuidelineService.record_view(pk)
+        return response
+
+    @action(detail=False, methods=['post'], url_path='batch')
+    def batch(self, request):
+        """
+        Apply many create/update/delete operations in one request.
+
+        Body: ``{"operations": [...], "mode": "atomic" | "partial"}`` (see
+        GuidelineService.apply_batch). In ``atomic`` mode (the default) any
+        invalid operation rejects the whole batch with 400; in ``partial``
+        mode the valid operations are applied and the response is 207 if
+        some failed. The body lists a result per operation.
+        """
+        operations = request.data.get('operations') if isinstance(request.data, dict) else None
+        mode = request.data.get('mode', 'atomic') if isinstance(request.data, dict) else None
+        if not isinstance(operations, list) or not operations:
+            return Response({'operations': ['Expected a non-empty list.']}, status=status.HTTP_400_BAD_REQUEST)
+        if len(operations) > BATCH_MAX_OPERATIONS:
+            return Response(
+                {'operations': [f'At most {BATCH_MAX_OPERATIONS} operations per batch.']},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if mode not in ('atomic', 'partial'):
+            return Response({'mode': ['Expected "atomic" or "partial".']}, status=status.HTTP_400_BAD_REQUEST)
+        ok, results = GuidelineService.apply_batch(operations, request.user, atomic=mode == 'atomic')
+        if ok:
+            response_status = status.HTTP_200_OK
+        elif mode == 'atomic':
+            response_status = status.HTTP_400_BAD_REQUEST
+        else:
+            response_status = status.HTTP_207_MULTI_STATUS
+        return Response({'mode': mode, 'results': results}, status=response_status)
 
     def create(self, request, *args, **kwargs):
         self.check_permissions(request)
@@ -61,4 +270,23 @@ class GuidelineViewSet(viewsets.ModelViewSet):
         self.check_permissions(request)
         guideline = GuidelineService.get_guideline(kwargs['pk'])
         GuidelineService.delete_guideline(guideline)
-        return Response(status=status.HTTP_204_NO_CONTENT)
\ No newline at end of file
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class TrustViewSet(viewsets.ReadOnlyModelViewSet):
+    """Read-only trust endpoints; retrieve supports conditional GET."""
+    serializer_class = TrustSerializer
+    permission_classes = []
+
+    def get_queryset(self):
+        return TrustService.list_trusts()
+
+    def retrieve(self, request, *args, **kwargs):
+        pk = kwargs['pk']
+        validators = TrustService.get_trust_validators(pk) if pk.isdigit() else None
+        if validators is None:
+            raise Http404
+        response = conditional.not_modified(request, *validators)
+        if response is None:
+            response = Response(self.get_serializer(TrustService.get_trust(pk)).data)
+        return conditional.set_validators(response, *validators)
@@ -0,0 +1,434 @@
+"""
+apps/guidelines/whitespace.py
+
+Consumer for the Whitespace change queue (``manage.py consume_whitespace``).
+
+Messages are JSON objects:
+
+    {"type": "trust.upserted", "name": "<trust name>"}
+    {"type": "guideline.upserted", "id": 42, "data": {...}}   # update
+    {"type": "guideline.upserted", "data": {...}}             # create
+    {"type": "guideline.upserted", "id": 42, "href": "/guidelines/42"}
+    {"type": "guideline.deleted", "id": 42}
+
+``data`` holds guideline fields as accepted by the API, except that
+``trust`` is the trust's name; unknown trusts are created. With ``href``
+instead of ``data`` the payload is fetched from ``WHITESPACE_API_BASE_URL``.
+
+Each batch is received with prefetch, decoded (and fetched) concurrently on
+a bounded thread pool, then applied in one transaction: trusts with one
+INSERT .. ON CONFLICT DO NOTHING, guidelines through
+GuidelineService.apply_batch (bulk create/update/delete, history rows and
+one change signal). Messages are settled only after the commit: applied
+ones are completed, invalid ones dead-lettered; messages whose fetch failed,
+or the whole batch if the transaction fails, are abandoned for redelivery
+and the consumer backs off. Several
+updates of one guideline in a batch are merged, so redelivered or repeated
+messages are harmless; an update that follows the guideline's delete in the
+same batch is dead-lettered.
+
+The consumer holds at most one batch (plus the broker's prefetch) at a time
+and only receives again once the previous batch is settled; together with
+the exponential backoff after failures this is its backpressure.
+``stop()`` (SIGTERM/SIGINT in the command) lets the current batch finish and
+settle before the receiver is closed.
+"""
+import json
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from itertools import count
+from urllib.parse import urljoin
+
+from django.conf import settings
+from django.db import transaction
+
+from apps.core import metrics
+
+from . import changes
+from .models import GuidelineChange, Trust
+from .services import GuidelineService
+
+logger = logging.getLogger(__name__)
+
+FETCH_TIMEOUT = 10
+MAX_BACKOFF = 60
+REPORT_INTERVAL = 60
+
+
+class InvalidMessage(Exception):
+    """The message can never be applied; it is dead-lettered."""
+
+
+# -- Queues -------------------------------------------------------------------
+
+class MessageQueue:
+    """
+    Interface the consumer needs from a queue.
+
+    ``receive`` returns received messages, each with a ``body`` (bytes or
+    str); they stay locked until settled with ``complete``, ``abandon``
+    (redeliver) or ``dead_letter``.
+    """
+
+    def receive(self, max_messages, max_wait):
+        raise NotImplementedError
+
+    def complete(self, message):
+        raise NotImplementedError
+
+    def abandon(self, message):
+        raise NotImplementedError
+
+    def dead_letter(self, message, reason, description=''):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class ServiceBusQueue(MessageQueue):
+    """Azure Service Bus queue, using ``PEEK_LOCK`` and client-side prefetch."""
+
+    def __init__(self, connection_string=None, queue_name=None, prefetch=0):
+        # Imported here so the web process never loads the Service Bus SDK
+        from azure.servicebus import ServiceBusClient
+
+        self.client = ServiceBusClient.from_connection_string(
+            connection_string or settings.AZURE_SERVICE_BUS_CONNECTION_STRING
+        )
+        self.receiver = self.client.get_queue_receiver(
+            queue_name or settings.WHITESPACE_QUEUE_NAME, prefetch_count=prefetch
+        )
+
+    def receive(self, max_messages, max_wait):
+        return self.receiver.receive_messages(max_message_count=max_messages, max_wait_time=max_wait)
+
+    def complete(self, message):
+        self.receiver.complete_message(message)
+
+    def abandon(self, message):
+        self.receiver.abandon_message(message)
+
+    def dead_letter(self, message, reason, description=''):
+        self.receiver.dead_letter_message(message, reason=reason, error_description=description[:4096])
+
+    def close(self):
+        self.receiver.close()
+        self.client.close()
+
+
+@dataclass
+class InMemoryMessage:
+    body: str
+    sequence_number: int
+    delivery_count: int = 0
+
+
+class InMemoryQueue(MessageQueue):
+    """
+    In-process stand-in for tests and local runs.
+
+    Abandoned messages go back to the end of the queue and are dead-lettered
+    after ``max_delivery_count`` deliveries, like Service Bus.
+    """
+
+    def __init__(self, bodies=(), max_delivery_count=10, prefetch=0):
+        # ``prefetch`` is accepted for parity with ServiceBusQueue and unused
+        self.max_delivery_count = max_delivery_count
+        self._sequence = count(1)
+        self._ready = deque()
+        self._cond = threading.Condition()
+        self.completed = []
+        self.dead_lettered = []
+        for body in bodies:
+            self.send(body)
+
+    def send(self, body):
+        if not isinstance(body, (str, bytes)):
+            body = json.dumps(body)
+        with self._cond:
+            self._ready.append(InMemoryMessage(body, next(self._sequence)))
+            self._cond.notify()
+
+    def __len__(self):
+        return len(self._ready)
+
+    def receive(self, max_messages, max_wait):
+        with self._cond:
+            self._cond.wait_for(lambda: self._ready, timeout=max_wait)
+            batch = []
+            while self._ready and len(batch) < max_messages:
+                message = self._ready.popleft()
+                message.delivery_count += 1
+                batch.append(message)
+            return batch
+
+    def complete(self, message):
+        self.completed.append(message)
+
+    def abandon(self, message):
+        if message.delivery_count >= self.max_delivery_count:
+            self.dead_letter(message, 'MaxDeliveryCountExceeded')
+            return
+        with self._cond:
+            self._ready.append(message)
+            self._cond.notify()
+
+    def dead_letter(self, message, reason, description=''):
+        self.dead_lettered.append((message, reason, description))
+
+
+# -- Processing ---------------------------------------------------------------
+
+@dataclass
+class Change:
+    """A decoded message: what to do with which trust or guideline."""
+    kind: str  # 'trust', 'upsert' or 'delete'
+    guideline_id: int = None
+    data: dict = field(default_factory=dict)
+    trust_name: str = None
+
+
+_local = threading.local()
+
+
+def _fetch(href):
+    import requests
+
+    base_url = getattr(settings, 'WHITESPACE_API_BASE_URL', None)
+    if not base_url:
+        raise InvalidMessage('href given but WHITESPACE_API_BASE_URL is not configured')
+    session = getattr(_local, 'session', None)
+    if session is None:
+        # One keep-alive session per pool thread
+        session = _local.session = requests.Session()
+        token = getattr(settings, 'WHITESPACE_AUTH_TOKEN', None)
+        if token:
+            session.headers['Authorization'] = f'Bearer {token}'
+    response = session.get(urljoin(base_url, href), timeout=FETCH_TIMEOUT)
+    if response.status_code == 404:
+        raise InvalidMessage(f'{href} not found')
+    response.raise_for_status()
+    return response.json()
+
+
+def _valid_trust_name(name):
+    return isinstance(name, str) and 0 < len(name.strip()) <= Trust._meta.get_field('name').max_length
+
+
+def decode(message):
+    """Turn a queue message into a Change; raises InvalidMessage for bad messages."""
+    body = message.body
+    if not isinstance(body, (str, bytes)):
+        # Service Bus delivers the body as a generator of byte sections
+        body = b''.join(body)
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        raise InvalidMessage('Body is not JSON')
+    if not isinstance(payload, dict):
+        raise InvalidMessage('Body is not a JSON object')
+    kind = payload.get('type')
+    pk = payload.get('id')
+    if pk is not None and (not isinstance(pk, int) or isinstance(pk, bool)):
+        raise InvalidMessage('id must be an integer')
+    if kind == 'trust.upserted':
+        name = payload.get('name')
+        if not _valid_trust_name(name):
+            raise InvalidMessage('trust.upserted needs a name of at most 100 characters')
+        return Change('trust', trust_name=name.strip())
+    if kind == 'guideline.deleted':
+        if pk is None:
+            raise InvalidMessage('guideline.deleted needs an id')
+        return Change('delete', guideline_id=pk)
+    if kind == 'guideline.upserted':
+        data = _fetch(payload['href']) if payload.get('href') else payload.get('data')
+        if not isinstance(data, dict):
+            raise InvalidMessage('guideline.upserted needs data or href')
+        data = {key: value for key, value in data.items() if key != 'id'}
+        trust_name = data.pop('trust', None)
+        if trust_name is not None and not _valid_trust_name(trust_name):
+            raise InvalidMessage('trust must be a trust name of at most 100 characters')
+        return Change('upsert', guideline_id=pk, data=data, trust_name=trust_name and trust_name.strip())
+    raise InvalidMessage(f'Unknown message type {kind!r}')
+
+
+def ensure_trusts(names):
+    """Create missing trusts (by unique name) and return ``{name: id}``."""
+    if not names:
+        return {}
+    ids = dict(Trust.objects.filter(name__in=names).values_list('name', 'id'))
+    missing = [name for name in names if name not in ids]
+    if not missing:
+        return ids
+    Trust.objects.bulk_create([Trust(name=name) for name in missing], ignore_conflicts=True)
+    created = dict(Trust.objects.filter(name__in=missing).values_list('name', 'id'))
+    changes.record(GuidelineChange.TRUST, GuidelineChange.CREATE, list(created.values()))
+    return {**ids, **created}
+
+
+def _operations(decoded):
+    """
+    Coalesce decoded guideline changes into apply_batch operations.
+
+    Returns ``(operations, owners, rejected)``: ``owners[i]`` lists the
+    indexes of the changes folded into operation ``i``. Later messages for a
+    guideline win; updates are merged field by field. An update after a
+    delete of the same guideline can't be applied (the id no longer
+    exists); ``rejected`` maps its index to the error it is dead-lettered
+    with.
+    """
+    operations, owners, by_id, rejected = [], [], {}, {}
+    for index, change in decoded:
+        if change.kind == 'trust':
+            continue
+        if change.guideline_id is None:
+            operations.append({'op': 'create', 'data': change.data})
+            owners.append([index])
+            continue
+        position = by_id.get(change.guideline_id)
+        if position is None:
+            by_id[change.guideline_id] = len(operations)
+            op = 'delete' if change.kind == 'delete' else 'update'
+            operations.append({'op': op, 'id': change.guideline_id, 'data': dict(change.data)})
+            owners.append([index])
+            continue
+        operation = operations[position]
+        if change.kind == 'delete':
+            operation.update(op='delete', data={})
+        elif operation['op'] == 'delete':
+            rejected[index] = {'id': ['Guideline deleted earlier in the same batch; nothing to update.']}
+            continue
+        else:
+            operation['data'].update(change.data)
+        owners[position].append(index)
+    return operations, owners, rejected
+
+
+def apply_changes(decoded):
+    """
+    Apply decoded ``[(index, Change)]`` in one transaction.
+
+    Returns ``{index: error or None}``; failed operations don't roll back
+    the others. Database errors propagate (the caller abandons the batch).
+    """
+    outcome = {index: None for index, _ in decoded}
+    with transaction.atomic():
+        trust_ids = ensure_trusts({change.trust_name for _, change in decoded if change.trust_name})
+        for _, change in decoded:
+            if change.trust_name:
+                change.data['trust'] = trust_ids[change.trust_name]
+        operations, owners, rejected = _operations(decoded)
+        outcome.update(rejected)
+        if operations:
+            _, results = GuidelineService.apply_batch(operations, None, atomic=False)
+            for operation, result, indexes in zip(operations, results, owners):
+                errors = result.get('errors')
+                if errors and operation['op'] == 'delete' and 'id' in errors:
+                    # Already gone: deletes are idempotent
+                    errors = None
+                for index in indexes:
+                    outcome[index] = errors
+    return outcome
+
+
+class Consumer:
+    """Receive, process, apply and settle batches until stopped."""
+
+    def __init__(self, queue, batch_size=100, concurrency=8, max_wait=5):
+        self.queue = queue
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='whitespace')
+        self.stopping = threading.Event()
+        self.backoff = 0
+        self.totals = {'applied': 0, 'dead_lettered': 0, 'abandoned': 0}
+
+    def stop(self):
+        self.stopping.set()
+
+    def run(self, max_batches=None, exit_when_idle=False):
+        batches = 0
+        reported_at, reported = time.monotonic(), 0
+        try:
+            while not self.stopping.is_set() and (max_batches is None or batches < max_batches):
+                now = time.monotonic()
+                if now - reported_at >= REPORT_INTERVAL:
+                    handled = sum(self.totals.values())
+                    logger.info(
+                        "Whitespace consumer: %d message(s) in %.0fs (%.1f/s), totals %s",
+                        handled - reported, now - reported_at, (handled - reported) / (now - reported_at), self.totals,
+                    )
+                    reported_at, reported = now, handled
+                with metrics.timed(metrics.WHITESPACE_BATCH_LATENCY, stage='receive'):
+                    messages = self.queue.receive(self.batch_size, self.max_wait)
+                if not messages:
+                    if exit_when_idle:
+                        break
+                    continue
+                batches += 1
+                self.handle_batch(messages)
+                if self.backoff:
+                    self.stopping.wait(self.backoff)
+        finally:
+            self.pool.shutdown(wait=True)
+            self.queue.close()
+        return self.totals
+
+    def _decode(self, message):
+        try:
+            return decode(message)
+        except Exception as exc:
+            return exc
+
+    def handle_batch(self, messages):
+        metrics.WHITESPACE_BATCH_SIZE.observe(len(messages))
+        with metrics.timed(metrics.WHITESPACE_BATCH_LATENCY, stage='process'):
+            decoded = list(self.pool.map(self._decode, messages))
+        valid = [(i, change) for i, change in enumerate(decoded) if isinstance(change, Change)]
+        invalid = {i: str(exc) for i, exc in enumerate(decoded) if isinstance(exc, InvalidMessage)}
+        # Anything else (e.g. a failed fetch) may succeed on redelivery
+        retry = {i for i, exc in enumerate(decoded) if isinstance(exc, Exception) and i not in invalid}
+        for i in retry:
+            logger.warning("Processing a Whitespace message failed; abandoning it", exc_info=decoded[i])
+        try:
+            with metrics.timed(metrics.WHITESPACE_BATCH_LATENCY, stage='apply'):
+                outcome = apply_changes(valid) if valid else {}
+        except Exception:
+            logger.exception("Applying a Whitespace batch of %d message(s) failed", len(messages))
+            outcome = None
+            retry.update(i for i, _ in valid)
+        if outcome is None or retry:
+            self.backoff = min(max(self.backoff * 2, 1), MAX_BACKOFF)
+        else:
+            self.backoff = 0
+        invalid.update({i: json.dumps(error) for i, error in (outcome or {}).items() if error})
+
+        with metrics.timed(metrics.WHITESPACE_BATCH_LATENCY, stage='settle'):
+            for i, message in enumerate(messages):
+                if i in retry:
+                    self._settle(self.queue.abandon, message)
+                elif i in invalid:
+                    logger.warning("Dead-lettering Whitespace message: %s", invalid[i])
+                    self._settle(self.queue.dead_letter, message, 'InvalidMessage', invalid[i])
+                else:
+                    self._settle(self.queue.complete, message)
+        self._count('abandoned', len(retry))
+        self._count('dead_lettered', len(invalid))
+        self._count('applied', len(messages) - len(retry) - len(invalid))
+
+    def _settle(self, settle, message, *args):
+        try:
+            settle(message, *args)
+        except Exception:
+            # E.g. the lock expired: the broker redelivers it, and reapplying is harmless
+            logger.warning("Could not settle Whitespace message", exc_info=True)
+
+    def _count(self, result, amount):
+        if amount:
+            self.totals[result] += amount
+            metrics.WHITESPACE_MESSAGES.labels(result).inc(amount)
@@ -0,0 +1,249 @@
+"""
+apps/risk_documents/index.py
+
+Compact on-disk catalogue of the ``risks/<category>/<group uuid>/<file uuid>.pdf`` tree.
+
+The index is a single binary file, read through ``mmap`` so every gunicorn
+worker shares one copy in the page cache:
+
+    header      magic "RDIX", version, category count, record count
+    categories  per category: name (UTF-8, 64 bytes), first record, record count
+    records     per file: category, group uuid, file uuid, size, mtime (ns), sha256
+
+Records are sorted by (category, group, file), so a category's files are a
+contiguous slice (listing reads only that slice) and a single file is found
+by binary search. Rebuilds reuse the hash of every file whose size and mtime
+are unchanged and replace the index atomically with ``os.replace``.
+"""
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'RDIX'
+VERSION = 1
+HEADER = struct.Struct('<4sHHI')
+CATEGORY = struct.Struct('<64sII')
+RECORD = struct.Struct('<H16s16sQq32s')
+KEY_SLICE = slice(2, 34)  # group + file uuid bytes within a record
+EXTENSION = '.pdf'
+HASH_CHUNK = 1024 * 1024
+
+
+@dataclass(frozen=True)
+class RiskFile:
+    category: str
+    group: uuid.UUID
+    file: uuid.UUID
+    size: int
+    mtime_ns: int
+    sha256: str
+
+    @property
+    def name(self):
+        """Path relative to the corpus root."""
+        return f'{self.category}/{self.group}/{self.file}{EXTENSION}'
+
+
+class CorpusIndex:
+    """Read-only view of an index file."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            self.identity = (stat.st_ino, stat.st_mtime_ns)
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, n_categories, self.count = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'{path} is not a version {VERSION} risk document index')
+        self.categories = {}
+        offset = HEADER.size
+        for _ in range(n_categories):
+            raw_name, start, count = CATEGORY.unpack_from(self._mm, offset)
+            self.categories[raw_name.rstrip(b'\0').decode()] = (start, count)
+            offset += CATEGORY.size
+        self._records_offset = offset
+
+    def __len__(self):
+        return self.count
+
+    def _record(self, category, position):
+        _, group, file, size, mtime_ns, digest = RECORD.unpack_from(
+            self._mm, self._records_offset + position * RECORD.size
+        )
+        return RiskFile(category, uuid.UUID(bytes=group), uuid.UUID(bytes=file), size, mtime_ns, digest.hex())
+
+    def category_size(self, category):
+        return self.categories.get(category, (0, 0))[1]
+
+    def list_category(self, category, offset=0, limit=None):
+        """Return the files of ``category`` (sorted by group, then file) from the index."""
+        start, count = self.categories.get(category, (0, 0))
+        stop = count if limit is None else min(count, offset + limit)
+        return [self._record(category, start + i) for i in range(offset, stop)]
+
+    def __iter__(self):
+        for category, (start, count) in self.categories.items():
+            for i in range(count):
+                yield self._record(category, start + i)
+
+    def find(self, category, group, file):
+        """Return the RiskFile for ``category/group/file`` or None."""
+        start, count = self.categories.get(category, (0, 0))
+        target = group.bytes + file.bytes
+        lo, hi = start, start + count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            offset = self._records_offset + mid * RECORD.size
+            key = self._mm[offset + KEY_SLICE.start:offset + KEY_SLICE.stop]
+            if key < target:
+                lo = mid + 1
+            elif key > target:
+                hi = mid
+            else:
+                return self._record(category, mid)
+        return None
+
+    def close(self):
+        self._mm.close()
+
+
+def _hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(HASH_CHUNK):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def _parse_uuid(value):
+    try:
+        return uuid.UUID(value)
+    except ValueError:
+        return None
+
+
+def scan(root):
+    """Yield ``(category, group, file, path, stat)`` for every document under ``root``."""
+    with os.scandir(root) as categories:
+        for category in sorted(categories, key=lambda e: e.name):
+            if not category.is_dir() or category.name.startswith('.'):
+                continue
+            if len(category.name.encode()) > 64:
+                logger.warning("Skipping risk category with a name over 64 bytes: %s", category.name)
+                continue
+            with os.scandir(category.path) as groups:
+                for group_entry in groups:
+                    group = _parse_uuid(group_entry.name)
+                    if group is None or not group_entry.is_dir():
+                        continue
+                    with os.scandir(group_entry.path) as files:
+                        for file_entry in files:
+                            stem, ext = os.path.splitext(file_entry.name)
+                            file = _parse_uuid(stem)
+                            if ext != EXTENSION or file is None or not file_entry.is_file():
+                                continue
+                            yield category.name, group, file, file_entry.path, file_entry.stat()
+
+
+def build_index(root, index_path, previous=None):
+    """
+    Write a fresh index of ``root`` to ``index_path`` and return change counts.
+
+    Files whose size and mtime match ``previous`` (a CorpusIndex) keep their
+    recorded hash instead of being read again.
+    """
+    stats = {'files': 0, 'hashed': 0, 'reused': 0, 'removed': 0}
+    entries = []
+    matched = 0
+    for category, group, file, path, stat in scan(root):
+        known = previous.find(category, group, file) if previous is not None else None
+        matched += known is not None
+        if known is not None and known.size == stat.st_size and known.mtime_ns == stat.st_mtime_ns:
+            digest = bytes.fromhex(known.sha256)
+            stats['reused'] += 1
+        else:
+            digest = _hash_file(path)
+            stats['hashed'] += 1
+        entries.append((category, group.bytes, file.bytes, stat.st_size, stat.st_mtime_ns, digest))
+    entries.sort()
+    stats['files'] = len(entries)
+    if previous is not None:
+        stats['removed'] = len(previous) - matched
+
+    categories = {}
+    for position, (category, *_rest) in enumerate(entries):
+        start, count = categories.get(category, (position, 0))
+        categories[category] = (start, count + 1)
+
+    tmp_path = f'{index_path}.{os.getpid()}.tmp'
+    os.makedirs(os.path.dirname(os.path.abspath(index_path)), exist_ok=True)
+    try:
+        with open(tmp_path, 'wb') as out:
+            out.write(HEADER.pack(MAGIC, VERSION, len(categories), len(entries)))
+            for category, (start, count) in categories.items():
+                out.write(CATEGORY.pack(category.encode(), start, count))
+            category_ids = {name: i for i, name in enumerate(categories)}
+            for category, group, file, size, mtime_ns, digest in entries:
+                out.write(RECORD.pack(category_ids[category], group, file, size, mtime_ns, digest))
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(tmp_path, index_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return stats
+
+
+class IndexHandle:
+    """
+    Per-process access to the current index, reopened when it is replaced.
+
+    The index file is re-stat'ed at most every ``check_interval`` seconds;
+    a missing index is built on first use.
+    """
+
+    def __init__(self, root, index_path, check_interval=5.0):
+        self.root = root
+        self.index_path = index_path
+        self.check_interval = check_interval
+        self._index = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    def get(self):
+        now = time.monotonic()
+        if self._index is not None and now - self._checked < self.check_interval:
+            return self._index
+        with self._lock:
+            self._checked = now
+            try:
+                stat = os.stat(self.index_path)
+            except FileNotFoundError:
+                logger.warning("Risk document index %s is missing; building it", self.index_path)
+                build_index(self.root, self.index_path)
+                stat = os.stat(self.index_path)
+            if self._index is None or self._index.identity != (stat.st_ino, stat.st_mtime_ns):
+                # The old mapping is left to the garbage collector: other
+                # threads may still be reading from it
+                self._index = CorpusIndex(self.index_path)
+            return self._index
+
+    def rebuild(self):
+        """Rebuild incrementally from the current index and return the change counts."""
+        previous = None
+        if os.path.exists(self.index_path):
+            previous = CorpusIndex(self.index_path)
+        try:
+            return build_index(self.root, self.index_path, previous)
+        finally:
+            if previous is not None:
+                previous.close()
@@ -0,0 +1,27 @@
+"""
+Build or incrementally refresh the risk document catalogue index.
+
+Only files whose size or mtime changed since the last build are re-hashed;
+the new index replaces the old one atomically, and running workers pick it
+up within a few seconds. Run after deploying or syncing the corpus:
+
+    python manage.py build_risk_index
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from apps.risk_documents.storage import risk_storage
+
+
+class Command(BaseCommand):
+    help = "Build or refresh the index of the local risks/ document corpus."
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        stats = risk_storage.handle.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {stats['files']} file(s) from {risk_storage.location} in "
+            f"{time.perf_counter() - started:.2f}s: {stats['hashed']} hashed, "
+            f"{stats['reused']} unchanged, {stats['removed']} removed."
+        ))
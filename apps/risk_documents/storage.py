@@ -0,0 +1,96 @@
+"""
+apps/risk_documents/storage.py
+
+Read-only Django storage backend over the local ``risks/`` corpus.
+
+Metadata calls (``exists``, ``size``, ``listdir``, ``get_modified_time``)
+are answered from the catalogue index instead of the file system, so they
+stay cheap however large the tree grows; only ``open``/``path`` touch the
+files themselves.
+"""
+import os
+import uuid
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import Storage
+from django.utils.deconstruct import deconstructible
+from django.utils.functional import cached_property
+
+from .index import EXTENSION, IndexHandle
+
+
+@deconstructible(path='apps.risk_documents.storage.RiskCorpusStorage')
+class RiskCorpusStorage(Storage):
+    def __init__(self, location=None, index_path=None):
+        self.location = os.path.abspath(location or settings.RISK_DOCUMENTS_ROOT)
+        self.index_path = index_path or settings.RISK_DOCUMENTS_INDEX
+
+    @cached_property
+    def handle(self):
+        return IndexHandle(self.location, self.index_path)
+
+    @property
+    def index(self):
+        return self.handle.get()
+
+    def lookup(self, name):
+        """Return the index entry for ``<category>/<group>/<file>.pdf`` or None."""
+        parts = name.strip('/').split('/')
+        if len(parts) != 3 or not parts[2].endswith(EXTENSION):
+            return None
+        try:
+            group = uuid.UUID(parts[1])
+            file = uuid.UUID(parts[2][:-len(EXTENSION)])
+        except ValueError:
+            return None
+        return self.index.find(parts[0], group, file)
+
+    def path(self, name):
+        entry = self.lookup(name)
+        if entry is None:
+            raise FileNotFoundError(name)
+        return os.path.join(self.location, entry.name)
+
+    def _open(self, name, mode='rb'):
+        if 'w' in mode or 'a' in mode or '+' in mode:
+            raise PermissionError('RiskCorpusStorage is read-only')
+        return File(open(self.path(name), mode))
+
+    def _save(self, name, content):
+        raise PermissionError('RiskCorpusStorage is read-only')
+
+    def delete(self, name):
+        raise PermissionError('RiskCorpusStorage is read-only')
+
+    def exists(self, name):
+        return self.lookup(name) is not None
+
+    def size(self, name):
+        entry = self.lookup(name)
+        if entry is None:
+            raise FileNotFoundError(name)
+        return entry.size
+
+    def get_modified_time(self, name):
+        entry = self.lookup(name)
+        if entry is None:
+            raise FileNotFoundError(name)
+        return datetime.fromtimestamp(entry.mtime_ns / 1e9, timezone.utc)
+
+    def listdir(self, path):
+        parts = [part for part in path.strip('/').split('/') if part]
+        index = self.index
+        if not parts:
+            return list(index.categories), []
+        entries = index.list_category(parts[0])
+        if len(parts) == 1:
+            return sorted({str(entry.group) for entry in entries}), []
+        return [], [f'{entry.file}{EXTENSION}' for entry in entries if str(entry.group) == parts[1]]
+
+    def url(self, name):
+        return f'/api/risk-documents/{name.strip("/")}'
+
+
+risk_storage = RiskCorpusStorage()
@@ -0,0 +1,145 @@
+import hashlib
+import os
+import tempfile
+import uuid
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase
+from rest_framework.test import APIClient
+
+from apps.users.models import User
+
+from . import index
+from .index import CorpusIndex, build_index
+from .storage import RiskCorpusStorage
+
+
+class CorpusMixin:
+    """A temporary ``risks/`` tree with two categories."""
+
+    def setUp(self):
+        super().setUp()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = os.path.join(tmp.name, 'risks')
+        self.index_path = os.path.join(tmp.name, 'risks.idx')
+        self.group = uuid.UUID(int=2)
+        self.files = {}
+        for category, group, number in [('falls', self.group, 1), ('falls', self.group, 3), ('falls', uuid.UUID(int=1), 2), ('sepsis', self.group, 4)]:
+            self.write(category, group, uuid.UUID(int=number), f'document {number}'.encode())
+        # Ignored: not a uuid, not a pdf
+        os.makedirs(os.path.join(self.root, 'falls', 'notes'))
+        with open(os.path.join(self.root, 'falls', str(self.group), 'readme.txt'), 'w') as f:
+            f.write('x')
+
+    def write(self, category, group, file, content):
+        directory = os.path.join(self.root, category, str(group))
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'{file}.pdf')
+        with open(path, 'wb') as f:
+            f.write(content)
+        self.files[(category, group, file)] = content
+        return path
+
+    def open_index(self):
+        corpus = CorpusIndex(self.index_path)
+        self.addCleanup(corpus.close)
+        return corpus
+
+
+class CorpusIndexTests(CorpusMixin, SimpleTestCase):
+    """The binary catalogue: lookups, listings and incremental rebuilds."""
+
+    def test_find_and_list(self):
+        stats = build_index(self.root, self.index_path)
+        self.assertEqual(stats, {'files': 4, 'hashed': 4, 'reused': 0, 'removed': 0})
+        corpus = self.open_index()
+        self.assertEqual(corpus.categories, {'falls': (0, 3), 'sepsis': (3, 1)})
+        for (category, group, file), content in self.files.items():
+            entry = corpus.find(category, group, file)
+            self.assertEqual((entry.size, entry.sha256), (len(content), hashlib.sha256(content).hexdigest()))
+        self.assertIsNone(corpus.find('falls', self.group, uuid.UUID(int=4)))
+        self.assertIsNone(corpus.find('burns', self.group, uuid.UUID(int=1)))
+        listed = [(entry.group.int, entry.file.int) for entry in corpus.list_category('falls')]
+        self.assertEqual(listed, [(1, 2), (2, 1), (2, 3)])
+        self.assertEqual([entry.file.int for entry in corpus.list_category('falls', offset=1, limit=1)], [1])
+
+    def test_rebuild_rehashes_only_changed_files(self):
+        build_index(self.root, self.index_path)
+        path = self.write('falls', self.group, uuid.UUID(int=1), b'revised document')
+        os.utime(path, ns=(1, 1))
+        os.remove(os.path.join(self.root, 'sepsis', str(self.group), f'{uuid.UUID(int=4)}.pdf'))
+        self.write('sepsis', self.group, uuid.UUID(int=5), b'new')
+        previous = self.open_index()
+        with mock.patch.object(index, '_hash_file', wraps=index._hash_file) as hash_file:
+            stats = build_index(self.root, self.index_path, previous)
+        self.assertEqual(stats, {'files': 4, 'hashed': 2, 'reused': 2, 'removed': 1})
+        self.assertEqual(
+            sorted(os.path.basename(call.args[0]) for call in hash_file.call_args_list),
+            [f'{uuid.UUID(int=1)}.pdf', f'{uuid.UUID(int=5)}.pdf'],
+        )
+        revised = self.open_index().find('falls', self.group, uuid.UUID(int=1))
+        self.assertEqual(revised.sha256, hashlib.sha256(b'revised document').hexdigest())
+
+
+class RiskCorpusStorageTests(CorpusMixin, SimpleTestCase):
+    """Storage metadata is answered from the index."""
+
+    def test_listdir_and_metadata(self):
+        build_index(self.root, self.index_path)
+        storage = RiskCorpusStorage(self.root, self.index_path)
+        self.assertEqual(storage.listdir(''), (['falls', 'sepsis'], []))
+        self.assertEqual(storage.listdir('falls'), ([str(uuid.UUID(int=1)), str(self.group)], []))
+        self.assertEqual(
+            storage.listdir(f'falls/{self.group}/'),
+            ([], [f'{uuid.UUID(int=1)}.pdf', f'{uuid.UUID(int=3)}.pdf']),
+        )
+        name = f'sepsis/{self.group}/{uuid.UUID(int=4)}.pdf'
+        self.assertTrue(storage.exists(name))
+        self.assertEqual(storage.size(name), len(b'document 4'))
+        self.assertFalse(storage.exists(f'sepsis/{self.group}/not-a-uuid.pdf'))
+        with storage.open(name) as f:
+            self.assertEqual(f.read(), b'document 4')
+
+
+class RiskDocumentViewTests(CorpusMixin, TestCase):
+    """Document downloads with Range and conditional requests."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('reader@example.com', 'reader@example.com', 'secret')
+
+    def setUp(self):
+        super().setUp()
+        build_index(self.root, self.index_path)
+        patcher = mock.patch('apps.risk_documents.views.risk_storage', RiskCorpusStorage(self.root, self.index_path))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = APIClient(HTTP_HOST='localhost')
+        self.client.force_authenticate(self.user)
+        self.url = f'/api/risk-documents/falls/{self.group}/{uuid.UUID(int=3)}.pdf'
+
+    def get(self, url=None, **headers):
+        response = self.client.get(url or self.url, headers=headers)
+        body = b''.join(response.streaming_content) if response.streaming else response.content
+        response.close()
+        return response, body
+
+    def test_full_and_ranged_download(self):
+        response, body = self.get()
+        self.assertEqual((response.status_code, body), (200, b'document 3'))
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        response, body = self.get(Range='bytes=0-7')
+        self.assertEqual((response.status_code, body), (206, b'document'))
+        self.assertEqual(response['Content-Range'], 'bytes 0-7/10')
+
+    def test_not_modified_keeps_cache_policy(self):
+        response, _ = self.get()
+        revalidated, _ = self.get(**{'If-None-Match': response['ETag']})
+        self.assertEqual(revalidated.status_code, 304)
+        self.assertEqual(revalidated['ETag'], response['ETag'])
+        self.assertEqual(revalidated['Cache-Control'], response['Cache-Control'])
+
+    def test_unknown_document_is_404(self):
+        response, _ = self.get(f'/api/risk-documents/falls/{self.group}/{uuid.UUID(int=9)}.pdf')
+        self.assertEqual(response.status_code, 404)
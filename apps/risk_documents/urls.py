@@ -0,0 +1,13 @@
+# apps/risk_documents/urls.py
+from django.urls import path
+from .views import RiskCategoryListView, RiskCategoryDetailView, RiskDocumentView
+
+urlpatterns = [
+    path('risk-documents/', RiskCategoryListView.as_view(), name='risk_category_list'),
+    path('risk-documents/<slug:category>/', RiskCategoryDetailView.as_view(), name='risk_category_detail'),
+    path(
+        'risk-documents/<slug:category>/<uuid:group>/<uuid:file>.pdf',
+        RiskDocumentView.as_view(),
+        name='risk_document',
+    ),
+]
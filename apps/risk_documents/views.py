@@ -0,0 +1,88 @@
+"""
+apps/risk_documents/views.py
+
+Endpoints for the local risk document corpus. Listings come from the
+catalogue index; files are streamed with Range support (sendfile under
+gunicorn).
+"""
+from django.http import Http404
+from django.utils.cache import get_conditional_response, patch_cache_control
+from rest_framework import permissions
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from apps.core import http
+
+from .storage import risk_storage
+
+MAX_PAGE_SIZE = 500
+# Documents are addressed by content hash, so a cached copy is good for a while
+DOCUMENT_CACHE_CONTROL = {'private': True, 'max_age': 3600}
+
+
+def _file_payload(entry):
+    return {
+        'group': str(entry.group),
+        'file': str(entry.file),
+        'size': entry.size,
+        'sha256': entry.sha256,
+        'url': risk_storage.url(entry.name),
+    }
+
+
+class RiskCategoryListView(APIView):
+    """Categories in the corpus with their file counts."""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        index = risk_storage.index
+        return Response([
+            {'category': name, 'count': count} for name, (start, count) in index.categories.items()
+        ])
+
+
+class RiskCategoryDetailView(APIView):
+    """Files of one category, paged with ``?offset=`` and ``?limit=``."""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, category):
+        index = risk_storage.index
+        if category not in index.categories:
+            raise Http404
+        try:
+            offset = max(int(request.query_params.get('offset', 0)), 0)
+            limit = min(max(int(request.query_params.get('limit', 100)), 1), MAX_PAGE_SIZE)
+        except ValueError:
+            return Response({'detail': 'offset and limit must be integers.'}, status=400)
+        entries = index.list_category(category, offset, limit)
+        return Response({
+            'category': category,
+            'count': index.category_size(category),
+            'offset': offset,
+            'results': [_file_payload(entry) for entry in entries],
+        })
+
+
+class RiskDocumentView(APIView):
+    """Stream one document; supports Range, If-Range and If-None-Match."""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, category, group, file):
+        entry = risk_storage.index.find(category, group, file)
+        if entry is None:
+            raise Http404
+        etag = f'"{entry.sha256[:32]}"'
+        response = get_conditional_response(request, etag=etag)
+        if response is not None:
+            # Same caching policy as the 200, which the 304 refreshes
+            response.headers['ETag'] = etag
+            patch_cache_control(response, **DOCUMENT_CACHE_CONTROL)
+            return response
+        try:
+            return http.file_response(
+                request, risk_storage.path(entry.name), 'application/pdf', etag=etag,
+                filename=f'{entry.file}.pdf', cache_control=DOCUMENT_CACHE_CONTROL,
+            )
+        except FileNotFoundError:
+            # Deleted since the index was built
+            raise Http404
@@ -3,6 +3,7 @@ from rest_framework_simplejwt.exceptions import InvalidToken, AuthenticationFail
 
 import logging
 from rest_framework_simplejwt.authentication import JWTAuthentication
+from apps.core import timing
 logger = logging.getLogger(__name__)
 
 
@@ -13,9 +14,13 @@ class CookieJWTAuthentication(JWTAuthentication):
     def authenticate(self, request):
         # Retrieve the access token from the 'access_token' cookie
         raw_token = request.COOKIES.get('access_token')
-        logger.debug("CookieJWTAuthentication.authenticate raw_token=%s", raw_token)
+        logger.debug("CookieJWTAuthentication.authenticate token_present=%s", bool(raw_token))
         if not raw_token:
             return None
+        with timing.phase('auth'):
+            return self._authenticate_token(raw_token)
+
+    def _authenticate_token(self, raw_token):
         try:
             # Validate token
             validated_token = self.get_validated_token(raw_token)
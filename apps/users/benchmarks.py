@@ -0,0 +1,82 @@
+"""
+apps/users/benchmarks.py
+
+Micro-benchmarks for cookie JWT authentication and the magic link / token services.
+Run with ``python manage.py benchmark run -k 'users.*'``.
+"""
+from datetime import timedelta
+
+from django.test import RequestFactory
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+from apps.core.benchmarking import Benchmark, register
+
+from .authentication import CookieJWTAuthentication
+from .models import MagicLink, User
+from .services import MagicLinkService, TokenService
+
+
+def create_user():
+    return User.objects.create(username='bench@example.com', email='bench@example.com')
+
+
+@register
+class CookieJWTAuthenticationBenchmark(Benchmark):
+    name = 'users.authentication.cookie_jwt'
+    params = {'token': ['valid', 'expired', 'missing']}
+    repeat = 10
+    number = 500
+
+    def setup(self):
+        self.user = create_user()
+        self.auth = CookieJWTAuthentication()
+        access = AccessToken.for_user(self.user)
+        if self.kwargs['token'] == 'expired':
+            access.set_exp(lifetime=-timedelta(minutes=1))
+        factory = RequestFactory()
+        self.request = factory.get('/api/auth/session/')
+        if self.kwargs['token'] != 'missing':
+            self.request.COOKIES['access_token'] = str(access)
+
+    def run(self):
+        self.auth.authenticate(self.request)
+
+    def teardown(self):
+        self.user.delete()
+
+
+@register
+class ConfirmMagicLinkBenchmark(Benchmark):
+    name = 'users.services.confirm_magic_link'
+    repeat = 10
+    number = 100
+
+    def setup(self):
+        self.user = create_user()
+
+    def setup_iteration(self):
+        links = MagicLink.objects.bulk_create(MagicLink(user=self.user) for _ in range(self.number))
+        self.tokens = iter([link.token for link in links])
+
+    def run(self):
+        MagicLinkService.confirm_magic_link_and_issue_tokens(next(self.tokens))
+
+    def teardown(self):
+        self.user.delete()
+
+
+@register
+class RefreshAccessTokenBenchmark(Benchmark):
+    name = 'users.services.refresh_access_token'
+    repeat = 10
+    number = 500
+
+    def setup(self):
+        self.user = create_user()
+        self.refresh = str(RefreshToken.for_user(self.user))
+
+    def run(self):
+        TokenService.refresh_access_token(self.refresh)
+
+    def teardown(self):
+        self.user.delete()
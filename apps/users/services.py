@@ -2,13 +2,24 @@ from django.conf import settings
 from django.contrib.sites.models import Site
 from django.core.mail import send_mail
 from django.template.loader import render_to_string
+from django.db import connections, router, transaction
 from django.utils import timezone
 from datetime import timedelta
+import logging
+import uuid
 
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.state import token_backend
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
 from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.utils import get_md5_hash_password
 
+from apps.core import metrics
 from .models import User, MagicLink
 
+logger = logging.getLogger(__name__)
+
 
 class UserService:
     """
@@ -57,8 +68,8 @@ class MagicLinkService:
         """
         Send the magic link email to the user.
         """
-        print(f"[DEBUG] send_magic_link_email called with user: {user} (email: {getattr(user, 'email', None)})")
-        print(f"[DEBUG] send_magic_link_email called with confirm_url: {confirm_url}")
+        # The confirm URL is a login credential, so it is never logged
+        logger.debug("Sending magic link email", extra={'user_id': str(user.pk)})
         site = Site.objects.get_current()
         context = {
             'site_name': site.name,
@@ -69,33 +80,103 @@ class MagicLinkService:
         }
         subject = render_to_string('account/email/magic_link_subject.txt', context).strip()
         message = render_to_string('account/email/magic_link_message.txt', context)
-        send_mail(subject, message, settings.DEFAULT_FROM_EMAIL, [user.email])
+        with metrics.timed(metrics.EMAIL_SEND_LATENCY, template='magic_link'):
+            send_mail(subject, message, settings.DEFAULT_FROM_EMAIL, [user.email])
 
     @staticmethod
-    def confirm_magic_link_and_issue_tokens(token):
+    def consume_magic_link(token):
         """
-        Verify a magic link token, consume it, and issue JWT tokens.
-        Returns a dict with 'access_token' and 'refresh_token'.
+        Mark a valid magic link as used and return its user's id.
+
+        One conditional UPDATE: the link must be unused, unexpired and belong
+        to an active user, so of two concurrent clicks exactly one succeeds.
+        On backends with ``RETURNING`` (PostgreSQL, SQLite 3.35+) the user id
+        comes back in the same statement. Raises InvalidMagicLink for unknown
+        tokens and inactive users, ExpiredMagicLink for used or expired links.
         """
         try:
-            magic_link = MagicLink.objects.get(token=token)
-        except MagicLink.DoesNotExist:
+            token = uuid.UUID(str(token))
+        except ValueError:
+            raise MagicLinkService.InvalidMagicLink
+        cutoff = timezone.now() - timedelta(minutes=settings.MAGIC_LINK_EXPIRY_MINUTES)
+        connection = connections[router.db_for_write(MagicLink)]
+        if MagicLinkService._can_update_returning(connection):
+            user_id = MagicLinkService._consume_returning(connection, token, cutoff)
+        else:
+            with transaction.atomic(using=connection.alias):
+                links = MagicLink.objects.using(connection.alias).filter(token=token)
+                consumed = links.valid().filter(user__is_active=True).update(used=True)
+                user_id = links.values_list('user_id', flat=True).first() if consumed else None
+        if user_id is not None:
+            return user_id
+        # Failure path only: tell an unknown link (or inactive user) from a spent one
+        is_active = MagicLink.objects.filter(token=token).values_list('user__is_active', flat=True).first()
+        if not is_active:
             raise MagicLinkService.InvalidMagicLink
+        raise MagicLinkService.ExpiredMagicLink
 
-        expiry = magic_link.created_at + timedelta(minutes=settings.MAGIC_LINK_EXPIRY_MINUTES)
-        if timezone.now() > expiry or magic_link.used:
-            raise MagicLinkService.ExpiredMagicLink
+    @staticmethod
+    def _can_update_returning(connection):
+        # Not features.can_return_columns_from_insert: MariaDB has INSERT ... RETURNING
+        # but no UPDATE ... RETURNING
+        if connection.vendor == 'postgresql':
+            return True
+        return connection.vendor == 'sqlite' and connection.Database.sqlite_version_info >= (3, 35)
 
-        magic_link.used = True
-        magic_link.save()
+    @staticmethod
+    def _consume_returning(connection, token, cutoff):
+        link_meta, user_meta = MagicLink._meta, User._meta
+        fields = {name: link_meta.get_field(name) for name in ('token', 'created_at', 'used', 'user')}
+        qn = connection.ops.quote_name
+        sql = (
+            f"UPDATE {qn(link_meta.db_table)} SET {qn(fields['used'].column)} = %s "
+            f"WHERE {qn(fields['token'].column)} = %s AND {qn(fields['used'].column)} = %s "
+            f"AND {qn(fields['created_at'].column)} > %s "
+            f"AND EXISTS (SELECT 1 FROM {qn(user_meta.db_table)} "
+            f"WHERE {qn(user_meta.db_table)}.{qn(user_meta.pk.column)} = {qn(link_meta.db_table)}.{qn(fields['user'].column)} "
+            f"AND {qn(user_meta.db_table)}.{qn(user_meta.get_field('is_active').column)} = %s) "
+            f"RETURNING {qn(fields['user'].column)}"
+        )
+        params = [
+            True,
+            fields['token'].get_db_prep_value(token, connection),
+            False,
+            fields['created_at'].get_db_prep_value(cutoff, connection),
+            True,
+        ]
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            row = cursor.fetchone()
+        return user_meta.pk.to_python(row[0]) if row else None
+
+    @staticmethod
+    def issue_tokens(user_id):
+        """
+        Return ``{'access_token', 'refresh_token'}`` for ``user_id`` without database writes.
 
-        # Issue JWT tokens
-        refresh = RefreshToken.for_user(magic_link.user)
+        ``RefreshToken.for_user`` would load the user and insert an
+        OutstandingToken per login. The blacklist app creates that row
+        itself when a token is blacklisted (logout), so it is skipped here.
+        """
+        refresh = RefreshToken()
+        refresh[jwt_settings.USER_ID_CLAIM] = str(user_id)
+        if jwt_settings.CHECK_REVOKE_TOKEN:
+            # The revoke claim is derived from the password hash
+            password = User.objects.filter(pk=user_id).values_list('password', flat=True).first()
+            refresh[jwt_settings.REVOKE_TOKEN_CLAIM] = get_md5_hash_password(password)
         return {
             'access_token': str(refresh.access_token),
             'refresh_token': str(refresh),
         }
 
+    @staticmethod
+    def confirm_magic_link_and_issue_tokens(token):
+        """
+        Verify a magic link token, consume it, and issue JWT tokens.
+        Returns a dict with 'access_token' and 'refresh_token'.
+        """
+        return MagicLinkService.issue_tokens(MagicLinkService.consume_magic_link(token))
+
 
 class TokenService:
     """
@@ -112,12 +193,31 @@ class TokenService:
         """
         try:
             refresh = RefreshToken(refresh_token_str)
+        except TokenError:
+            if TokenService._is_blacklisted(refresh_token_str):
+                metrics.TOKEN_BLACKLIST_HITS.inc()
+                metrics.TOKEN_REFRESHES.labels('blacklisted').inc()
+            else:
+                metrics.TOKEN_REFRESHES.labels('invalid').inc()
+            raise TokenService.InvalidToken
         except Exception:
+            metrics.TOKEN_REFRESHES.labels('invalid').inc()
             raise TokenService.InvalidToken
 
         new_access = str(refresh.access_token)
+        metrics.TOKEN_REFRESHES.labels('success').inc()
         return new_access
 
+    @staticmethod
+    def _is_blacklisted(refresh_token_str):
+        """Whether a rejected refresh token is genuine but blacklisted (as opposed to bad or expired)."""
+        try:
+            payload = token_backend.decode(refresh_token_str, verify=True)
+        except Exception:
+            return False
+        jti = payload.get(jwt_settings.JTI_CLAIM)
+        return jti is not None and BlacklistedToken.objects.filter(token__jti=jti).exists()
+
     @staticmethod
     def blacklist_refresh_token(refresh_token_str):
         """
@@ -0,0 +1,103 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.db import connection
+from prometheus_client import REGISTRY
+from django.test import TestCase
+from django.utils import timezone
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .authentication import CookieJWTAuthentication
+from .models import MagicLink, User
+from .services import MagicLinkService, TokenService
+
+
+class ConsumeMagicLinkTests(TestCase):
+    """Single-use login links: one conditional UPDATE decides the outcome."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('reader@example.com', 'reader@example.com', 'secret')
+
+    def link(self, user=None, **fields):
+        link = MagicLinkService.create_magic_link(user or self.user)
+        if fields:
+            MagicLink.objects.filter(pk=link.pk).update(**fields)
+        return link.token
+
+    def test_first_click_succeeds_and_second_is_expired(self):
+        token = self.link()
+        self.assertEqual(MagicLinkService.consume_magic_link(token), self.user.pk)
+        with self.assertRaises(MagicLinkService.ExpiredMagicLink):
+            MagicLinkService.consume_magic_link(token)
+
+    def test_expired_link(self):
+        token = self.link(created_at=timezone.now() - timedelta(days=1))
+        with self.assertRaises(MagicLinkService.ExpiredMagicLink):
+            MagicLinkService.consume_magic_link(token)
+        self.assertFalse(MagicLink.objects.get(pk=token).used)
+
+    def test_inactive_user(self):
+        inactive = User.objects.create_user('gone@example.com', 'gone@example.com', is_active=False)
+        token = self.link(inactive)
+        with self.assertRaises(MagicLinkService.InvalidMagicLink):
+            MagicLinkService.consume_magic_link(token)
+        self.assertFalse(MagicLink.objects.get(pk=token).used)
+
+    def test_malformed_and_unknown_tokens(self):
+        for token in ('not-a-uuid', '', '00000000-0000-0000-0000-000000000000'):
+            with self.subTest(token=token), self.assertRaises(MagicLinkService.InvalidMagicLink):
+                MagicLinkService.consume_magic_link(token)
+
+    def test_update_returning_is_chosen_by_vendor(self):
+        expected = connection.vendor == 'postgresql' or (
+            connection.vendor == 'sqlite' and connection.Database.sqlite_version_info >= (3, 35)
+        )
+        self.assertEqual(MagicLinkService._can_update_returning(connection), expected)
+        with mock.patch.object(connection, 'vendor', 'mysql'):
+            self.assertFalse(MagicLinkService._can_update_returning(connection))
+
+    def test_fallback_path_consumes_once(self):
+        token = self.link()
+        with mock.patch.object(MagicLinkService, '_can_update_returning', return_value=False):
+            self.assertEqual(MagicLinkService.consume_magic_link(token), self.user.pk)
+            with self.assertRaises(MagicLinkService.ExpiredMagicLink):
+                MagicLinkService.consume_magic_link(token)
+
+    def test_tokens_with_revoke_claim_authenticate(self):
+        with mock.patch.object(jwt_settings, 'CHECK_REVOKE_TOKEN', True):
+            tokens = MagicLinkService.confirm_magic_link_and_issue_tokens(self.link())
+            user, validated = CookieJWTAuthentication()._authenticate_token(tokens['access_token'])
+            self.assertEqual(user.pk, self.user.pk)
+            self.assertIn(jwt_settings.REVOKE_TOKEN_CLAIM, validated)
+            # Changing the password revokes them
+            self.user.set_password('changed')
+            self.user.save()
+            self.assertIsNone(CookieJWTAuthentication()._authenticate_token(tokens['access_token']))
+
+
+class RefreshTokenTests(TestCase):
+    """Refresh outcomes are counted by what went wrong, not by error wording."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('reader@example.com', 'reader@example.com')
+
+    def refreshes(self, result):
+        return REGISTRY.get_sample_value('auth_token_refresh_total', {'result': result}) or 0
+
+    def test_blacklisted_token_is_counted_as_blacklisted(self):
+        refresh = RefreshToken.for_user(self.user)
+        self.assertTrue(TokenService.refresh_access_token(str(refresh)))
+        TokenService.blacklist_refresh_token(str(refresh))
+        before = self.refreshes('blacklisted')
+        with self.assertRaises(TokenService.InvalidToken):
+            TokenService.refresh_access_token(str(refresh))
+        self.assertEqual(self.refreshes('blacklisted'), before + 1)
+
+    def test_bad_token_is_counted_as_invalid(self):
+        before = self.refreshes('invalid'), self.refreshes('blacklisted')
+        with self.assertRaises(TokenService.InvalidToken):
+            TokenService.refresh_access_token('not-a-token')
+        self.assertEqual((self.refreshes('invalid'), self.refreshes('blacklisted')), (before[0] + 1, before[1]))
@@ -129,7 +129,7 @@ class SessionView(APIView):
 
     def get(self, request, *args, **kwargs):
         # Debug: inspect incoming cookies and header
-        logger.debug("SessionView GET called. cookies=%s HTTP_COOKIE=%s", request.COOKIES, request.META.get('HTTP_COOKIE'))
+        logger.debug("SessionView GET called. cookies=%s", sorted(request.COOKIES))
         user = request.user
         logger.debug("SessionView authentication status: user.is_authenticated=%s", user.is_authenticated)
         if user.is_authenticated:
@@ -151,7 +151,7 @@ class TokenRefreshView(APIView):
 
     def initial(self, request, *args, **kwargs):
         # Log entry into the refresh endpoint and incoming cookies
-        logger.debug("TokenRefreshView initial, cookies=%s", request.COOKIES)
+        logger.debug("TokenRefreshView initial, cookies=%s", sorted(request.COOKIES))
         return super().initial(request, *args, **kwargs)
 
     def post(self, request, *args, **kwargs):
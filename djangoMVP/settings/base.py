@@ -63,12 +63,19 @@ INSTALLED_APPS = [
     "rest_framework_simplejwt.token_blacklist",
 
     # "api",  # removed: models moved to apps.risks
+    "apps.core",
     "apps.users",
     "apps.guidelines",
+    "apps.risk_documents",
 
     ]
 
 MIDDLEWARE = [
+    "apps.core.middleware.RequestIdMiddleware",
+    "apps.core.middleware.MetricsMiddleware",
+    "apps.core.middleware.ServerTimingMiddleware",
+    "apps.core.middleware.RequestProfilingMiddleware",
+    "apps.core.middleware.ReplicaPinningMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -101,11 +108,41 @@ TEMPLATES = [
 WSGI_APPLICATION = "djangoMVP.wsgi.application"
 
 # Database (default: SQLite)
+# SQLite production profile for single-node deployments, applied to every SQLite
+# connection: WAL (readers never block on the writer), synchronous=NORMAL (durable
+# at checkpoints, safe against corruption), memory-mapped reads, a larger page
+# cache, in-memory temp tables and a busy timeout. Write transactions start with
+# BEGIN IMMEDIATE so they queue on the busy timeout instead of failing with
+# "database is locked" when a read transaction tries to upgrade to a write.
+# Run `manage.py sqlite_maintenance` periodically (see entrypoint.sh).
+SQLITE_TUNED = os.getenv("SQLITE_TUNED", "true").lower() == "true"
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", 256 * 1024 * 1024))  # bytes
+SQLITE_CACHE_SIZE_KIB = int(os.getenv("SQLITE_CACHE_SIZE_KIB", 32 * 1024))  # per connection
+SQLITE_BUSY_TIMEOUT = int(os.getenv("SQLITE_BUSY_TIMEOUT", 5000))  # milliseconds
+
+
+def sqlite_options(config):
+    """Apply the SQLite production profile to a DATABASES entry (no-op for other engines)."""
+    if not SQLITE_TUNED or config["ENGINE"] != "django.db.backends.sqlite3":
+        return config
+    options = config.setdefault("OPTIONS", {})
+    options.setdefault("transaction_mode", "IMMEDIATE")
+    options.setdefault("init_command", ";".join((
+        "PRAGMA journal_mode=WAL",
+        "PRAGMA synchronous=NORMAL",
+        f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}",
+        f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KIB}",
+        f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT}",
+        "PRAGMA temp_store=MEMORY",
+    )))
+    return config
+
+
 DATABASES = {
-    "default": {
+    "default": sqlite_options({
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
-    }
+    })
 }
 
 # Override with PostgreSQL when specific PostgreSQL host environment variables are set
@@ -123,10 +160,96 @@ DATABASES = {
 #         },
 #     }
 
+# Connection pooling (PostgreSQL, psycopg 3). Each process keeps a pool per
+# database alias; size it to the number of threads per gunicorn worker (the
+# default matches entrypoint.sh's --threads ${GUNICORN_THREADS:-1}).
+DB_POOL = os.getenv("DB_POOL", "true").lower() == "true"
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", 1))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", os.getenv("GUNICORN_THREADS", 1)))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 10))  # seconds to wait for a free connection
+DB_POOL_MAX_LIFETIME = float(os.getenv("DB_POOL_MAX_LIFETIME", 1800))  # seconds before a connection is recycled
+DB_POOL_MAX_IDLE = float(os.getenv("DB_POOL_MAX_IDLE", 600))
+# Set when connecting through PgBouncer in transaction mode: server-side cursors
+# don't survive across transactions there (prepared statements are already off).
+DB_PGBOUNCER = os.getenv("DB_PGBOUNCER", "false").lower() == "true"
+
+
+def database_from_url(url):
+    """Build a DATABASES entry from a URL, applying pooling and health-check settings."""
+    config = dj_database_url.parse(
+        url, conn_max_age=600, conn_health_checks=True, ssl_require=not url.startswith("sqlite"),
+    )
+    if config["ENGINE"] == "django.db.backends.postgresql":
+        if DB_POOL:
+            # Pooling replaces persistent connections; Django rejects CONN_MAX_AGE > 0
+            config["CONN_MAX_AGE"] = 0
+            config.setdefault("OPTIONS", {})["pool"] = {
+                "min_size": DB_POOL_MIN_SIZE,
+                "max_size": DB_POOL_MAX_SIZE,
+                "timeout": DB_POOL_TIMEOUT,
+                "max_lifetime": DB_POOL_MAX_LIFETIME,
+                "max_idle": DB_POOL_MAX_IDLE,
+            }
+        if DB_PGBOUNCER:
+            config["DISABLE_SERVER_SIDE_CURSORS"] = True
+    return sqlite_options(config)
+
+
 # Use DATABASE_URL if provided
 database_url = os.getenv('DATABASE_URL')
 if database_url:
-    DATABASES['default'] = dj_database_url.parse(database_url, conn_max_age=600, ssl_require=True)
+    DATABASES['default'] = database_from_url(database_url)
+
+# Read replicas: comma-separated URLs, registered as replica_1, replica_2, ...
+# Reads of REPLICA_READ_APPS go to a healthy replica; writes and everything else
+# use default. After a write the client reads from the primary for
+# REPLICA_STICKY_SECONDS (see apps.core.db.router).
+DATABASE_REPLICAS = []
+for index, replica_url in enumerate(filter(None, os.getenv("DATABASE_REPLICA_URLS", "").split(",")), start=1):
+    alias = f"replica_{index}"
+    DATABASES[alias] = database_from_url(replica_url.strip())
+    if DATABASES[alias]["ENGINE"] == "django.db.backends.postgresql":
+        # Fail fast so an unreachable replica falls back to the primary quickly
+        DATABASES[alias]["OPTIONS"].setdefault("connect_timeout", 2)
+    DATABASES[alias]["TEST"] = {"MIRROR": "default"}
+    DATABASE_REPLICAS.append(alias)
+REPLICA_READ_APPS = os.getenv("REPLICA_READ_APPS", "guidelines").split(",")  # e.g. "guidelines,sessions,users"
+REPLICA_STICKY_SECONDS = int(os.getenv("REPLICA_STICKY_SECONDS", 5))
+# Writes that don't pin the client to the primary (nobody reads them back at once)
+REPLICA_UNPINNED_MODELS = [
+    "guidelines.GuidelineViewEvent",
+    "guidelines.GuidelineViewDaily",
+    "guidelines.GuidelineHistory",
+]
+REPLICA_HEALTH_CHECK_INTERVAL = int(os.getenv("REPLICA_HEALTH_CHECK_INTERVAL", 10))
+DATABASE_ROUTERS = ["apps.core.db.router.PrimaryReplicaRouter"]
+
+# Caches: the default cache is shared by all workers on a host (file-based), or
+# across hosts when CACHE_URL points at Redis (requires the `redis` package).
+CACHE_URL = os.getenv("CACHE_URL")
+if CACHE_URL and CACHE_URL.startswith(("redis://", "rediss://")):
+    CACHES = {"default": {"BACKEND": "django.core.cache.backends.redis.RedisCache", "LOCATION": CACHE_URL}}
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+            "LOCATION": os.getenv("CACHE_DIR", "/tmp/djangomvp_cache"),
+            "OPTIONS": {"MAX_ENTRIES": 20000},
+        }
+    }
+
+# Guideline detail cache (apps.guidelines.cache): per-worker LRU in front of the shared cache
+GUIDELINE_CACHE_LOCAL_MAXSIZE = int(os.getenv("GUIDELINE_CACHE_LOCAL_MAXSIZE", 1024))
+GUIDELINE_CACHE_LOCAL_TTL = int(os.getenv("GUIDELINE_CACHE_LOCAL_TTL", 60))  # seconds
+GUIDELINE_CACHE_TTL = int(os.getenv("GUIDELINE_CACHE_TTL", 3600))  # seconds, shared tier
+# Per-worker typeahead index (apps.guidelines.suggest) is rebuilt after this
+# many seconds so viewcount ranking stays fresh; writes are applied immediately
+SUGGEST_MAX_AGE = int(os.getenv("SUGGEST_MAX_AGE", 600))
+# Guideline view analytics (apps.guidelines.analytics): per-worker buffers are
+# written after this many views or seconds; trending results are cached
+VIEW_EVENTS_FLUSH_SIZE = int(os.getenv("VIEW_EVENTS_FLUSH_SIZE", 500))
+VIEW_EVENTS_FLUSH_INTERVAL = int(os.getenv("VIEW_EVENTS_FLUSH_INTERVAL", 10))  # seconds
+TRENDING_CACHE_TTL = int(os.getenv("TRENDING_CACHE_TTL", 300))  # seconds
 
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
@@ -151,7 +274,7 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 # Django REST Framework configuration
 REST_FRAMEWORK = {
-    "DEFAULT_RENDERER_CLASSES": ["rest_framework.renderers.JSONRenderer"],
+    "DEFAULT_RENDERER_CLASSES": ["apps.core.renderers.TimedJSONRenderer"],
     "DEFAULT_PARSER_CLASSES": ["rest_framework.parsers.JSONParser"],
     "DEFAULT_AUTHENTICATION_CLASSES": ["apps.users.authentication.CookieJWTAuthentication"],
     "DEFAULT_PERMISSION_CLASSES": ["rest_framework.permissions.IsAuthenticated"],
@@ -212,15 +335,53 @@ AWS_S3_OBJECT_PARAMETERS = {
 AWS_DEFAULT_ACL = None # Default: None (use bucket policy). Or 'public-read' if needed.
 AWS_S3_FILE_OVERWRITE = False # Prevent overwriting files with the same name
 AWS_QUERYSTRING_AUTH = False # Do not add auth parameters to URLs
+# Versioned document keys (<name>_v<n>.<ext>) are never overwritten, so caches may keep them forever
+AWS_S3_IMMUTABLE_CACHE_CONTROL = os.getenv('S3_IMMUTABLE_CACHE_CONTROL_VALUE', 'public, max-age=31536000, immutable')
+
+# Signed document URLs (apps.core.signing), computed locally: None (public bucket),
+# 's3' (SigV4 presigned) or 'cloudfront' (canned policy; needs the cryptography package).
+# URLs are stable for SIGNED_URL_BUCKET_SECONDS and valid for one to two buckets
+# (at most 302400, i.e. 3.5 days, with 's3': presigned URLs can't outlive 7 days).
+DOCUMENT_URL_SIGNING = os.getenv('DOCUMENT_URL_SIGNING') or None
+SIGNED_URL_BUCKET_SECONDS = int(os.getenv('SIGNED_URL_BUCKET_SECONDS', 3600))
+AWS_CLOUDFRONT_KEY_ID = os.getenv('AWS_CLOUDFRONT_KEY_ID')
+AWS_CLOUDFRONT_KEY = os.getenv('AWS_CLOUDFRONT_KEY', '').replace('\\n', '\n') or None
 
 # Static files storage (optional: if you want to serve static files from S3 too)
 # STATICFILES_STORAGE = 'storages.backends.s3boto3.S3Boto3Storage'
 
 # Default file storage
-DEFAULT_FILE_STORAGE = 'storages.backends.s3boto3.S3Boto3Storage'
+# Django 5.1+ only reads STORAGES (DEFAULT_FILE_STORAGE is ignored). The S3 backend
+# is wrapped to record operation latency metrics.
+STORAGES = {
+    "default": {"BACKEND": "apps.core.storage.InstrumentedS3Storage"},
+    "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+}
+# Local stand-in for S3 (development and tests): store files in this directory
+if os.getenv("LOCAL_STORAGE_DIR"):
+    STORAGES["default"] = {
+        "BACKEND": "django.core.files.storage.FileSystemStorage",
+        "OPTIONS": {"location": os.getenv("LOCAL_STORAGE_DIR")},
+    }
+
+# Guideline documents are streamed through /api/guidelines/<id>/document/ from a
+# local LRU disk cache in front of default_storage
+DOCUMENT_CACHE_DIR = os.getenv("DOCUMENT_CACHE_DIR", "/tmp/djangomvp_documents")
+DOCUMENT_CACHE_MAX_BYTES = int(os.getenv("DOCUMENT_CACHE_MAX_BYTES", 2 * 1024 ** 3))
+
+# BM25 guideline search index (apps.guidelines.search), built with
+# `manage.py build_search_index`; must be shared by all workers on the host
+SEARCH_INDEX_DIR = os.getenv("SEARCH_INDEX_DIR", "/tmp/djangomvp_search")
+
+# Local risks/<category>/<group>/<file>.pdf corpus served by apps.risk_documents;
+# the catalogue index is rebuilt with `manage.py build_risk_index`
+RISK_DOCUMENTS_ROOT = os.getenv("RISK_DOCUMENTS_ROOT", str(BASE_DIR / "risks"))
+RISK_DOCUMENTS_INDEX = os.getenv("RISK_DOCUMENTS_INDEX", "/tmp/djangomvp_risk_documents.idx")
 
 # CORS defaults (override per environment)
 CORS_ALLOW_CREDENTIALS = True
+# Starting cursor of the guideline sync feed (apps.guidelines.changes), read by the frontend
+CORS_EXPOSE_HEADERS = ['X-Changes-Cursor']
 
 # Front-end base URL for magic link callback
 FRONTEND_URL = os.getenv("FRONTEND_URL", "http://localhost:3000")
@@ -248,4 +409,54 @@ ACCOUNT_AUTO_SIGNUP = True
 ACCOUNT_LOGOUT_ON_GET = False
 ACCOUNT_EMAIL_SUBJECT_PREFIX = '[Your Site] '
 ACCOUNT_ADAPTER = 'allauth.account.adapter.DefaultAccountAdapter'
-ACCOUNT_PREVENT_ENUMERATION = True
\ No newline at end of file
+ACCOUNT_PREVENT_ENUMERATION = True
+
+# Prometheus metrics (/metrics). Set PROMETHEUS_MULTIPROC_DIR to aggregate across
+# gunicorn workers. Scrapes need METRICS_AUTH_TOKEN as a bearer token; without
+# one the endpoint is only served when DEBUG is on.
+METRICS_AUTH_TOKEN = os.getenv("METRICS_AUTH_TOKEN", None)
+
+# Server-Timing header (auth/db/serialization/render phases) on every response
+SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING_ENABLED", "true").lower() == "true"
+
+# On-demand request profiling: staff fetch a signed token from /api/debug/profile-token/
+PROFILE_STORAGE_DIR = os.getenv("PROFILE_STORAGE_DIR", str(BASE_DIR / "profiles"))
+PROFILE_MAX_STORED = int(os.getenv("PROFILE_MAX_STORED", 200))  # oldest are deleted on save
+PROFILE_TOKEN_MAX_AGE = int(os.getenv("PROFILE_TOKEN_MAX_AGE", 3600))  # seconds
+PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", 2))
+
+# Log the stack of requests still running after this many milliseconds (0 disables)
+SLOW_REQUEST_THRESHOLD_MS = int(os.getenv("SLOW_REQUEST_THRESHOLD_MS", 2000))
+
+# Logging: records go through a queue to a background thread, so request threads
+# never block on log I/O. LOG_FORMAT is "json" (default) or "text"; LOG_SAMPLE_RATES
+# keeps a fraction of DEBUG/INFO records per logger, e.g. "apps.guidelines.views=0.01".
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "filters": {
+        "request_context": {"()": "apps.core.log.RequestContextFilter"},
+        "sampling": {
+            "()": "apps.core.log.SamplingFilter",
+            "rates": os.getenv("LOG_SAMPLE_RATES", ""),
+        },
+    },
+    "formatters": {
+        "json": {"()": "apps.core.log.JSONFormatter"},
+        "text": {"format": "%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s"},
+    },
+    "handlers": {
+        "queue": {
+            "()": "apps.core.log.QueueListenerHandler",
+            "stream": "ext://sys.stdout",
+            "filters": ["request_context", "sampling"],
+            "formatter": os.getenv("LOG_FORMAT", "json"),
+        },
+    },
+    "root": {"handlers": ["queue"], "level": LOG_LEVEL},
+    "loggers": {
+        "django": {"handlers": ["queue"], "level": LOG_LEVEL, "propagate": False},
+        "apps": {"level": os.getenv("APP_LOG_LEVEL", LOG_LEVEL)},
+    },
+}
@@ -0,0 +1,24 @@
+from .base import *
+
+# Settings for `manage.py benchmark`: in-memory SQLite and no external services,
+# so results only reflect the code under test.
+SECRET_KEY = SECRET_KEY or "benchmark-secret-key-not-for-production-use"
+DEBUG = False
+ALLOWED_HOSTS = ["testserver", "localhost"]
+
+DATABASES = {
+    "default": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": ":memory:",
+        "TEST": {"NAME": ":memory:"},
+    }
+}
+
+# Local stand-in for the shared cache
+CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+EMAIL_BACKEND = "django.core.mail.backends.locmem.EmailBackend"
+PASSWORD_HASHERS = ["django.contrib.auth.hashers.MD5PasswordHasher"]
+
+# Where `benchmark run --save NAME` writes NAME.json
+BENCHMARK_BASELINE_DIR = BASE_DIR / "benchmarks"
@@ -17,6 +17,7 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 from api.views import health
+from apps.core.views import metrics_view
 from apps.users.views import (
     ConfirmMagicLinkView,
     RequestMagicLinkView,
@@ -35,6 +36,7 @@ urlpatterns = [
     path('api/auth/csrf/', CSRFCookieView.as_view(), name='api_csrf'),
     path('admin/', admin.site.urls),
     path('health/', health, name='health'),
+    path('metrics', metrics_view, name='metrics'),
     path('accounts/', include('allauth.urls')), # Enable allauth views including account_signup
 
     # Custom logout endpoint to blacklist tokens and clear cookies
@@ -46,5 +48,7 @@ urlpatterns = [
     # API endpoints from users app (Currently only User List)
     path('api/', include('apps.users.urls')), # Includes /api/users/list/
     path('api/', include('apps.guidelines.urls')),
+    path('api/', include('apps.core.urls')),
+    path('api/', include('apps.risk_documents.urls')),
 
 ]
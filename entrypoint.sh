@@ -9,6 +9,17 @@ python manage.py migrate --noinput
 echo "Collecting static files"
 python manage.py collectstatic --noinput
 
+# Prometheus metrics are shared between gunicorn workers through this directory
+export PROMETHEUS_MULTIPROC_DIR="${PROMETHEUS_MULTIPROC_DIR:-/tmp/prometheus_multiproc}"
+mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+
+# Single-node SQLite deployments: checkpoint the WAL and refresh planner
+# statistics every SQLITE_MAINTENANCE_INTERVAL seconds alongside gunicorn
+if [ -n "${SQLITE_MAINTENANCE_INTERVAL}" ]; then
+  echo "Starting SQLite maintenance every ${SQLITE_MAINTENANCE_INTERVAL}s"
+  python manage.py sqlite_maintenance --interval "${SQLITE_MAINTENANCE_INTERVAL}" &
+fi
+
 # Start Gunicorn
 echo "Starting Gunicorn"
-exec gunicorn djangoMVP.wsgi:application --bind 0.0.0.0:8000 --workers ${WEB_CONCURRENCY:-3} --log-level info 
\ No newline at end of file
+exec gunicorn djangoMVP.wsgi:application --bind 0.0.0.0:8000 --workers ${WEB_CONCURRENCY:-3} --threads ${GUNICORN_THREADS:-1} --log-level info 
\ No newline at end of file
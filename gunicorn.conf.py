@@ -0,0 +1,19 @@
+# gunicorn.conf.py
+# Loaded automatically by gunicorn from the working directory (see entrypoint.sh).
+import os
+import shutil
+
+
+def on_starting(server):
+    """Start each deploy with an empty Prometheus multiprocess directory."""
+    path = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if path:
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path, exist_ok=True)
+
+
+def child_exit(server, worker):
+    """Drop live gauges of dead workers; their counters are kept in the aggregate."""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)